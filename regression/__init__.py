@@ -0,0 +1,85 @@
+"""Regression examples of the course as an importable package.
+
+The examples stay in the course directories as scripts that can be run on
+their own. This package loads them on first use, so that
+
+    from regression import returns
+
+gives the functions of predict-returns.py without running its example, and
+without importing more than numpy and pandas until a function needs them.
+
+    alpha_beta  -- u1-intro/project-1/solution/compute_alpha_beta.py
+    experiments -- u3-goodfit/project-2/solution/solve_experiments.py
+    anscombe    -- u3-goodfit/slide-images/src/anscombe.py
+    simulate    -- u3-goodfit/slide-images/src/sim-experiments.py
+    returns     -- u4-multivariate/project-3/solution/predict-returns.py
+    poly        -- u4-multivariate/slide-images/src/fit-poly.py
+
+The code the scripts share lives in modules of the package itself, which
+the scripts import:
+
+    figures     -- figures drawn in parallel, only when their inputs change
+    grouped     -- one linear regression per group, for all the groups at once
+    intervals   -- confidence and prediction intervals for large batches of points
+    lazy        -- modules imported on first use, e.g., statsmodels and matplotlib
+    marketdata  -- cached, concurrent downloads of market data
+    online      -- recursive least squares, updated one observation at a time
+    plotting    -- scatter plots that stay fast for any number of points
+    tidy        -- returns and design matrices of tidy market data, without extra copies
+    tracing     -- opt-in tracing of the stages of a run
+
+Run python -m regression --help for the command line interface.
+"""
+
+import importlib.util
+import os.path
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCRIPTS = {
+    'alpha_beta': ('u1-intro', 'project-1', 'solution', 'compute_alpha_beta.py'),
+    'experiments': ('u3-goodfit', 'project-2', 'solution', 'solve_experiments.py'),
+    'anscombe': ('u3-goodfit', 'slide-images', 'src', 'anscombe.py'),
+    'simulate': ('u3-goodfit', 'slide-images', 'src', 'sim-experiments.py'),
+    'returns': ('u4-multivariate', 'project-3', 'solution', 'predict-returns.py'),
+    'poly': ('u4-multivariate', 'slide-images', 'src', 'fit-poly.py'),
+}
+
+def script_path(name):
+    """Return the path of the script behind one of the modules of this package.
+
+    Arguments:
+        name -- module name, one of the keys of SCRIPTS
+    """
+    return os.path.join(ROOT, *SCRIPTS[name])
+
+def start_tracing():
+    """Turn on stage tracing in all the modules; return the StageTracer they record to.
+
+    See regression.tracing.
+    """
+    from regression import tracing
+    return tracing.start_tracing()
+
+def stop_tracing():
+    """Turn off stage tracing in all the modules; return the tracer, or None if it was off."""
+    from regression import tracing
+    return tracing.stop_tracing()
+
+def __getattr__(name):
+    if name not in SCRIPTS:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    spec = importlib.util.spec_from_file_location(__name__ + "." + name, script_path(name))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[spec.name]
+        raise
+    globals()[name] = module
+    return module
+
+def __dir__():
+    return sorted(set(globals()) | set(SCRIPTS))
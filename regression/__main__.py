@@ -0,0 +1,7 @@
+"""Run the command line interface: python -m regression <command> ..."""
+
+import sys
+
+from regression.cli import main
+
+sys.exit(main())
@@ -0,0 +1,300 @@
+"""Benchmarks of the regression examples on synthetic data.
+
+Each case times one function of the example scripts on generated data of a
+given number of rows and predictors, so the suite runs offline. For every
+case and size it records the best wall time over a few runs, the peak
+memory allocated during a separate traced run and the throughput in rows
+per second. Results are appended to a JSON Lines history, and compared with
+a stored baseline to flag regressions:
+
+    python -m regression bench --sizes 1e3 1e5 1e7 --predictors 1 10 100
+    python -m regression bench --save-baseline
+    python -m regression bench --baseline benchmarks-baseline.json
+"""
+
+import datetime
+import gc
+import io
+import json
+import os
+import os.path
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from regression import ROOT
+
+def price_frames(n, seed=0):
+    """Return a stock and a benchmark of n minutes of random walk prices.
+
+    Arguments:
+        n    -- number of rows
+        seed -- seed of the random numbers
+    """
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2000-01-01', periods=n, freq='min')
+    bench = 100 * np.exp(np.cumsum(rng.normal(0, 0.001, n)))
+    stock = bench * np.exp(np.cumsum(rng.normal(0, 0.001, n)))
+    return (pd.DataFrame({'Adj. Close': stock}, index=index),
+            pd.DataFrame({'Adjusted Close': bench}, index=index))
+
+def tidy_frame(n, p, seed=0):
+    """Return a tidy data frame of stock_ret, p predictors starting with bench_ret, and const.
+
+    Arguments:
+        n    -- number of rows
+        p    -- number of predictors, besides const
+        seed -- seed of the random numbers
+    """
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0, 0.01, (n, p))
+    columns = ['bench_ret'] + [ 'stock_ret_%02d' % i for i in range(1, p) ]
+    df = pd.DataFrame(X, columns=columns, index=pd.date_range('2000-01-01', periods=n, freq='min'))
+    df.insert(0, 'stock_ret', 0.0001 + X.dot(rng.normal(0, 1, p)) + rng.normal(0, 0.01, n))
+    df['const'] = 1
+    return df
+
+def savefig(function, *args, **kwargs):
+    """Draw a figure with a plotting function and render it to memory as PNG."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    function(*args, **kwargs)
+    plt.savefig(io.BytesIO(), format='png')
+    plt.close('all')
+
+def setup_alpha_beta_tidy(n, p):
+    """Benchmark alpha_beta.tidy_data on n rows of stock and benchmark prices."""
+    from regression import alpha_beta
+    stock, bench = price_frames(n)
+    return lambda: alpha_beta.tidy_data(stock, bench)
+
+def setup_alpha_beta_fit(n, p):
+    """Benchmark alpha_beta.do_linear_regression on n rows of stock_ret, bench_ret and const."""
+    from regression import alpha_beta
+    data = tidy_frame(n, 1)
+    return lambda: alpha_beta.do_linear_regression(data)
+
+def setup_alpha_beta_batch(n, p):
+    """Benchmark alpha_beta.do_batch_linear_regression of p columns of n returns on bench_ret."""
+    from regression import alpha_beta
+    data = tidy_frame(n, p)
+    design = data[['bench_ret', 'const']]
+    returns = data.drop(columns=['bench_ret', 'const'])
+    return lambda: alpha_beta.do_batch_linear_regression(returns, design)
+
+def setup_alpha_beta_robust(n, p):
+    """Benchmark alpha_beta.do_batch_robust_linear_regression of p columns of n returns."""
+    from regression import alpha_beta
+    data = tidy_frame(n, p)
+    design = data[['bench_ret', 'const']]
+    returns = data.drop(columns=['bench_ret', 'const'])
+    return lambda: alpha_beta.do_batch_robust_linear_regression(returns, design)
+
+def setup_alpha_beta_plot(n, p):
+    """Benchmark alpha_beta.visualize_linear_regression with bands, of a fit on n rows."""
+    from regression import alpha_beta
+    data = tidy_frame(n, 1)
+    fit = alpha_beta.do_linear_regression(data)
+    return lambda: savefig(alpha_beta.visualize_linear_regression, data, fit, 'Stock', 'Benchmark',
+                           show_std=True)
+
+def setup_returns_tidy(n, p):
+    """Benchmark returns.tidy_data on n rows of prices, with p - 1 lags of the stock returns."""
+    from regression import returns
+    stock, bench = price_frames(n)
+    return lambda: returns.tidy_data(stock, bench, lags=p - 1)
+
+def setup_returns_correlations(n, p):
+    """Benchmark returns.find_correlations on a tidy frame of n rows and p predictors."""
+    from regression import returns
+    data = tidy_frame(n, p)
+    return lambda: returns.find_correlations(data)
+
+def setup_returns_fit(n, p):
+    """Benchmark returns.do_linear_regression on a tidy frame of n rows and p predictors."""
+    from regression import returns
+    data = tidy_frame(n, p)
+    return lambda: returns.do_linear_regression(data)
+
+def setup_experiments_fit(n, p):
+    """Benchmark experiments.do_linear_regression on n simulated rows of the springs experiment."""
+    from regression import experiments, simulate
+    data = pd.DataFrame(simulate.simulate_block('springs', n, seed=0), columns=['distance', 'mass', 'const'])
+    return lambda: experiments.do_linear_regression(data)
+
+def setup_experiments_transformed(n, p):
+    """Benchmark fitting experiments.TransformedRegression to n rows of refraction."""
+    from regression import experiments, simulate
+    data = pd.DataFrame(simulate.simulate_block('refraction', n, seed=0), columns=['beta', 'alpha', 'const'])
+    return lambda: experiments.TransformedRegression(data, {0: 'sin', 1: 'sin'})
+
+def setup_experiments_plot(n, p):
+    """Benchmark the transformed refraction plot of experiments, with bands, of n rows."""
+    from regression import experiments, simulate
+    data = pd.DataFrame(simulate.simulate_block('refraction', n, seed=0), columns=['beta', 'alpha', 'const'])
+    model = experiments.TransformedRegression(data, {0: 'sin', 1: 'sin'})
+    return lambda: savefig(experiments.visualize_linear_regression_with_transformation,
+                           data, model, 'beta', 'alpha', show_std=True)
+
+def setup_poly_fit(n, p):
+    """Benchmark fitting poly.PolynomialRegression of degrees up to p to n noisy points of a sine."""
+    from regression import poly
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 100, n)
+    y = np.sin(x / 10) + rng.normal(0, 0.1, n)
+    return lambda: poly.PolynomialRegression(x, y, p)
+
+# name: (setup, whether the case uses the number of predictors)
+CASES = {
+    'alpha_beta.tidy_data': (setup_alpha_beta_tidy, False),
+    'alpha_beta.do_linear_regression': (setup_alpha_beta_fit, False),
+    'alpha_beta.do_batch_linear_regression': (setup_alpha_beta_batch, True),
+    'alpha_beta.do_batch_robust_linear_regression': (setup_alpha_beta_robust, True),
+    'alpha_beta.visualize_linear_regression': (setup_alpha_beta_plot, False),
+    'returns.tidy_data': (setup_returns_tidy, True),
+    'returns.find_correlations': (setup_returns_correlations, True),
+    'returns.do_linear_regression': (setup_returns_fit, True),
+    'experiments.do_linear_regression': (setup_experiments_fit, False),
+    'experiments.TransformedRegression': (setup_experiments_transformed, False),
+    'experiments.visualize_linear_regression_with_transformation': (setup_experiments_plot, False),
+    'poly.PolynomialRegression': (setup_poly_fit, True),
+}
+
+def measure(function, repeat=5, min_time=0.05):
+    """Return the best and median wall time of function over repeat runs, and its peak memory.
+
+    One untimed call first pays for lazy imports, e.g., of statsmodels. As
+    with timeit, fast functions are then called several times in a row per
+    run, so that each run lasts at least min_time and the times are not
+    lost in the noise; the runs that find that number are not kept. The
+    peak memory comes from one more call under tracemalloc, which numpy and
+    pandas report their arrays to, so tracing does not slow the timed runs.
+
+    Arguments:
+        function -- function of no arguments to measure
+        repeat   -- number of timed runs (default 5)
+        min_time -- shortest run, in seconds (default 0.05)
+    """
+    def run(number):
+        gc.collect()
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        return (time.perf_counter() - start) / number
+
+    # The first call pays for lazy imports and caches, and is not timed
+    function()
+    number = 1
+    elapsed = run(number)
+    while elapsed * number < min_time and number < 10000:
+        number = max(number * 2, min(10000, int(min_time / max(elapsed, 1e-9)) + 1))
+        elapsed = run(number)
+    times = [ run(number) for i in range(repeat) ]
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), float(np.median(times)), peak
+
+def environment():
+    """Return a dict describing the machine, the library versions and the commit."""
+    import statsmodels
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'host': platform.node(), 'machine': platform.machine(), 'cpus': os.cpu_count(),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'statsmodels': statsmodels.__version__, 'commit': commit}
+
+def run_benchmarks(cases=None, sizes=(1000, 100000), predictors=(1, 10), repeat=5,
+                   max_cells=2 * 10 ** 8, progress=None):
+    """Run benchmark cases over a grid of sizes; return a DataFrame with one row per run.
+
+    Cases that do not use predictors run once per size. Sizes whose rows
+    times predictors exceed max_cells are skipped.
+
+    Arguments:
+        cases      -- names of the cases to run (default all of CASES)
+        sizes      -- numbers of rows
+        predictors -- numbers of predictors
+        repeat     -- timed runs of each case (default 5)
+        max_cells  -- largest rows times predictors to run (default 2e8)
+        progress   -- function called with each record as it is measured (default None)
+    """
+    env = environment()
+    stamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
+    records = []
+    for name in (cases or CASES):
+        setup, uses_predictors = CASES[name]
+        for n in sizes:
+            for p in (predictors if uses_predictors else (1,)):
+                if n * p > max_cells:
+                    continue
+                best, median, peak = measure(setup(n, p), repeat)
+                record = dict(env, time=stamp, case=name, rows=n, predictors=p, seconds=best,
+                              median_seconds=median, peak_bytes=peak, rows_per_second=n / best)
+                records.append(record)
+                if progress is not None:
+                    progress(record)
+                gc.collect()
+    return pd.DataFrame(records)
+
+def append_history(fname, results):
+    """Append the records of a DataFrame of results to a JSON Lines history file."""
+    with open(fname, 'a') as f:
+        for record in results.to_dict('records'):
+            f.write(json.dumps(record, default=str) + "\n")
+
+def read_history(fname):
+    """Return a DataFrame of all records of a JSON Lines history file."""
+    return pd.read_json(fname, lines=True)
+
+def save_baseline(fname, results):
+    """Write results as the baseline to compare later runs with, keyed by case, rows and predictors."""
+    baseline = dict(('%s|%d|%d' % (r['case'], r['rows'], r['predictors']), r)
+                    for r in results.to_dict('records'))
+    tmp = fname + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True, default=str)
+    os.replace(tmp, fname)
+
+def compare_baseline(results, fname, tolerance=0.25, min_seconds=0.001):
+    """Compare results with a stored baseline; return the runs found in both.
+
+    A run is flagged as a regression when its time, or its peak memory, is
+    more than tolerance above the baseline. Time differences below
+    min_seconds are ignored as noise.
+
+    Arguments:
+        results     -- DataFrame of results of run_benchmarks
+        fname       -- baseline file written by save_baseline
+        tolerance   -- relative increase flagged (default 0.25)
+        min_seconds -- smallest time difference flagged (default 0.001)
+    """
+    with open(fname) as f:
+        baseline = json.load(f)
+    rows = []
+    for r in results.to_dict('records'):
+        base = baseline.get('%s|%d|%d' % (r['case'], r['rows'], r['predictors']))
+        if base is None:
+            continue
+        time_ratio = r['seconds'] / base['seconds']
+        memory_ratio = r['peak_bytes'] / max(base['peak_bytes'], 1)
+        slower = time_ratio > 1 + tolerance and r['seconds'] - base['seconds'] > min_seconds
+        rows.append({'case': r['case'], 'rows': r['rows'], 'predictors': r['predictors'],
+                     'seconds': r['seconds'], 'base_seconds': base['seconds'], 'time_ratio': time_ratio,
+                     'peak_bytes': r['peak_bytes'], 'base_peak_bytes': base['peak_bytes'],
+                     'memory_ratio': memory_ratio,
+                     'regression': slower or memory_ratio > 1 + tolerance})
+    return pd.DataFrame(rows, columns=['case', 'rows', 'predictors', 'seconds', 'base_seconds',
+                                       'time_ratio', 'peak_bytes', 'base_peak_bytes',
+                                       'memory_ratio', 'regression'])
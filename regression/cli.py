@@ -0,0 +1,283 @@
+"""Command line interface to the regression examples.
+
+    python -m regression fetch WIKI/AAPL YAHOO/INDEX_GSPC
+    python -m regression tidy WIKI/WMT YAHOO/INDEX_GSPC --lags 10 -o wmt-sp500.csv
+    python -m regression fit wmt-sp500.csv --select bic
+    python -m regression --trace fit.json fit wmt-sp500.csv
+    python -m regression plot wmt-sp500.csv -x bench_ret stock_ret_01 -o img
+    python -m regression report WIKI/AAPL WIKI/WMT --benchmark YAHOO/INDEX_GSPC -o report
+    python -m regression report WIKI/AAPL WIKI/WMT --bootstrap 10000 --bootstrap-method stationary
+    python -m regression report WIKI/AAPL WIKI/WMT --robust tukey
+    python -m regression bench --sizes 1e3 1e5 1e7 --predictors 1 10 100 --baseline benchmarks-baseline.json
+
+Only the standard library is imported up front. Each command loads the
+script modules it needs, and those defer statsmodels, matplotlib and quandl
+until they are used, so fetch, tidy and fit never import matplotlib.
+"""
+
+import argparse
+import os
+import os.path
+import sys
+
+def read_tidy_data(fname):
+    """Read a tidy data frame written by the tidy command.
+
+    Arguments:
+        fname -- name of the CSV file, or - for standard input
+    """
+    import pandas as pd
+    return pd.read_csv(sys.stdin if fname == "-" else fname, index_col=0, parse_dates=True)
+
+def get_data(args, qtickers):
+    """Return the market data of the tickers through the cache, and the failures.
+
+    Arguments:
+        args     -- parsed arguments with start, end, cache_dir, workers and api_key
+        qtickers -- list of tickers in Quandl format
+    """
+    from regression import marketdata
+    os.makedirs(args.cache_dir, exist_ok=True)
+    marketdata.migrate_csv_cache(args.cache_dir)
+    source = marketdata.make_quandl_http_source(api_key=args.api_key,
+                                                max_connections=args.workers)
+    data, failures = marketdata.get_bulk_data_from_quandl(qtickers, args.start, args.end,
+                                                          cache=True, source=source,
+                                                          max_workers=args.workers,
+                                                          cache_dir=args.cache_dir)
+    for qticker, e in sorted(failures.items()):
+        print("%s: %s" % (qticker, e), file=sys.stderr)
+    return data, failures
+
+def fit_tidy_data(data, columns=None, select=None):
+    """Fit stock_ret of a tidy data frame; return the predictor columns and the fit.
+
+    Arguments:
+        data    -- a tidy DataFrame, with columns stock_ret, ..., const
+        columns -- predictor columns to use (default all)
+        select  -- 'aic', 'bic' or 'adjr2' to choose among the columns (default None)
+    """
+    from regression import returns
+    if columns:
+        data = data[['stock_ret'] + [ col for col in columns if col != 'stock_ret' ]]
+    if select is not None:
+        return returns.select_features(data, criterion=select)
+    return ([ col for col in data.columns if col != 'stock_ret' ],
+            returns.do_linear_regression(data))
+
+def fetch(args):
+    """Download the tickers into the cache and list what it holds."""
+    data, failures = get_data(args, args.tickers)
+    for qticker in sorted(data):
+        df = data[qticker]
+        first, last = (df.index[0].date(), df.index[-1].date()) if len(df) else ("-", "-")
+        print("%s\t%d rows\t%s\t%s" % (qticker, len(df), first, last))
+    return 1 if failures else 0
+
+def tidy(args):
+    """Write the tidy data frame of a stock and a benchmark as CSV."""
+    from regression import returns
+    data, failures = get_data(args, [args.stock, args.benchmark])
+    if failures:
+        return 1
+    df = returns.tidy_data(data[args.stock], data[args.benchmark],
+                           lags=args.lags, bench_lags=args.bench_lags)
+    df.to_csv(sys.stdout if args.output == "-" else args.output)
+    return 0
+
+def fit(args):
+    """Print the summary of a linear regression on a tidy data frame."""
+    columns, result = fit_tidy_data(read_tidy_data(args.data), args.columns, args.select)
+    if args.select is not None:
+        print("Selected by %s: %s" % (args.select, ", ".join(columns)))
+    print(result.summary())
+    return 0
+
+def plot(args):
+    """Draw the single-parameter figures of a fit on a tidy data frame."""
+    from regression import figures as pipeline, returns
+    data = read_tidy_data(args.data)
+    columns, result = fit_tidy_data(data, args.columns, args.select)
+    data = data[['stock_ret'] + columns]
+    os.makedirs(args.output, exist_ok=True)
+    figures = []
+    for x in args.x:
+        figures.append(pipeline.figure_task(os.path.join(args.output, 'lr-single-%s.png' % x),
+                                            returns.visualize_single_parameter,
+                                            data, result, args.stock, x, x=x))
+        figures.append(pipeline.figure_task(os.path.join(args.output, 'lr-isolated-%s.png' % x),
+                                            returns.visualize_single_isolated_parameter,
+                                            data, result, args.stock, x, x=x))
+    figure_times = pipeline.build_figures(figures, max_workers=args.processes, force=args.force)
+    print(figure_times)
+    return 1 if (figure_times['status'] == 'failed').any() else 0
+
+def report(args):
+    """Compute alpha and beta of many stocks against a benchmark, with their figures."""
+    import pandas as pd
+    from regression import alpha_beta, figures as pipeline
+    data, failures = get_data(args, args.tickers + [args.benchmark])
+    if args.benchmark not in data:
+        return 1
+    benchmark = data[args.benchmark]
+    tickers = [ qticker for qticker in args.tickers if qticker in data ]
+    if not tickers:
+        return 1
+    names = [ qticker.split("/")[-1] for qticker in tickers ]
+    # On the dates of the benchmark, so all stocks share one design
+    tidy = dict((name, alpha_beta.tidy_data(data[qticker].reindex(benchmark.index), benchmark))
+                for qticker, name in zip(tickers, names))
+    returns = pd.DataFrame(dict((name, tidy[name]['stock_ret']) for name in names),
+                           index=benchmark.index, columns=names)
+    design = tidy[names[0]][['bench_ret', 'const']]
+    fits = alpha_beta.do_batch_linear_regression(returns, design)
+
+    os.makedirs(args.output, exist_ok=True)
+    fits.to_csv(os.path.join(args.output, 'alpha-beta.csv'))
+    print(fits)
+    if args.robust:
+        robust_fits = alpha_beta.do_batch_robust_linear_regression(returns, design, args.robust, start=fits)
+        robust_fits.to_csv(os.path.join(args.output, 'alpha-beta-robust.csv'))
+        print(robust_fits)
+    if args.bootstrap:
+        intervals = alpha_beta.bootstrap_alpha_beta_universe(returns, design, resamples=args.bootstrap,
+                                                             method=args.bootstrap_method,
+                                                             seed=args.seed, max_workers=args.processes)
+        intervals.to_csv(os.path.join(args.output, 'bootstrap.csv'))
+        print(intervals)
+    if not args.no_plots:
+        bench_name = args.benchmark.split("/")[-1]
+        figures = []
+        for name in names:
+            fit = alpha_beta.do_linear_regression(tidy[name])
+            figures.append(pipeline.figure_task(os.path.join(args.output, '%s-lr-plot.png' % name),
+                                                alpha_beta.visualize_linear_regression,
+                                                tidy[name], fit, name, bench_name, show_std=True))
+        figure_times = pipeline.build_figures(figures, max_workers=args.processes, force=args.force)
+        print(figure_times)
+        if (figure_times['status'] == 'failed').any():
+            return 1
+    return 1 if failures else 0
+
+def bench(args):
+    """Time the functions of the examples on synthetic data, and compare with a baseline."""
+    from regression import benchmarks
+    def progress(record):
+        print("%-60s %10d %4d %10.4fs %12d B" % (record['case'], record['rows'], record['predictors'],
+                                                 record['seconds'], record['peak_bytes']), file=sys.stderr)
+    results = benchmarks.run_benchmarks(args.cases, [ int(float(n)) for n in args.sizes ], args.predictors,
+                                        repeat=args.repeat, progress=progress)
+    benchmarks.append_history(args.history, results)
+    print(results[['case', 'rows', 'predictors', 'seconds', 'peak_bytes', 'rows_per_second']].to_string())
+    if args.save_baseline:
+        benchmarks.save_baseline(args.baseline, results)
+    elif os.path.exists(args.baseline):
+        comparison = benchmarks.compare_baseline(results, args.baseline, args.tolerance)
+        print(comparison.to_string())
+        if comparison['regression'].any():
+            print("Regressions against %s:" % args.baseline, file=sys.stderr)
+            print(comparison[comparison['regression']][['case', 'rows', 'predictors', 'time_ratio',
+                                                        'memory_ratio']].to_string(), file=sys.stderr)
+            return 1
+    return 0
+
+def make_parser():
+    """Create the argument parser with one subcommand per step of the analysis."""
+    market = argparse.ArgumentParser(add_help=False)
+    market.add_argument("--start", default="2016-01-01", help="first date (default %(default)s)")
+    market.add_argument("--end", default="2016-12-31", help="last date (default %(default)s)")
+    market.add_argument("--cache-dir", default=os.path.join("data", "cache"),
+                        help="directory of the local cache (default %(default)s)")
+    market.add_argument("--api-key", default=os.environ.get("QUANDL_API_KEY"),
+                        help="Quandl API key (default $QUANDL_API_KEY)")
+    market.add_argument("--workers", type=int, default=8,
+                        help="tickers fetched at the same time (default %(default)s)")
+
+    model = argparse.ArgumentParser(add_help=False)
+    model.add_argument("data", help="tidy CSV file written by tidy, or - for standard input")
+    model.add_argument("--columns", nargs="+", metavar="COLUMN",
+                       help="predictor columns (default all but stock_ret)")
+    model.add_argument("--select", choices=["aic", "bic", "adjr2"],
+                       help="choose the predictors by this criterion")
+
+    figures = argparse.ArgumentParser(add_help=False)
+    figures.add_argument("--force", action="store_true", help="redraw figures even if unchanged")
+    figures.add_argument("--processes", type=int,
+                         help="processes drawing figures (default the number of cores)")
+
+    parser = argparse.ArgumentParser(prog="python -m regression", description=__doc__.split("\n")[0])
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record the time and memory of each stage to a Chrome trace JSON file")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    p = commands.add_parser("fetch", parents=[market], help=fetch.__doc__)
+    p.add_argument("tickers", nargs="+", metavar="TICKER", help="ticker in Quandl format, e.g., WIKI/AAPL")
+    p.set_defaults(func=fetch)
+
+    p = commands.add_parser("tidy", parents=[market], help=tidy.__doc__)
+    p.add_argument("stock", help="ticker of the stock, e.g., WIKI/WMT")
+    p.add_argument("benchmark", help="ticker of the benchmark, e.g., YAHOO/INDEX_GSPC")
+    p.add_argument("--lags", type=int, default=0, help="lagged stock returns (default %(default)s)")
+    p.add_argument("--bench-lags", type=int, default=0, help="lagged benchmark returns (default %(default)s)")
+    p.add_argument("-o", "--output", default="-", help="CSV file to write (default standard output)")
+    p.set_defaults(func=tidy)
+
+    p = commands.add_parser("fit", parents=[model], help=fit.__doc__)
+    p.set_defaults(func=fit)
+
+    p = commands.add_parser("plot", parents=[model, figures], help=plot.__doc__)
+    p.add_argument("-x", nargs="+", default=["bench_ret"], metavar="COLUMN",
+                   help="predictors to draw (default bench_ret)")
+    p.add_argument("--stock", default="Stock", help="name of the stock on the axes")
+    p.add_argument("-o", "--output", default="img", help="directory of the figures (default %(default)s)")
+    p.set_defaults(func=plot)
+
+    p = commands.add_parser("report", parents=[market, figures], help=report.__doc__)
+    p.add_argument("tickers", nargs="+", metavar="TICKER", help="tickers of the stocks")
+    p.add_argument("--benchmark", default="YAHOO/INDEX_GSPC", help="ticker of the benchmark (default %(default)s)")
+    p.add_argument("-o", "--output", default="report", help="directory of the report (default %(default)s)")
+    p.add_argument("--no-plots", action="store_true", help="only write alpha-beta.csv")
+    p.add_argument("--bootstrap", type=int, default=0, metavar="RESAMPLES",
+                   help="also write bootstrap intervals of alpha and beta to bootstrap.csv")
+    p.add_argument("--bootstrap-method", choices=["iid", "block", "stationary"], default="iid",
+                   help="resampling of the bootstrap (default %(default)s)")
+    p.add_argument("--seed", type=int, default=0, help="seed of the bootstrap (default %(default)s)")
+    p.add_argument("--robust", choices=["huber", "tukey"],
+                   help="also write a robust fit with this norm to alpha-beta-robust.csv")
+    p.set_defaults(func=report)
+
+    p = commands.add_parser("bench", help=bench.__doc__)
+    p.add_argument("--cases", nargs="+", metavar="CASE", help="cases to run (default all)")
+    p.add_argument("--sizes", nargs="+", default=["1e3", "1e5"], metavar="ROWS",
+                   help="numbers of rows (default %(default)s)")
+    p.add_argument("--predictors", nargs="+", type=int, default=[1, 10], metavar="P",
+                   help="numbers of predictors (default %(default)s)")
+    p.add_argument("--repeat", type=int, default=5, help="timed runs of each case (default %(default)s)")
+    p.add_argument("--history", default="benchmarks.jsonl",
+                   help="JSON Lines file the results are appended to (default %(default)s)")
+    p.add_argument("--baseline", default="benchmarks-baseline.json",
+                   help="baseline to compare with, if it exists (default %(default)s)")
+    p.add_argument("--save-baseline", action="store_true", help="store the results as the baseline")
+    p.add_argument("--tolerance", type=float, default=0.25,
+                   help="relative slowdown or memory growth flagged (default %(default)s)")
+    p.set_defaults(func=bench)
+    return parser
+
+def main(argv=None):
+    """Run a command; return the exit status.
+
+    Arguments:
+        argv -- command line arguments (default sys.argv[1:])
+    """
+    args = make_parser().parse_args(argv)
+    if not args.trace:
+        return args.func(args)
+    import regression
+    tracer = regression.start_tracing()
+    try:
+        return args.func(args)
+    finally:
+        regression.stop_tracing()
+        tracer.write_chrome_trace(args.trace)
+        print(tracer.summary().to_string(), file=sys.stderr)
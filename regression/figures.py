@@ -0,0 +1,208 @@
+"""Figures of the examples as tasks, drawn in parallel and only when their inputs change.
+
+A script declares each figure with figure_task, the file it is saved to
+and the plotting call that draws it, and hands the list to build_figures.
+The inputs of every figure are hashed, and a manifest next to the figures
+records the hashes of the last build, so only new and changed figures are
+drawn, in a pool of processes on the Agg backend:
+
+    figures = [ figure_task('img/scatter-plot.png', visualize_data, data) ]
+    print(build_figures(figures))
+"""
+
+import concurrent.futures
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+import os.path
+import time
+import types
+import numpy as np
+import pandas as pd
+
+from regression.tracing import get_tracer, trace_stage, traced
+
+def figure_task(path, function, *args, **kwargs):
+    """Declare a figure: the output path and the plotting call that draws it.
+
+    Arguments:
+        path     -- file name the figure is saved to
+        function -- plotting function that draws on the current figure
+        args     -- positional arguments of the plotting function
+        kwargs   -- keyword arguments of the plotting function
+    """
+    return types.SimpleNamespace(path=path, function=function, args=args, kwargs=kwargs)
+
+def content_hash(digest, value):
+    """Feed a plotting input into a hashlib digest.
+
+    DataFrames, Series and arrays are hashed by content, fits by their
+    parameters and covariance, and functions by their name and bytecode,
+    so that editing a plotting function also invalidates its figures. Other
+    objects, e.g., a PolynomialRegression, are hashed by their class and
+    attributes, and scalars by their repr; anything else raises TypeError.
+
+    Arguments:
+        digest -- a hashlib object
+        value  -- the input to hash
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        labels = list(value.columns) if isinstance(value, pd.DataFrame) else value.name
+        digest.update(repr(labels).encode())
+        digest.update(pd.util.hash_pandas_object(value, index=True).values.tobytes())
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode())
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        digest.update(b'(')
+        for item in value:
+            content_hash(digest, item)
+        digest.update(b')')
+    elif isinstance(value, dict):
+        for key in sorted(value):
+            digest.update(repr(key).encode())
+            content_hash(digest, value[key])
+    elif hasattr(value, 'params') and hasattr(value, 'cov_params'):
+        content_hash(digest, value.params)
+        content_hash(digest, np.asarray(value.cov_params()))
+    elif hasattr(value, '__code__'):
+        digest.update(value.__qualname__.encode())
+        digest.update(value.__code__.co_code)
+        digest.update(repr([ const for const in value.__code__.co_consts
+                             if not hasattr(const, 'co_code') ]).encode())
+    elif callable(value):
+        digest.update(repr((getattr(value, '__module__', None),
+                            getattr(value, '__qualname__', None))).encode())
+    elif isinstance(value, (str, bytes, int, float, complex, type(None), np.generic)):
+        digest.update(repr(value).encode())
+    elif hasattr(value, '__dict__'):
+        # The default repr holds the address of the object, which changes every run
+        digest.update(repr((type(value).__module__, type(value).__qualname__)).encode())
+        content_hash(digest, vars(value))
+    elif ' at 0x' not in repr(value):
+        digest.update(repr(value).encode())
+    else:
+        raise TypeError("can't hash a figure input of type %s" % type(value).__name__)
+
+def figure_hash(task):
+    """Return the hex digest of everything that goes into a figure.
+
+    Arguments:
+        task -- a figure_task
+    """
+    digest = hashlib.sha1()
+    content_hash(digest, [ os.path.basename(task.path), task.function, task.args, task.kwargs ])
+    return digest.hexdigest()
+
+def read_figure_manifest(fname):
+    """Return the dict of figure path to input hash recorded by the last build.
+
+    Arguments:
+        fname -- name of the manifest file
+    """
+    if not os.path.exists(fname):
+        return {}
+    with open(fname) as f:
+        return json.load(f)
+
+def write_figure_manifest(fname, manifest):
+    """Write the figure manifest, replacing the old one only once it is complete.
+
+    Arguments:
+        fname    -- name of the manifest file
+        manifest -- dict of figure path to input hash
+    """
+    tmp = fname + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp, fname)
+
+_figure_tasks = []
+
+def render_figure(index):
+    """Draw and save a figure in a worker process; return the seconds it took and its trace events.
+
+    The task is looked up in the list inherited from the parent process, so
+    its data is never pickled.
+
+    Arguments:
+        index -- position of the task in the list given to build_figures
+    """
+    task = _figure_tasks[index]
+    # The tracer forked from the parent already holds its events, so only
+    # the ones of this figure are sent back
+    tracer = get_tracer()
+    first = len(tracer.events) if tracer is not None else 0
+    start = time.perf_counter()
+    plt = importlib.import_module('matplotlib.pyplot')
+    plt.switch_backend('Agg')
+    try:
+        with trace_stage('plot', os.path.basename(task.path)):
+            task.function(*task.args, **task.kwargs)
+            with trace_stage('plot', 'savefig'):
+                plt.savefig(task.path)
+    finally:
+        plt.close('all')
+    return time.perf_counter() - start, (tracer.events[first:] if tracer is not None else [])
+
+@traced('plot')
+def build_figures(tasks, manifest=None, max_workers=None, force=False):
+    """Render the figures whose inputs changed since the last build, in parallel.
+
+    A figure is skipped when its file exists and the hash of its data, fit and
+    plotting function matches the one in the manifest. The rest are rendered
+    in a process pool on the Agg backend. A figure that fails to render is
+    reported and left out of the manifest, so the next build retries it.
+    Returns a DataFrame indexed by figure path with the status ('rendered',
+    'skipped' or 'failed'), the seconds spent on each figure and the error.
+
+    Arguments:
+        tasks       -- list of figure_task
+        manifest    -- name of the manifest file (default .figures.json next to the first figure)
+        max_workers -- number of processes (default the number of cores)
+        force       -- render every figure even if unchanged (default False)
+    """
+    global _figure_tasks
+    tracer = get_tracer()
+    if not tasks:
+        return pd.DataFrame({'status': [], 'seconds': [], 'error': []}, columns=['status', 'seconds', 'error'])
+    if manifest is None:
+        manifest = os.path.join(os.path.dirname(tasks[0].path), ".figures.json")
+    hashes = read_figure_manifest(manifest)
+    keys = [ figure_hash(task) for task in tasks ]
+    pending = [ i for i, task in enumerate(tasks)
+                if force or hashes.get(task.path) != keys[i] or not os.path.exists(task.path) ]
+    seconds = np.zeros(len(tasks))
+    status = np.array([ 'skipped' ] * len(tasks), dtype=object)
+    errors = np.array([ None ] * len(tasks), dtype=object)
+
+    # Workers are forked so that they inherit the tasks, and the functions
+    # of the scripts even when they were loaded by path rather than imported
+    _figure_tasks = tasks
+    try:
+        if pending:
+            # Import pyplot before forking, rather than once in every worker
+            importlib.import_module('matplotlib.pyplot')
+            context = multiprocessing.get_context("fork")
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+                futures = dict((executor.submit(render_figure, i), i) for i in pending)
+                for future in concurrent.futures.as_completed(futures):
+                    i = futures[future]
+                    try:
+                        seconds[i], events = future.result()
+                    except Exception as e:
+                        status[i], errors[i] = 'failed', repr(e)
+                        hashes.pop(tasks[i].path, None)
+                        continue
+                    status[i] = 'rendered'
+                    if tracer is not None:
+                        tracer.events.extend(events)
+                    hashes[tasks[i].path] = keys[i]
+    finally:
+        _figure_tasks = []
+        write_figure_manifest(manifest, hashes)
+    return pd.DataFrame({'status': status, 'seconds': seconds, 'error': errors},
+                        index=[ task.path for task in tasks ], columns=['status', 'seconds', 'error'])
+
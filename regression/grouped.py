@@ -0,0 +1,112 @@
+"""One linear regression per group, for all the groups at once, e.g., Anscombe's quartet.
+
+do_grouped_linear_regression takes a long DataFrame with a group column,
+or a list or dict of DataFrames, and returns the coefficients and the
+diagnostics of every group as one DataFrame:
+
+    fits = do_grouped_linear_regression(data, by='dataset')
+"""
+
+import numpy as np
+import pandas as pd
+
+from regression.tracing import traced
+
+@traced('fit')
+def do_grouped_linear_regression(data, by=None, response=None, predictors=None):
+    """Perform one linear regression per group, for all groups at once.
+
+    Rows are sorted by group, and the Gram matrices, coefficients, residuals
+    and diagnostics of every group come out of the same stacked array
+    operations, so many small fits cost about as much as one large fit.
+    Rows with missing values are dropped, as with missing='drop'.
+
+    Returns a DataFrame with one row per group and the columns: for each
+    predictor its coefficient and its standard error <predictor>_se, then
+    nobs, df_resid, rsquared, rsquared_adj, resid_std, durbin_watson, skew
+    and kurtosis of the residuals, max_leverage and max_cooks_d, the largest
+    Cook's distance among the points with leverage below 1.
+
+    Arguments:
+        data       -- a long DataFrame with a group column, or a list or dict of DataFrames,
+                      one per group, whose columns are matched by position
+        by         -- name of the group column of a long DataFrame
+        response   -- name of the response column (default the first column)
+        predictors -- names of the predictor columns (default the other columns)
+    """
+    if isinstance(data, (list, tuple, dict)):
+        frames = data if isinstance(data, dict) else dict(enumerate(data))
+        labels = pd.Index(list(frames))
+        names = list(frames[labels[0]].columns)
+        if any(list(frame.columns) != names for frame in frames.values()):
+            names = ['y'] + [ 'x%d' % i for i in range(1, len(names)) ]
+        codes = np.repeat(np.arange(len(frames)), [ len(frame) for frame in frames.values() ])
+        data = pd.DataFrame(np.concatenate([ frame.values for frame in frames.values() ]).astype(float),
+                            columns=names)
+    else:
+        codes, labels = pd.factorize(data[by])
+        labels = pd.Index(labels, name=by)
+    columns = [ col for col in data.columns if col != by ]
+    response = columns[0] if response is None else response
+    predictors = [ col for col in columns if col != response ] if predictors is None else list(predictors)
+    y = data[response].values.astype(float)
+    X = data[predictors].values.astype(float)
+
+    keep = ~(np.isnan(y) | np.isnan(X).any(axis=1)) & (codes >= 0)
+    order = np.argsort(codes[keep], kind='stable')
+    y, X, codes = y[keep][order], X[keep][order], codes[keep][order]
+    k, p = len(labels), X.shape[1]
+
+    gram = np.empty((k, p, p))
+    for i in range(p):
+        for j in range(i, p):
+            gram[:, i, j] = gram[:, j, i] = np.bincount(codes, X[:, i] * X[:, j], k)
+    xty = np.column_stack([ np.bincount(codes, X[:, i] * y, k) for i in range(p) ])
+    gram_inv = np.linalg.pinv(gram)
+    params = np.einsum('kij,kj->ki', gram_inv, xty)
+    resid = y - np.einsum('ni,ni->n', X, params[codes])
+
+    nobs = np.bincount(codes, minlength=k)
+    df_resid = nobs - np.linalg.matrix_rank(gram)
+    ssr = np.bincount(codes, resid ** 2, k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ybar = np.bincount(codes, y, k) / nobs
+        tss = np.bincount(codes, (y - ybar[codes]) ** 2, k)
+        scale = np.where(df_resid > 0, ssr / df_resid, np.nan)
+        bse = np.sqrt(scale[:, None] * np.diagonal(gram_inv, axis1=1, axis2=2))
+        rsquared = 1 - ssr / tss
+        rsquared_adj = 1 - (nobs - 1) / df_resid * (1 - rsquared)
+
+        # Durbin-Watson uses the differences of consecutive residuals within a group
+        same = codes[1:] == codes[:-1]
+        durbin_watson = np.bincount(codes[1:][same], np.diff(resid)[same] ** 2, k) / ssr
+        centered = resid - (np.bincount(codes, resid, k) / nobs)[codes]
+        m2, m3, m4 = [ np.bincount(codes, centered ** i, k) / nobs for i in (2, 3, 4) ]
+        skew = m3 / m2 ** 1.5
+        kurtosis = m4 / m2 ** 2
+        # The residuals of an exact fit are rounding errors
+        exact = df_resid <= 0
+        durbin_watson[exact] = skew[exact] = kurtosis[exact] = np.nan
+
+        leverage = np.einsum('ni,nij,nj->n', X, gram_inv[codes], X)
+        # A point with leverage 1 is fitted exactly, and has no Cook's distance
+        cooks_d = np.where(leverage < 1 - 1e-8,
+                           resid ** 2 / (p * scale[codes]) * leverage / (1 - leverage) ** 2, np.nan)
+    max_leverage = np.full(k, np.nan)
+    max_cooks_d = np.full(k, np.nan)
+    present = nobs > 0
+    starts = np.concatenate([[0], np.cumsum(nobs)[:-1]])[present]
+    if len(y):
+        max_leverage[present] = np.maximum.reduceat(leverage, starts)
+        max_cooks_d[present] = np.fmax.reduceat(cooks_d, starts)
+
+    result = pd.DataFrame(index=labels)
+    for i, name in enumerate(predictors):
+        result[name] = params[:, i]
+        result[name + '_se'] = bse[:, i]
+    for name, values in [('nobs', nobs), ('df_resid', df_resid), ('rsquared', rsquared),
+                         ('rsquared_adj', rsquared_adj), ('resid_std', np.sqrt(scale)),
+                         ('durbin_watson', durbin_watson), ('skew', skew), ('kurtosis', kurtosis),
+                         ('max_leverage', max_leverage), ('max_cooks_d', max_cooks_d)]:
+        result[name] = values
+    return result
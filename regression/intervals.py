@@ -0,0 +1,106 @@
+"""Confidence and prediction intervals of a linear regression, for large batches of points.
+
+PredictionIntervals takes any fit with params, cov_params(), scale and
+df_resid, a statsmodels result or a RecursiveLeastSquares, and computes
+the intervals chunk by chunk in bounded memory:
+
+    lower, upper = PredictionIntervals(fit).predict(X, 'prediction')[1:]
+"""
+
+import numpy as np
+import pandas as pd
+
+from regression.tracing import traced
+
+class PredictionIntervals(object):
+    """Confidence and prediction intervals of a linear regression for large batches of new points.
+
+    The covariance of the parameters is factored once as C C', so the
+    variance of the mean response at x is the squared norm of C'x. Points
+    are processed in chunks of rows, so the working memory is bounded by
+    chunksize times the number of parameters, however many points there are.
+    """
+
+    def __init__(self, fit, chunksize=65536):
+        """Create the intervals of a fit.
+
+        Arguments:
+            fit       -- a linear regression result, with params, cov_params(), scale and df_resid;
+                         DataFrame points are matched by name only if params is a Series
+            chunksize -- number of points processed at a time (default 65536)
+        """
+        # Fits on ndarray exog have plain array params, and match points by position
+        self.names = list(fit.params.index) if hasattr(fit.params, 'index') else None
+        self.params = np.asarray(fit.params, dtype=float)
+        self.cov = np.asarray(fit.cov_params(), dtype=float)
+        self.scale = float(fit.scale)
+        self.df_resid = float(fit.df_resid)
+        self.chunksize = chunksize
+        self.factor = None
+        self.quantiles = {}
+
+    def _as_matrix(self, exog):
+        """Return exog as a 2-D array, with DataFrame columns matched to the parameters by name if possible."""
+        if (isinstance(exog, pd.DataFrame) and self.names is not None
+                and all(name in exog.columns for name in self.names)):
+            exog = exog[self.names]
+        return np.atleast_2d(np.asarray(exog, dtype=float))
+
+    def cov_factor(self):
+        """Return C with C C' equal to the covariance of the parameters, computed on first use."""
+        if self.factor is None:
+            try:
+                self.factor = np.linalg.cholesky(self.cov)
+            except np.linalg.LinAlgError:
+                # A singular covariance, e.g., of a rank deficient fit, has no Cholesky factor
+                w, V = np.linalg.eigh(self.cov)
+                self.factor = V * np.sqrt(np.clip(w, 0.0, None))
+        return self.factor
+
+    def quantile(self, alpha):
+        """Return the t quantile of a two-sided 1 - alpha interval, computed once per alpha.
+
+        Arguments:
+            alpha -- significance level of the interval
+        """
+        if alpha not in self.quantiles:
+            import scipy.stats
+            self.quantiles[alpha] = scipy.stats.t.isf(alpha / 2.0, self.df_resid)
+        return self.quantiles[alpha]
+
+    def std(self, exog, interval='confidence'):
+        """Return the standard errors of the mean response, or of a new observation, at each point.
+
+        Arguments:
+            exog     -- DataFrame or 2-D array of points, one row per point
+            interval -- 'confidence' for the mean response or 'prediction' for a new
+                        observation (default 'confidence')
+        """
+        if interval not in ('confidence', 'prediction'):
+            raise ValueError("unknown interval %r" % interval)
+        X = self._as_matrix(exog)
+        C = self.cov_factor()
+        std = np.empty(len(X))
+        for start in range(0, len(X), self.chunksize):
+            Z = X[start:start + self.chunksize].dot(C)
+            std[start:start + len(Z)] = np.einsum('ij,ij->i', Z, Z)
+        if interval == 'prediction':
+            std += self.scale
+        return np.sqrt(std, out=std)
+
+    @traced('predict')
+    def predict(self, exog, interval=None, alpha=0.05):
+        """Predict the response at each point; with an interval, also return its lower and upper bounds.
+
+        Arguments:
+            exog     -- DataFrame or 2-D array of points, one row per point
+            interval -- None, 'confidence' or 'prediction' (default None)
+            alpha    -- significance level of the interval (default 0.05)
+        """
+        X = self._as_matrix(exog)
+        preds = X.dot(self.params)
+        if interval is None:
+            return preds
+        half = self.std(X, interval)
+        half *= self.quantile(alpha)
+        return preds, preds - half, preds + half
@@ -0,0 +1,19 @@
+"""Modules that are only imported when one of their attributes is first used.
+
+Importing an example to reuse a function should not pay for statsmodels
+and matplotlib, so the scripts bind those to LazyModules:
+
+    sm = LazyModule('statsmodels.api')
+    plt = LazyModule('matplotlib.pyplot')
+"""
+
+import importlib
+import types
+
+class LazyModule(types.ModuleType):
+    """A module that is only imported when one of its attributes is first used."""
+
+    def __getattr__(self, name):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, name)
@@ -0,0 +1,430 @@
+"""Market data of the examples: a local cache of Quandl series, and concurrent downloads.
+
+Each ticker is cached as a few binary files that are memory-mapped on
+load, together with the date spans the entry holds, so that only the
+missing dates are downloaded. Downloads go either through the quandl
+package or through a pooled, rate-limited HTTP client of the Quandl REST
+API, and many tickers are fetched at the same time:
+
+    data, failures = get_bulk_data_from_quandl(["WIKI/AAPL", "YAHOO/INDEX_GSPC"], cache=True)
+"""
+
+import concurrent.futures
+import contextlib
+import http.client
+import importlib
+import io
+import json
+import os
+import os.path
+import queue
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+import numpy as np
+import pandas as pd
+
+from regression.tracing import trace_note, traced
+
+def cache_file_names(ticker, cache_dir, version=None):
+    """Return the file names of the binary cache of a ticker: its manifest, values and dates.
+
+    An entry is stored as a JSON manifest, which holds the column names, the
+    date spans the entry holds and the version of its arrays, and two arrays
+    per version: the values as a float64 array with one row per column of
+    the original data (so every column is contiguous on disk), and the dates
+    as int64 nanoseconds since the epoch. Without a version, only the name
+    of the manifest is returned.
+
+    Arguments:
+        ticker    -- ticker without the Quandl database, e.g., "AAPL"
+        cache_dir -- directory of the cache
+        version   -- version of the arrays, as recorded in the manifest (default None)
+    """
+    base = os.path.join(cache_dir, ticker)
+    if version is None:
+        return base + ".json"
+    return (base + ".json", "%s.%s.values.npy" % (base, version),
+            "%s.%s.dates.npy" % (base, version))
+
+def write_binary_cache(data, ticker, cache_dir, spans):
+    """Store a DataFrame of market data in the binary columnar cache.
+
+    The arrays are written under a new version, and the manifest is then
+    replaced in one rename, which is the commit point of the entry: readers
+    see either the old entry or the new one, never new dates with old
+    values. The arrays of the previous version are removed afterwards.
+
+    Arguments:
+        data      -- DataFrame of numeric columns, indexed by date
+        ticker    -- ticker without the Quandl database, e.g., "AAPL"
+        cache_dir -- directory of the cache
+        spans     -- list of (start, end) Timestamp pairs of the dates the entry holds
+    """
+    version = uuid.uuid4().hex
+    manifest_fname, values_fname, dates_fname = cache_file_names(ticker, cache_dir, version)
+    previous = read_cache_manifest(ticker, cache_dir)
+    dates = pd.to_datetime(data.index).values.astype('datetime64[ns]').view(np.int64)
+    for fname, array in ((dates_fname, dates),
+                         (values_fname, np.ascontiguousarray(data.values.T, dtype=np.float64))):
+        with open(fname + ".tmp", 'wb') as f:
+            np.save(f, array)
+        os.replace(fname + ".tmp", fname)
+    manifest = {'version': version, 'columns': [ str(col) for col in data.columns ],
+                'spans': [ [start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")]
+                           for start, end in spans ]}
+    with open("%s.%s.tmp" % (manifest_fname, version), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace("%s.%s.tmp" % (manifest_fname, version), manifest_fname)
+    # Readers that mapped older arrays keep them until they let go. Arrays of
+    # other versions than the previous one are left by writers that lost a
+    # race for the same ticker, or died before their commit, and are removed
+    # once they are too old to belong to a writer still running.
+    stale = time.time() - 60
+    pattern = re.compile(re.escape(ticker) + r"\.([0-9a-f]{32})\.(values|dates)\.npy")
+    for fname in os.listdir(cache_dir):
+        match = pattern.fullmatch(fname)
+        if match is None or match.group(1) == version:
+            continue
+        path = os.path.join(cache_dir, fname)
+        with contextlib.suppress(FileNotFoundError):
+            if previous is not None and match.group(1) == previous['version'] or os.path.getmtime(path) < stale:
+                os.remove(path)
+
+def read_cache_manifest(ticker, cache_dir):
+    """Return the manifest of a ticker in the binary cache as a dict, or None if it is not cached.
+
+    Arguments:
+        ticker    -- ticker without the Quandl database, e.g., "AAPL"
+        cache_dir -- directory of the cache
+    """
+    try:
+        with open(cache_file_names(ticker, cache_dir)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_binary_cache(ticker, cache_dir, attempts=3):
+    """Load a ticker from the binary columnar cache without copying its values.
+
+    Returns the DataFrame and the date spans it holds, a sorted list of
+    non-overlapping (start, end) Timestamp pairs, both ends inclusive; or
+    None and [] if the ticker is not cached.
+
+    The values are memory-mapped copy-on-write and wrapped in a DataFrame
+    as-is, so only the pages that are actually used get read from disk. The
+    frame can be written to like any other: changed pages are copied in
+    memory, and the file is left alone.
+
+    Arguments:
+        ticker    -- ticker without the Quandl database, e.g., "AAPL"
+        cache_dir -- directory of the cache
+        attempts  -- times to read the manifest again when a writer replaces
+                     the entry while it is being read (default 3)
+    """
+    for attempt in range(attempts):
+        manifest = read_cache_manifest(ticker, cache_dir)
+        if manifest is None:
+            return None, []
+        _, values_fname, dates_fname = cache_file_names(ticker, cache_dir, manifest['version'])
+        try:
+            values = np.load(values_fname, mmap_mode='c')
+            dates = np.load(dates_fname, mmap_mode='r')
+            break
+        except FileNotFoundError:
+            if attempt == attempts - 1:
+                raise
+    index = pd.DatetimeIndex(dates.view('datetime64[ns]'), name='Date')
+    spans = [ (pd.Timestamp(start), pd.Timestamp(end)) for start, end in manifest['spans'] ]
+    return pd.DataFrame(values.T, index=index, columns=manifest['columns'], copy=False), spans
+
+def migrate_csv_cache(cache_dir=os.path.join("..", "data", "cache"),
+                      start_date="2016-01-01", end_date="2016-12-31"):
+    """Convert every CSV file of the cache into the binary columnar format.
+
+    CSV files that already have a binary entry are left alone, so this is
+    safe to run more than once. The CSV cache did not record which dates it
+    was downloaded for, so each migrated entry is taken to cover start_date
+    to end_date, the range get_data_from_quandl used to write it with.
+
+    Arguments:
+        cache_dir  -- directory of the cache (default "../data/cache")
+        start_date -- first date the CSV files were downloaded for (default "2016-01-01")
+        end_date   -- last date the CSV files were downloaded for (default "2016-12-31")
+    """
+    for fname in sorted(os.listdir(cache_dir)):
+        ticker, ext = os.path.splitext(fname)
+        if ext != ".csv" or os.path.isfile(cache_file_names(ticker, cache_dir)):
+            continue
+        data = pd.read_csv(os.path.join(cache_dir, fname), index_col=0, parse_dates=True)
+        spans = [(pd.Timestamp(start_date), pd.Timestamp(end_date))]
+        if len(data) > 0:
+            spans.append((data.index[0], data.index[-1]))
+        write_binary_cache(data, ticker, cache_dir, merge_spans(spans))
+
+def merge_spans(spans):
+    """Merge overlapping and adjacent date spans into a sorted list.
+
+    Arguments:
+        spans -- list of (start, end) Timestamp pairs, both ends inclusive
+    """
+    one_day = pd.Timedelta(days=1)
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1] + one_day:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def missing_spans(spans, start, end):
+    """Return the parts of the range start..end that are not covered by spans.
+
+    Arguments:
+        spans -- sorted, merged list of (start, end) Timestamp pairs
+        start -- first date of the requested range
+        end   -- last date of the requested range
+    """
+    one_day = pd.Timedelta(days=1)
+    gaps = []
+    for span_start, span_end in spans:
+        if span_end < start:
+            continue
+        if span_start > end:
+            break
+        if span_start > start:
+            gaps.append((start, span_start - one_day))
+        start = span_end + one_day
+    if start <= end:
+        gaps.append((start, end))
+    return gaps
+
+@traced('fetch')
+def get_data_from_quandl(qticker, 
+                         start_date="2016-01-01", end_date="2016-12-31", 
+                         cache=False, source=None,
+                         cache_dir=os.path.join("..", "data", "cache")):
+    """Download data from Quandl service.
+
+    The cache remembers which date spans it holds for each ticker. Only the
+    parts of start_date..end_date that it does not hold yet are downloaded,
+    and they are merged into the stored series before the requested range
+    is returned. Without the cache the whole range is downloaded, and still
+    merged into the stored series. A span is only recorded up to the last
+    date the source returned, so dates past the end of the series, e.g., in
+    the future, are asked for again on the next call. CSV files of the old
+    cache are only seen once migrate_csv_cache has converted them.
+    
+    Arguments:
+        qticker    -- ticker in Quandl format, e.g., "WIKI/AAPL"
+        start_date -- first date to retrieve (default "2016-01-01")
+        end_date   -- last date to retrieve (default "2016-12-31")
+        cache      -- True if local cache should be used (default False)
+        source     -- function with the signature of quandl.get used to download
+                      data (default quandl.get)
+        cache_dir  -- directory of the local cache (default ../data/cache)
+    """
+    if source is None:
+        # The Quandl package makes it easy to access market data
+        # It is available from https://pypi.python.org/pypi/Quandl
+        source = importlib.import_module('quandl').get
+    base, ticker = qticker.split("/")
+    start, end = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    data, spans = read_binary_cache(ticker, cache_dir)
+    gaps = missing_spans(spans, start, end) if cache else [(start, end)]
+    trace_note(cache='hit' if not gaps else 'miss' if gaps == [(start, end)] else 'partial')
+    if gaps:
+        parts = [] if data is None else [data]
+        for gap_start, gap_end in gaps:
+            part = source(qticker,
+                          start_date=gap_start.strftime("%Y-%m-%d"),
+                          end_date=gap_end.strftime("%Y-%m-%d"))
+            # In the resolution of the cache, so fresh and cached frames are alike
+            part.index = pd.to_datetime(part.index).as_unit('ns')
+            parts.append(part)
+        data = pd.concat(parts)
+        data = data[~data.index.duplicated(keep='last')].sort_index()
+        last = data.index[-1] if len(data) else start - pd.Timedelta(days=1)
+        fetched = [ (gap_start, min(gap_end, last)) for gap_start, gap_end in gaps if gap_start <= last ]
+        write_binary_cache(data, ticker, cache_dir, merge_spans(spans + fetched))
+    return data.loc[start:end]
+
+class RateLimiter(object):
+    """Spaces out calls so that at most `rate` of them start per second, across threads."""
+
+    def __init__(self, rate):
+        """Create a rate limiter.
+
+        Arguments:
+            rate -- maximum number of calls per second
+        """
+        self.interval = 1.0 / rate
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed to start."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+class HTTPConnectionPool(object):
+    """A bounded pool of keep-alive connections to a single host, shared by threads."""
+
+    def __init__(self, url, maxsize=8):
+        """Create a connection pool; connections are opened on first use.
+
+        Arguments:
+            url     -- base URL of the host, e.g., "https://www.quandl.com"
+            maxsize -- maximum number of open connections (default 8)
+        """
+        parts = urllib.parse.urlsplit(url)
+        self.connection_class = (http.client.HTTPSConnection if parts.scheme == "https"
+                                 else http.client.HTTPConnection)
+        self.netloc = parts.netloc
+        self.connections = queue.LifoQueue()
+        for i in range(maxsize):
+            self.connections.put(None)
+
+    def get(self, path, timeout=30):
+        """Send a GET request and return the status, headers and body of the response.
+
+        Blocks while all connections of the pool are in use.
+
+        Arguments:
+            path    -- path and query string of the request
+            timeout -- socket timeout in seconds (default 30)
+        """
+        conn = self.connections.get()
+        try:
+            if conn is None:
+                conn = self.connection_class(self.netloc, timeout=timeout)
+            conn.request("GET", path)
+            response = conn.getresponse()
+            return response.status, response.getheaders(), response.read()
+        except Exception:
+            conn.close()
+            conn = None
+            raise
+        finally:
+            self.connections.put(conn)
+
+class DownloadError(Exception):
+    """A download failed with an HTTP status that is not worth retrying."""
+
+def make_quandl_http_source(base_url="https://www.quandl.com/api/v3/datasets",
+                            api_key=None, max_connections=8, requests_per_second=10,
+                            retries=4, backoff=0.5):
+    """Create a download function with the signature of quandl.get on top of the Quandl REST API.
+
+    Requests go through a bounded pool of keep-alive connections and a rate
+    limiter for the host. Connection errors, HTTP 429 and 5xx responses are
+    retried with exponential backoff and jitter, honoring Retry-After; other
+    HTTP errors raise DownloadError right away.
+
+    Arguments:
+        base_url            -- URL of the datasets API (default Quandl's), e.g., a local stub server
+        api_key             -- Quandl API key (default None)
+        max_connections     -- maximum number of open connections (default 8)
+        requests_per_second -- maximum request rate to the host (default 10)
+        retries             -- number of retries after the first attempt (default 4)
+        backoff             -- delay in seconds before the first retry, doubled each time (default 0.5)
+    """
+    pool = HTTPConnectionPool(base_url, max_connections)
+    limiter = RateLimiter(requests_per_second)
+    base_path = urllib.parse.urlsplit(base_url).path.rstrip("/")
+
+    def source(qticker, start_date, end_date):
+        query = {'start_date': start_date, 'end_date': end_date}
+        if api_key is not None:
+            query['api_key'] = api_key
+        path = "%s/%s/data.csv?%s" % (base_path, qticker, urllib.parse.urlencode(query))
+        for attempt in range(retries + 1):
+            limiter.wait()
+            delay = backoff * 2 ** attempt * (0.5 + random.random())
+            try:
+                status, headers, body = pool.get(path)
+            except (OSError, http.client.HTTPException):
+                if attempt == retries:
+                    raise
+            else:
+                if status == 200:
+                    return pd.read_csv(io.BytesIO(body), index_col=0, parse_dates=True)
+                if status != 429 and status < 500:
+                    raise DownloadError("%s: HTTP %d" % (qticker, status))
+                if attempt == retries:
+                    raise DownloadError("%s: HTTP %d after %d attempts" % (qticker, status, attempt + 1))
+                retry_after = dict((k.lower(), v) for k, v in headers).get('retry-after', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            time.sleep(delay)
+
+    return source
+
+def lazy_quandl_http_source(max_connections=8):
+    """Create a download function that sets up make_quandl_http_source on its first call.
+
+    The quandl package is imported for its API key only then, so a run that
+    is served entirely from the cache never imports it.
+
+    Arguments:
+        max_connections -- maximum number of open connections (default 8)
+    """
+    lock = threading.Lock()
+    sources = []
+
+    def source(qticker, start_date, end_date):
+        with lock:
+            if not sources:
+                quandl = importlib.import_module('quandl')
+                sources.append(make_quandl_http_source(api_key=quandl.ApiConfig.api_key,
+                                                       max_connections=max_connections))
+        return sources[0](qticker, start_date, end_date)
+
+    return source
+
+@traced('fetch')
+def get_bulk_data_from_quandl(qtickers,
+                              start_date="2016-01-01", end_date="2016-12-31",
+                              cache=False, source=None, max_workers=8,
+                              cache_dir=os.path.join("..", "data", "cache")):
+    """Download data for many tickers concurrently from Quandl service.
+
+    Each ticker goes through get_data_from_quandl on a thread pool, so every
+    result is merged into the local cache as soon as it arrives. A failing
+    ticker does not stop the others.
+
+    Returns two dicts keyed by Quandl ticker: the DataFrames that were
+    retrieved, and the exceptions of the tickers that failed.
+
+    Arguments:
+        qtickers    -- list of tickers in Quandl format, e.g., ["WIKI/AAPL", "WIKI/WMT"]
+        start_date  -- first date to retrieve (default "2016-01-01")
+        end_date    -- last date to retrieve (default "2016-12-31")
+        cache       -- True if local cache should be used (default False)
+        source      -- function with the signature of quandl.get used to download
+                       data (default lazy_quandl_http_source)
+        max_workers -- number of tickers fetched at the same time (default 8)
+        cache_dir   -- directory of the local cache (default ../data/cache)
+    """
+    if source is None:
+        source = lazy_quandl_http_source(max_connections=max_workers)
+    data, failures = {}, {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = dict((executor.submit(get_data_from_quandl, qticker,
+                                        start_date, end_date, cache, source, cache_dir), qticker)
+                       for qticker in sorted(set(qtickers)))
+        for future in concurrent.futures.as_completed(futures):
+            qticker = futures[future]
+            try:
+                data[qticker] = future.result()
+            except Exception as e:
+                failures[qticker] = e
+    return data, failures
+
@@ -0,0 +1,149 @@
+"""Linear regression updated in place as observations arrive, for streaming and rolling fits.
+
+A RecursiveLeastSquares fit costs O(p^2) per new observation instead of a
+refit, and stands in for a statsmodels regression result wherever the
+examples only need its params, standard errors and predictions:
+
+    fit = RecursiveLeastSquares(['bench_ret', 'const'])
+    for date, row in data.iterrows():
+        fit.update(row[fit.names], row['stock_ret'])
+"""
+
+import types
+import numpy as np
+import pandas as pd
+
+class RecursiveLeastSquares(object):
+    """Linear regression that is updated in place as new observations arrive.
+
+    Until the first observations span all predictors, their (weighted) normal
+    equations are simply accumulated. From then on the coefficients and the
+    inverse Gram matrix are updated with the Woodbury identity, which costs
+    O(p^2) per observation instead of a refit. Without forgetting the result
+    is the batch OLS fit of all observations so far.
+
+    The params, bse, cov_params, predict, mse_resid and df_resid members
+    mirror a statsmodels regression result, so it can stand in for one in the
+    visualization functions, including PredictionIntervals.
+    """
+
+    def __init__(self, names, forgetting=1.0):
+        """Create an empty online regression.
+
+        Arguments:
+            names      -- names of the predictor columns, in the order of params
+            forgetting -- weight kept by past observations at each new one, between
+                          0 and 1; 1 means no forgetting (default 1.0)
+        """
+        self.names = list(names)
+        self.forgetting = forgetting
+        p = len(self.names)
+        self.gram = np.zeros((p, p))
+        self.xty = np.zeros(p)
+        self.yty = 0.0
+        self.theta = np.full(p, np.nan)
+        self.gram_inv = None
+        self.ssr = np.nan
+        self.nobs = 0.0
+        self.model = types.SimpleNamespace(predict=lambda params, exog: np.dot(exog, params))
+
+    def _as_matrix(self, exog):
+        """Return exog as a 2-d float array with columns in the order of names."""
+        if isinstance(exog, pd.DataFrame):
+            if set(self.names).issubset(exog.columns):
+                exog = exog[self.names]
+            return exog.values.astype(float)
+        if isinstance(exog, (pd.Series, dict)):
+            return np.array([[exog[name] for name in self.names]], dtype=float)
+        return np.atleast_2d(np.asarray(exog, dtype=float))
+
+    def update(self, exog, endog):
+        """Add one observation, or a mini-batch of them, to the fit.
+
+        Observations with a NaN are skipped, as with missing='drop'.
+
+        Arguments:
+            exog  -- predictors of one observation (a Series, dict or 1-d array),
+                     or of several (a DataFrame or 2-d array, one row each)
+            endog -- response of each observation
+        """
+        X = self._as_matrix(exog)
+        y = np.atleast_1d(np.asarray(endog, dtype=float))
+        keep = ~(np.isnan(X).any(axis=1) | np.isnan(y))
+        X, y = X[keep], y[keep]
+        m = len(y)
+        if m == 0:
+            return self
+        # Within a mini-batch, older rows are forgotten as if they had arrived one by one
+        w = self.forgetting ** np.arange(m - 1, -1, -1.0)
+        decay = self.forgetting ** m
+        self.nobs = decay * self.nobs + w.sum()
+        if self.gram_inv is None:
+            self.gram = decay * self.gram + (X.T * w).dot(X)
+            self.xty = decay * self.xty + (X.T * w).dot(y)
+            self.yty = decay * self.yty + (w * y * y).sum()
+            if np.linalg.matrix_rank(self.gram) == len(self.names):
+                self.gram_inv = np.linalg.inv(self.gram)
+                self.theta = self.gram_inv.dot(self.xty)
+                self.ssr = self.yty - self.theta.dot(self.xty)
+            return self
+        P = self.gram_inv
+        e = y - X.dot(self.theta)
+        if m == 1:
+            # Sherman-Morrison: the same update with a scalar instead of a solve
+            Px = P.dot(X[0])
+            s = decay + X[0].dot(Px)
+            k = Px / s
+            self.theta = self.theta + k * e[0]
+            self.ssr = decay * (self.ssr + e[0] * e[0] / s)
+            P = (P - np.outer(k, Px)) / decay
+            self.gram_inv = (P + P.T) / 2
+            return self
+        PXt = P.dot(X.T)
+        S = X.dot(PXt) + np.diag(decay / w)
+        K = np.linalg.solve(S, PXt.T).T
+        self.theta = self.theta + K.dot(e)
+        self.ssr = decay * (self.ssr + e.dot(np.linalg.solve(S, e)))
+        P = (P - K.dot(PXt.T)) / decay
+        self.gram_inv = (P + P.T) / 2
+        return self
+
+    @property
+    def params(self):
+        """Coefficients of the fit, as a Series indexed by predictor name."""
+        return pd.Series(self.theta, index=self.names)
+
+    @property
+    def df_resid(self):
+        """Residual degrees of freedom (effective, when forgetting)."""
+        return self.nobs - len(self.names)
+
+    @property
+    def mse_resid(self):
+        """Estimate of the residual variance."""
+        return self.ssr / self.df_resid
+
+    scale = mse_resid
+
+    def cov_params(self):
+        """Covariance of the coefficients, as a DataFrame."""
+        if self.gram_inv is None:
+            return pd.DataFrame(np.nan, index=self.names, columns=self.names)
+        return pd.DataFrame(self.mse_resid * self.gram_inv, index=self.names, columns=self.names)
+
+    @property
+    def bse(self):
+        """Standard errors of the coefficients."""
+        return pd.Series(np.sqrt(np.diag(self.cov_params().values)), index=self.names)
+
+    def predict(self, exog):
+        """Predict the response for new observations.
+
+        Arguments:
+            exog -- a DataFrame or 2-d array of predictors; DataFrames that have all
+                    the predictor names are matched by name, others by position
+        """
+        preds = self._as_matrix(exog).dot(self.theta)
+        if isinstance(exog, pd.DataFrame):
+            return pd.Series(preds, index=exog.index)
+        return preds
@@ -0,0 +1,58 @@
+"""Plots shared by the examples that stay fast for any number of points.
+
+plot_scatter draws a scatter plot as usual, and switches to a density
+raster of the points when there are too many to draw one by one:
+
+    ax = plot_scatter(data, x='bench_ret', y='stock_ret', title='Scatter Plot')
+"""
+
+import numpy as np
+
+from regression.lazy import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+
+def plot_scatter(data, x, y, max_points=100000, bins=256, **kwargs):
+    """Create a scatter plot, or a density raster of the points when there are too many to draw.
+
+    Up to max_points points this is data.plot(kind='scatter', ...). Beyond
+    that, the points are counted into a bins x bins grid with one vectorized
+    pass and the counts are drawn as a single log-scaled image, so drawing
+    takes the same time however many points there are. Lines plotted after
+    it, such as a regression line and its bands, are drawn on top as usual.
+
+    Arguments:
+        data       -- a DataFrame
+        x          -- name or position of the column on the x axis
+        y          -- name or position of the column on the y axis
+        max_points -- largest number of points drawn one by one (default 100000)
+        bins       -- number of bins along each axis of the raster (default 256)
+        kwargs     -- title, xlim and ylim, as for data.plot
+    """
+    from matplotlib.colors import LogNorm
+    if len(data) <= max_points:
+        return data.plot(kind='scatter', x=x, y=y, **kwargs)
+    xname = data.columns[x] if isinstance(x, int) else x
+    yname = data.columns[y] if isinstance(y, int) else y
+    xs = data[xname].values.astype(float)
+    ys = data[yname].values.astype(float)
+    xlim = kwargs.get('xlim') or (np.nanmin(xs), np.nanmax(xs))
+    ylim = kwargs.get('ylim') or (np.nanmin(ys), np.nanmax(ys))
+    ix = np.floor((xs - xlim[0]) / (xlim[1] - xlim[0]) * bins)
+    iy = np.floor((ys - ylim[0]) / (ylim[1] - ylim[0]) * bins)
+    # Points on the upper limit belong in the last bin; NaNs and points outside are dropped
+    ix[xs == xlim[1]] = bins - 1
+    iy[ys == ylim[1]] = bins - 1
+    inside = (ix >= 0) & (ix < bins) & (iy >= 0) & (iy < bins)
+    counts = np.bincount((iy[inside] * bins + ix[inside]).astype(np.int64),
+                         minlength=bins * bins).reshape(bins, bins)
+    fig, ax = plt.subplots()
+    ax.imshow(np.ma.masked_equal(counts, 0), origin='lower', aspect='auto',
+              extent=(xlim[0], xlim[1], ylim[0], ylim[1]), interpolation='nearest',
+              cmap='Blues', norm=LogNorm())
+    ax.set_xlim(xlim)
+    ax.set_ylim(ylim)
+    ax.set_title(kwargs.get('title', ''))
+    ax.set_xlabel(xname)
+    ax.set_ylabel(yname)
+    return ax
@@ -0,0 +1,67 @@
+"""Returns and design matrices of tidy market data, computed without extra copies.
+
+compute_returns writes the 1 day returns of a price series straight into
+a column of a preallocated block, and masked_design copies the complete
+rows of a tidy frame once into the arrays statsmodels fits:
+
+    y, X = masked_design(data, 'stock_ret', ['bench_ret'])
+"""
+
+import numpy as np
+import pandas as pd
+
+def compute_returns(prices, log=False, out=None):
+    """Compute the 1 day returns of a series of positive prices, without a shifted copy.
+
+    The differences of consecutive prices are written straight into a float64
+    out and divided there by the earlier price, so out is the only array
+    allocated, and none when it is given, e.g., as a column of a preallocated
+    block. An out of another dtype gets the float64 returns, computed in a
+    temporary, rounded once: float32 returns are the float64 ones correctly
+    rounded, within half a float32 ulp (relative 6e-8). The first return is NaN.
+
+    Arguments:
+        prices -- a Series or 1-d array of prices
+        log    -- compute log returns, log(today / yesterday), instead (default False)
+        out    -- array to write the returns to, not sharing memory with prices
+                  (default a new float64 array)
+    """
+    p = np.asarray(prices, dtype=float)
+    if out is None:
+        out = np.empty(len(p))
+    # Rounding to a lower precision after each step would compound the errors
+    ret = out if out.dtype == np.float64 else np.empty(len(p))
+    ret[:1] = np.nan
+    np.subtract(p[1:], p[:-1], out=ret[1:])
+    np.divide(ret[1:], p[:-1], out=ret[1:])
+    if log:
+        np.log1p(ret[1:], out=ret[1:])
+    if ret is not out:
+        out[:] = ret
+    return out
+
+def masked_design(data, response, predictors):
+    """Return the response and design matrix of the complete rows of a tidy data frame.
+
+    The complete rows are found with one NaN mask and copied once, into the
+    float64 arrays that statsmodels fits, with a const column added if the
+    predictors have none. This replaces missing='drop', which converts all of
+    data to float64 and then copies it again to drop the rows.
+
+    Arguments:
+        data       -- a tidy DataFrame
+        response   -- name of the response column
+        predictors -- names of the predictor columns
+    """
+    columns = [ data[col].values for col in [response] + list(predictors) ]
+    mask = np.ones(len(data), dtype=bool)
+    for values in columns:
+        if values.dtype.kind == 'f':
+            mask &= ~np.isnan(values)
+    names = list(predictors) + ([] if 'const' in predictors else ['const'])
+    X = np.ones((mask.sum(), len(names)))
+    for j, values in enumerate(columns[1:]):
+        X[:, j] = values[mask]
+    index = data.index[mask]
+    return (pd.Series(columns[0][mask].astype(float), index=index, name=response),
+            pd.DataFrame(X, index=index, columns=names, copy=False))
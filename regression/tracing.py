@@ -0,0 +1,170 @@
+"""Opt-in tracing of the stages of a run: fetch, tidy, fit, predict and plot.
+
+The example scripts decorate their main functions with traced, which calls
+them directly while tracing is off. Once start_tracing is called, every
+decorated call in any of the scripts is recorded to one StageTracer, with
+its wall and CPU time, memory and rows, and can be written as a Chrome
+trace:
+
+    tracer = start_tracing()
+    ...
+    stop_tracing().write_chrome_trace('trace.json')
+"""
+
+import contextlib
+import functools
+import json
+import os
+import resource
+import threading
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+class StageTracer(object):
+    """Records the stages of a run (fetch, tidy, fit, predict and plot) as Chrome trace events.
+
+    Each stage records its wall time, the CPU time of the process, the bytes
+    it allocated and its peak allocation as traced by tracemalloc, the peak
+    resident set size of the process, the number of rows it returned, and
+    notes such as cache hits. Stages nest, and are kept apart per thread,
+    but allocations are counted for the whole process.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.local = threading.local()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, category, name, **notes):
+        """Record the enclosed code as a stage; yields the dict of notes of the stage."""
+        stack = self.local.__dict__.setdefault('stack', [])
+        allocated, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        frame = {'notes': notes, 'peak': 0}
+        stack.append(frame)
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start, cpu = time.perf_counter_ns(), time.process_time()
+        try:
+            yield notes
+        finally:
+            end, cpu = time.perf_counter_ns(), time.process_time() - cpu
+            stack.pop()
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame['peak'])
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            notes.update(cpu_seconds=cpu, alloc_bytes=current - allocated,
+                         alloc_peak_bytes=peak - allocated, rss_peak_kb=max_rss,
+                         rss_growth_kb=max_rss - rss)
+            self.events.append({'name': name, 'cat': category, 'ph': 'X',
+                                'ts': start // 1000, 'dur': (end - start) // 1000,
+                                'pid': os.getpid(), 'tid': threading.get_native_id(),
+                                'args': notes})
+
+    def note(self, **notes):
+        """Add notes to the innermost stage of the current thread."""
+        stack = self.local.__dict__.get('stack')
+        if stack:
+            stack[-1]['notes'].update(notes)
+
+    def write_chrome_trace(self, fname):
+        """Write the stages as a JSON trace, for chrome://tracing or Perfetto."""
+        with open(fname, 'w') as f:
+            json.dump({'traceEvents': self.events, 'displayTimeUnit': 'ms'}, f, default=str)
+
+    def summary(self):
+        """Return a DataFrame of the stages by category and name, with their totals."""
+        columns = ['calls', 'wall_seconds', 'cpu_seconds', 'rows', 'alloc_peak_bytes',
+                   'rss_peak_kb', 'cache_hits', 'cache_misses']
+        if not self.events:
+            return pd.DataFrame(columns=columns)
+        df = pd.DataFrame({'stage': [ e['cat'] for e in self.events ],
+                           'name': [ e['name'] for e in self.events ],
+                           'wall_seconds': [ e['dur'] / 1e6 for e in self.events ],
+                           'cpu_seconds': [ e['args']['cpu_seconds'] for e in self.events ],
+                           'rows': [ e['args'].get('rows', 0) for e in self.events ],
+                           'alloc_peak_bytes': [ e['args']['alloc_peak_bytes'] for e in self.events ],
+                           'rss_peak_kb': [ e['args']['rss_peak_kb'] for e in self.events ],
+                           'cache': [ e['args'].get('cache') for e in self.events ]})
+        df['cache_hits'] = df['cache'] == 'hit'
+        df['cache_misses'] = df['cache'].isin(['miss', 'partial'])
+        return df.groupby(['stage', 'name'], sort=False).agg(
+            calls=('wall_seconds', 'size'), wall_seconds=('wall_seconds', 'sum'),
+            cpu_seconds=('cpu_seconds', 'sum'), rows=('rows', 'sum'),
+            alloc_peak_bytes=('alloc_peak_bytes', 'max'), rss_peak_kb=('rss_peak_kb', 'max'),
+            cache_hits=('cache_hits', 'sum'), cache_misses=('cache_misses', 'sum'))[columns]
+
+# The tracer of the run, or None when tracing is off
+_tracer = None
+
+def start_tracing(tracer=None):
+    """Turn tracing on; return the tracer.
+
+    Arguments:
+        tracer -- StageTracer to record to (default a new one)
+    """
+    global _tracer
+    _tracer = StageTracer() if tracer is None else tracer
+    return _tracer
+
+def stop_tracing():
+    """Turn tracing off; return the tracer, or None if it was off."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    return tracer
+
+def get_tracer():
+    """Return the tracer of the run, or None when tracing is off."""
+    return _tracer
+
+def count_rows(value):
+    """Return the number of rows of a stage result, or None if it has no rows."""
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    if isinstance(value, tuple) and value:
+        return count_rows(value[0])
+    if isinstance(value, dict):
+        return sum(count_rows(v) or 0 for v in value.values())
+    nobs = getattr(value, 'nobs', None)
+    return None if nobs is None else int(nobs)
+
+def traced(category):
+    """Decorate a function as a stage of a run, recorded while tracing is on.
+
+    When tracing is off the function is called directly, at the cost of a
+    global lookup.
+
+    Arguments:
+        category -- stage of the function: 'fetch', 'tidy', 'fit', 'predict' or 'plot'
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.stage(category, function.__qualname__) as notes:
+                result = function(*args, **kwargs)
+                rows = count_rows(result)
+                if rows is not None:
+                    notes['rows'] = rows
+                return result
+        return wrapper
+    return decorate
+
+def trace_stage(category, name, **notes):
+    """Return a context manager recording the enclosed code as a stage, if tracing is on."""
+    if _tracer is None:
+        return contextlib.nullcontext(notes)
+    return _tracer.stage(category, name, **notes)
+
+def trace_note(**notes):
+    """Add notes, such as cache='hit', to the current stage if tracing is on."""
+    if _tracer is not None:
+        _tracer.note(**notes)
@@ -0,0 +1,8 @@
+"""Make the regression package at the root of the repository importable by the tests."""
+
+import os.path
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
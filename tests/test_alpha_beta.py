@@ -0,0 +1,149 @@
+"""The returns and the fits of compute_alpha_beta against plain statsmodels OLS."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+
+from regression import alpha_beta, tidy
+
+def make_prices(n=2000, seed=0):
+    """Return stock and benchmark frames of n days of random walk prices, like Quandl's."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2010-01-01', periods=n, freq='B')
+    bench = 2000 * np.exp(np.cumsum(rng.normal(0.0003, 0.01, n)))
+    stock = 100 * np.exp(np.cumsum(rng.normal(0.0005, 0.015, n)) + 1.2 * np.log(bench / bench[0]))
+    return (pd.DataFrame({'Adj. Close': stock}, index=index),
+            pd.DataFrame({'Adjusted Close': bench}, index=index))
+
+@pytest.mark.parametrize('log', [False, True])
+def test_float32_returns_are_rounded_once(log):
+    stock, _ = make_prices()
+    exact = tidy.compute_returns(stock['Adj. Close'], log)
+    out = np.empty(len(stock), dtype=np.float32)
+    assert tidy.compute_returns(stock['Adj. Close'], log, out=out) is out
+    np.testing.assert_array_equal(out, exact.astype(np.float32))
+
+def test_compact_fit_matches_float64_fit():
+    stock, bench = make_prices()
+    fit = alpha_beta.do_linear_regression(alpha_beta.tidy_data(stock, bench))
+    compact = alpha_beta.tidy_data(stock, bench, dtype=np.float32, const=False)
+    assert compact.dtypes.tolist() == [np.float32, np.float32]
+    compact_fit = alpha_beta.do_linear_regression(compact)
+    np.testing.assert_allclose(compact_fit.params[fit.params.index], fit.params, rtol=1e-5)
+    assert ((compact_fit.params - fit.params).abs() < 1e-4 * fit.bse).all()
+
+@pytest.mark.parametrize('window', [5, 60, 252])
+def test_rolling_fit_matches_each_window(window):
+    stock, bench = make_prices(600, seed=2)
+    returns = alpha_beta.tidy_data(stock, bench)
+    returns.iloc[[50, 51, 52, 300], 0] = np.nan
+    returns.iloc[[120, 301], 1] = np.nan
+    rolling = alpha_beta.do_rolling_linear_regression(returns, window)
+    assert rolling.index.equals(returns.index)
+    for i in [window - 1, window + 40, 299, 302, len(returns) - 1]:
+        fit = alpha_beta.do_linear_regression(returns.iloc[i - window + 1:i + 1])
+        row = rolling.iloc[i]
+        assert row['nobs'] == fit.nobs
+        assert row['alpha'] == pytest.approx(fit.params['const'], rel=1e-8, abs=1e-12)
+        assert row['beta'] == pytest.approx(fit.params['bench_ret'], rel=1e-8)
+        assert row['resid_var'] == pytest.approx(fit.scale, rel=1e-8)
+
+def test_rolling_fit_needs_three_observations():
+    stock, bench = make_prices(10)
+    returns = alpha_beta.tidy_data(stock, bench)
+    rolling = alpha_beta.do_rolling_linear_regression(returns, 3)
+    # The first return is NaN, so the window ending on day 2 has only two days
+    assert rolling[['alpha', 'beta', 'resid_var']].iloc[:3].isna().all().all()
+    assert list(rolling['nobs'].iloc[:4]) == [0, 1, 2, 3]
+    assert rolling.iloc[3:].notna().all().all()
+
+def make_panel(n=400, k=5, seed=3, outliers=False):
+    """Return the returns of k tickers, with NaN gaps in some of them, and their design of bench_ret and const."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2012-01-02', periods=n, freq='B')
+    bench = rng.normal(0.0003, 0.01, n)
+    returns = pd.DataFrame(dict(('T%d' % j, 0.0001 * j + (0.5 + 0.2 * j) * bench
+                                 + rng.standard_t(3, n) * 0.005) for j in range(k)), index=index)
+    if outliers:
+        for j in range(k):
+            returns.iloc[rng.choice(n, 8, replace=False), j] += rng.choice([-0.2, 0.2], 8)
+    returns.iloc[10:40, 1] = np.nan
+    returns.iloc[rng.choice(n, 25, replace=False), 3] = np.nan
+    returns.iloc[-5:, 4] = np.nan
+    design = pd.DataFrame({'bench_ret': bench, 'const': 1.0}, index=index)
+    design.iloc[7, 0] = np.nan
+    return returns, design
+
+def test_batch_fit_matches_ols_per_ticker():
+    returns, design = make_panel()
+    batch = alpha_beta.do_batch_linear_regression(returns, design)
+    assert list(batch.index) == list(returns.columns)
+    for ticker in returns.columns:
+        fit = sm.OLS(returns[ticker], design, missing='drop').fit()
+        row = batch.loc[ticker]
+        assert row['nobs'] == fit.nobs
+        assert row['alpha'] == pytest.approx(fit.params['const'], rel=1e-9)
+        assert row['beta'] == pytest.approx(fit.params['bench_ret'], rel=1e-9)
+        assert row['alpha_se'] == pytest.approx(fit.bse['const'], rel=1e-9)
+        assert row['beta_se'] == pytest.approx(fit.bse['bench_ret'], rel=1e-9)
+        assert row['rsquared'] == pytest.approx(fit.rsquared, rel=1e-9)
+
+def test_batch_fit_adds_the_intercept():
+    returns, design = make_panel()
+    pd.testing.assert_frame_equal(alpha_beta.do_batch_linear_regression(returns, design[['bench_ret']]),
+                                  alpha_beta.do_batch_linear_regression(returns, design))
+
+@pytest.mark.parametrize('norm', ['huber', 'tukey'])
+def test_batch_robust_fit_matches_rlm(norm):
+    returns, design = make_panel(outliers=True)
+    robust = alpha_beta.do_batch_robust_linear_regression(returns, design, norm, max_iter=200, tol=1e-12)
+    assert robust['converged'].all()
+    M = sm.robust.norms.HuberT() if norm == 'huber' else sm.robust.norms.TukeyBiweight()
+    for ticker in returns.columns:
+        fit = sm.RLM(returns[ticker], design, M=M, missing='drop').fit(scale_est='mad', conv='coefs',
+                                                                      tol=1e-12, maxiter=200)
+        row = robust.loc[ticker]
+        assert row['nobs'] == fit.nobs
+        assert row['alpha'] == pytest.approx(fit.params['const'], rel=1e-12, abs=1e-12)
+        assert row['beta'] == pytest.approx(fit.params['bench_ret'], rel=1e-12)
+        assert row['scale'] == pytest.approx(fit.scale, rel=1e-12)
+        assert row['alpha_se'] == pytest.approx(fit.bse['const'], rel=1e-12)
+        assert row['beta_se'] == pytest.approx(fit.bse['bench_ret'], rel=1e-12)
+
+@pytest.mark.parametrize('method', ['iid', 'block', 'stationary'])
+def test_bootstrap_indices(method):
+    idx = alpha_beta.bootstrap_indices(50, 200, method, block_size=5, seed=1)
+    assert idx.shape == (200, 50)
+    assert idx.min() >= 0 and idx.max() < 50
+    np.testing.assert_array_equal(idx, alpha_beta.bootstrap_indices(50, 200, method, block_size=5, seed=1))
+    steps = np.diff(idx, axis=1) % 50
+    if method == 'block':
+        # Blocks of 5 consecutive rows, each starting where it fits in the sample
+        assert (steps[:, np.arange(49) % 5 != 4] == 1).all()
+        assert (idx[:, ::5] <= 45).all()
+    elif method == 'stationary':
+        # Most steps continue a block, wrapping around the end of the sample
+        assert (steps == 1).mean() > 0.7
+
+def test_bootstrap_universe_is_reproducible():
+    returns, design = make_panel()
+    first = alpha_beta.bootstrap_alpha_beta_universe(returns, design, resamples=300, method='block',
+                                                     seed=5, max_workers=1)
+    others = alpha_beta.bootstrap_alpha_beta_universe(returns[['T3', 'T0', 'T4']], design, resamples=300,
+                                                      method='block', seed=5, max_workers=3)
+    pd.testing.assert_frame_equal(others, first.loc[['T3', 'T0', 'T4']])
+    different = alpha_beta.bootstrap_alpha_beta_universe(returns[['T0']], design, resamples=300,
+                                                         method='block', seed=6, max_workers=1)
+    assert different.loc['T0', 'beta_se'] != first.loc['T0', 'beta_se']
+
+def test_bootstrap_intervals_cover_the_fit():
+    returns, design = make_panel()
+    data = pd.DataFrame({'stock_ret': returns['T0'], 'bench_ret': design['bench_ret']})
+    intervals = alpha_beta.bootstrap_intervals(data, resamples=2000, seed=0)
+    fit = sm.OLS(data['stock_ret'], sm.add_constant(data['bench_ret']), missing='drop').fit()
+    assert intervals['beta'] == pytest.approx(fit.params['bench_ret'], rel=1e-10)
+    assert intervals['beta_lower'] < intervals['beta'] < intervals['beta_upper']
+    assert intervals['beta_se'] == pytest.approx(fit.bse['bench_ret'], rel=0.3)
+    assert intervals['nobs'] == fit.nobs
@@ -0,0 +1,31 @@
+"""The out-of-core fit of solve_experiments against the in-memory fit of the same file."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from regression import experiments
+
+@pytest.fixture
+def experiment_csv(tmp_path):
+    """Write 1000 rows of a noisy line, with a few missing values, in the column layout of the experiments."""
+    rng = np.random.default_rng(0)
+    x = rng.uniform(0, 10, 1000)
+    data = pd.DataFrame({'y': 3.0 + 0.7 * x + rng.normal(scale=0.5, size=len(x)), 'x': x, 'const': 1.0},
+                        index=pd.Index(pd.bdate_range('2000-01-03', periods=len(x)), name='Date'))
+    data.iloc[[10, 500], 0] = np.nan
+    data.iloc[[11, 999], 1] = np.nan
+    fname = tmp_path / 'experiment.csv'
+    data.to_csv(fname)
+    return str(fname)
+
+@pytest.mark.parametrize('chunksize', [1, 37, 1000, 5000])
+def test_chunked_fit_matches_in_memory_fit(experiment_csv, chunksize):
+    fit = experiments.do_linear_regression(pd.read_csv(experiment_csv, index_col=0))
+    chunked = experiments.do_chunked_linear_regression(experiment_csv, chunksize=chunksize, index_col=0)
+    assert chunked.nobs == fit.nobs
+    assert chunked.df_resid == fit.df_resid
+    np.testing.assert_allclose(chunked.params, fit.params, rtol=1e-10)
+    np.testing.assert_allclose(chunked.bse, fit.bse, rtol=1e-10)
+    assert chunked.rsquared == pytest.approx(fit.rsquared, rel=1e-10)
+    assert chunked.mse_resid == pytest.approx(fit.mse_resid, rel=1e-10)
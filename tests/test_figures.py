@@ -0,0 +1,32 @@
+"""Input hashes and the empty build of regression.figures."""
+
+import numpy as np
+import pytest
+
+from regression import figures
+
+class Model(object):
+    """A plotting input with no hash of its own, like PolynomialRegression."""
+
+    def __init__(self, coef):
+        self.coef = np.asarray(coef, dtype=float)
+        self.degree = len(coef) - 1
+
+def draw(data, model):
+    pass
+
+def test_objects_are_hashed_by_state():
+    first = figures.figure_hash(figures.figure_task('a.png', draw, [1.0, 2.0], Model([1.0, 2.0])))
+    again = figures.figure_hash(figures.figure_task('a.png', draw, [1.0, 2.0], Model([1.0, 2.0])))
+    changed = figures.figure_hash(figures.figure_task('a.png', draw, [1.0, 2.0], Model([1.0, 3.0])))
+    assert first == again
+    assert first != changed
+
+def test_objects_without_state_are_refused():
+    with pytest.raises(TypeError):
+        figures.figure_hash(figures.figure_task('a.png', draw, object()))
+
+def test_no_figures_to_build():
+    status = figures.build_figures([])
+    assert len(status) == 0
+    assert list(status.columns) == ['status', 'seconds', 'error']
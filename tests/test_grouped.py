@@ -0,0 +1,50 @@
+"""do_grouped_linear_regression against one statsmodels OLS fit per group."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+stattools = pytest.importorskip('statsmodels.stats.stattools')
+
+from regression.grouped import do_grouped_linear_regression
+
+def make_groups(seed=0):
+    """Return a long DataFrame of four groups of different sizes, with a few missing values."""
+    rng = np.random.default_rng(seed)
+    frames = []
+    for g, n in enumerate([12, 30, 7, 50]):
+        x1, x2 = rng.normal(size=n), rng.normal(size=n)
+        y = 1.0 + g - 0.5 * g * x1 + 2.0 * x2 + rng.normal(scale=0.3 + 0.2 * g, size=n)
+        frames.append(pd.DataFrame({'group': 'g%d' % g, 'y': y, 'x1': x1, 'x2': x2, 'const': 1.0}))
+    data = pd.concat(frames, ignore_index=True)
+    data.loc[[3, 40, 41], 'x1'] = np.nan
+    data.loc[60, 'y'] = np.nan
+    return data
+
+def test_matches_ols_per_group():
+    data = make_groups()
+    fits = do_grouped_linear_regression(data, by='group', response='y', predictors=['x1', 'x2', 'const'])
+    assert list(fits.index) == ['g0', 'g1', 'g2', 'g3']
+    for label, group in data.groupby('group'):
+        fit = sm.OLS(group['y'], group[['x1', 'x2', 'const']], missing='drop').fit()
+        row = fits.loc[label]
+        for name in ['x1', 'x2', 'const']:
+            assert row[name] == pytest.approx(fit.params[name], rel=1e-9, abs=1e-12)
+            assert row[name + '_se'] == pytest.approx(fit.bse[name], rel=1e-9)
+        assert row['nobs'] == fit.nobs
+        assert row['df_resid'] == fit.df_resid
+        assert row['rsquared'] == pytest.approx(fit.rsquared, rel=1e-9)
+        assert row['rsquared_adj'] == pytest.approx(fit.rsquared_adj, rel=1e-9)
+        assert row['resid_std'] == pytest.approx(np.sqrt(fit.scale), rel=1e-9)
+        assert row['durbin_watson'] == pytest.approx(stattools.durbin_watson(fit.resid), rel=1e-9)
+        influence = fit.get_influence()
+        assert row['max_leverage'] == pytest.approx(influence.hat_matrix_diag.max(), rel=1e-9)
+        assert row['max_cooks_d'] == pytest.approx(influence.cooks_distance[0].max(), rel=1e-9)
+
+def test_list_of_frames_matches_long_frame():
+    data = make_groups(1).dropna()
+    frames = [ group[['y', 'x1', 'x2', 'const']] for _, group in data.groupby('group') ]
+    by_list = do_grouped_linear_regression(frames)
+    by_column = do_grouped_linear_regression(data[['group', 'y', 'x1', 'x2', 'const']], by='group')
+    np.testing.assert_allclose(by_list.values, by_column.values, rtol=1e-12)
@@ -0,0 +1,46 @@
+"""PredictionIntervals against the intervals of statsmodels."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+from statsmodels.sandbox.regression.predstd import wls_prediction_std
+
+from regression.intervals import PredictionIntervals
+
+def make_data(n=200, seed=0):
+    """Return a DataFrame of a response y and the predictors x1, x2 and const."""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({'x1': rng.normal(size=n), 'x2': rng.uniform(0, 5, n), 'const': 1.0})
+    y = 1.5 + 0.8 * X['x1'] - 0.3 * X['x2'] + rng.normal(scale=0.4, size=n)
+    return y.rename('y'), X
+
+@pytest.mark.parametrize('ndarray', [False, True])
+def test_intervals_match_statsmodels(ndarray):
+    y, X = make_data()
+    fit = sm.OLS(y.values, X.values).fit() if ndarray else sm.OLS(y, X).fit()
+    points = make_data(50, seed=1)[1]
+    if ndarray:
+        points = points.values
+    intervals = PredictionIntervals(fit, chunksize=7)
+    frame = fit.get_prediction(points).summary_frame(alpha=0.1)
+    prediction_std, lower, upper = wls_prediction_std(fit, exog=np.asarray(points), alpha=0.1)
+
+    np.testing.assert_allclose(intervals.std(points, 'confidence'), frame['mean_se'], rtol=1e-10)
+    np.testing.assert_allclose(intervals.std(points, 'prediction'), prediction_std, rtol=1e-10)
+    preds, low, high = intervals.predict(points, 'confidence', alpha=0.1)
+    np.testing.assert_allclose(preds, frame['mean'], rtol=1e-10)
+    np.testing.assert_allclose(low, frame['mean_ci_lower'], rtol=1e-10)
+    np.testing.assert_allclose(high, frame['mean_ci_upper'], rtol=1e-10)
+    preds, low, high = intervals.predict(points, 'prediction', alpha=0.1)
+    np.testing.assert_allclose(low, frame['obs_ci_lower'], rtol=1e-10)
+    np.testing.assert_allclose(high, frame['obs_ci_upper'], rtol=1e-10)
+    np.testing.assert_allclose(low, lower, rtol=1e-10)
+    np.testing.assert_allclose(high, upper, rtol=1e-10)
+
+def test_dataframe_points_are_matched_by_name():
+    y, X = make_data()
+    intervals = PredictionIntervals(sm.OLS(y, X).fit())
+    points = make_data(20, seed=2)[1]
+    np.testing.assert_allclose(intervals.predict(points[['const', 'x2', 'x1']]), intervals.predict(points))
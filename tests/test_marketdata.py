@@ -0,0 +1,159 @@
+"""Cached market data downloads of regression.marketdata, against fake sources and a stub server."""
+
+import collections
+import http.server
+import threading
+import urllib.parse
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from regression import marketdata
+
+class FakeSource(object):
+    """A download function with the signature of quandl.get, serving business days up to last_date."""
+
+    def __init__(self, last_date="2016-12-30", fail=()):
+        self.index = pd.bdate_range("2010-01-01", last_date)
+        self.fail = set(fail)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, qticker, start_date, end_date):
+        with self.lock:
+            self.calls.append((qticker, start_date, end_date))
+        if qticker in self.fail:
+            raise marketdata.DownloadError("%s: HTTP 404" % qticker)
+        index = self.index[(self.index >= start_date) & (self.index <= end_date)]
+        return pd.DataFrame({'Adj. Close': np.arange(len(index), dtype=float) + index.dayofyear},
+                            index=pd.Index(index.strftime("%Y-%m-%d"), name='Date'))
+
+def spans(*pairs):
+    return [ (pd.Timestamp(start), pd.Timestamp(end)) for start, end in pairs ]
+
+def test_merge_spans_joins_overlapping_and_adjacent_spans():
+    merged = marketdata.merge_spans(spans(("2016-03-01", "2016-03-31"), ("2016-01-01", "2016-01-31"),
+                                          ("2016-02-01", "2016-02-10"), ("2016-03-15", "2016-04-10"),
+                                          ("2016-06-01", "2016-06-30")))
+    assert merged == spans(("2016-01-01", "2016-02-10"), ("2016-03-01", "2016-04-10"),
+                           ("2016-06-01", "2016-06-30"))
+
+def test_missing_spans_returns_the_gaps_only():
+    held = spans(("2016-03-01", "2016-03-31"), ("2016-06-01", "2016-06-30"))
+    assert marketdata.missing_spans(held, pd.Timestamp("2016-01-01"), pd.Timestamp("2016-12-31")) == \
+        spans(("2016-01-01", "2016-02-29"), ("2016-04-01", "2016-05-31"), ("2016-07-01", "2016-12-31"))
+    assert marketdata.missing_spans(held, pd.Timestamp("2016-03-05"), pd.Timestamp("2016-03-20")) == []
+
+def test_cache_fetches_only_the_gaps(tmp_path):
+    source = FakeSource()
+    first = marketdata.get_data_from_quandl("WIKI/AAPL", "2016-03-01", "2016-03-31", cache=True,
+                                            source=source, cache_dir=str(tmp_path))
+    assert source.calls == [("WIKI/AAPL", "2016-03-01", "2016-03-31")]
+
+    again = marketdata.get_data_from_quandl("WIKI/AAPL", "2016-03-01", "2016-03-31", cache=True,
+                                            source=source, cache_dir=str(tmp_path))
+    assert len(source.calls) == 1
+    pd.testing.assert_frame_equal(again, first)
+
+    wider = marketdata.get_data_from_quandl("WIKI/AAPL", "2016-01-01", "2016-06-30", cache=True,
+                                            source=source, cache_dir=str(tmp_path))
+    assert source.calls[1:] == [("WIKI/AAPL", "2016-01-01", "2016-02-29"),
+                                ("WIKI/AAPL", "2016-04-01", "2016-06-30")]
+    assert list(wider.index) == list(pd.bdate_range("2016-01-01", "2016-06-30"))
+    assert marketdata.read_binary_cache("AAPL", str(tmp_path))[1] == spans(("2016-01-01", "2016-06-30"))
+
+def test_span_ends_at_the_last_date_returned(tmp_path):
+    source = FakeSource(last_date="2016-06-30")
+    marketdata.get_data_from_quandl("WIKI/AAPL", "2016-01-01", "2016-12-31", cache=True,
+                                    source=source, cache_dir=str(tmp_path))
+    assert marketdata.read_binary_cache("AAPL", str(tmp_path))[1] == spans(("2016-01-01", "2016-06-30"))
+
+    source.index = pd.bdate_range("2010-01-01", "2016-12-30")
+    data = marketdata.get_data_from_quandl("WIKI/AAPL", "2016-01-01", "2016-12-31", cache=True,
+                                           source=source, cache_dir=str(tmp_path))
+    assert source.calls[1:] == [("WIKI/AAPL", "2016-07-01", "2016-12-31")]
+    assert data.index[-1] == pd.Timestamp("2016-12-30")
+
+def test_bulk_download_reports_failures(tmp_path):
+    source = FakeSource(fail=["WIKI/NOPE"])
+    data, failures = marketdata.get_bulk_data_from_quandl(["WIKI/AAPL", "WIKI/NOPE", "WIKI/WMT"],
+                                                          cache=True, source=source, max_workers=3,
+                                                          cache_dir=str(tmp_path))
+    assert sorted(data) == ["WIKI/AAPL", "WIKI/WMT"]
+    assert list(failures) == ["WIKI/NOPE"]
+    assert isinstance(failures["WIKI/NOPE"], marketdata.DownloadError)
+
+def test_cached_frames_are_writable(tmp_path):
+    source = FakeSource()
+    marketdata.get_data_from_quandl("WIKI/AAPL", cache=True, source=source, cache_dir=str(tmp_path))
+    data = marketdata.get_data_from_quandl("WIKI/AAPL", cache=True, source=source, cache_dir=str(tmp_path))
+    data.iloc[0, 0] = -1.0
+    assert data.iloc[0, 0] == -1.0
+    assert marketdata.read_binary_cache("AAPL", str(tmp_path))[0].iloc[0, 0] != -1.0
+
+@pytest.fixture
+def stub_server():
+    """Serve the Quandl datasets API locally; yield its URL, the statuses to answer and the requests seen.
+
+    Each ticker answers the statuses queued for it in turn, and 200 with a
+    few rows of CSV once they run out.
+    """
+    statuses = collections.defaultdict(list)
+    requests = collections.Counter()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = urllib.parse.urlsplit(self.path).path
+            qticker = path[len("/api/v3/datasets/"):-len("/data.csv")]
+            requests[qticker] += 1
+            status = statuses[qticker].pop(0) if statuses[qticker] else 200
+            body = b"Date,Adj. Close\n2016-01-04,105.35\n2016-01-05,102.71\n" if status == 200 else b"error"
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:%d/api/v3/datasets" % server.server_address[1], statuses, requests
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_http_source_reports_not_found_without_retrying(stub_server, tmp_path):
+    url, statuses, requests = stub_server
+    statuses["WIKI/NOPE"] = [404]
+    source = marketdata.make_quandl_http_source(base_url=url, requests_per_second=1000, backoff=0.01)
+    data, failures = marketdata.get_bulk_data_from_quandl(["WIKI/AAPL", "WIKI/NOPE"], source=source,
+                                                          cache_dir=str(tmp_path))
+    assert list(data) == ["WIKI/AAPL"]
+    assert list(data["WIKI/AAPL"]["Adj. Close"]) == [105.35, 102.71]
+    assert list(failures) == ["WIKI/NOPE"]
+    assert isinstance(failures["WIKI/NOPE"], marketdata.DownloadError)
+    assert "404" in str(failures["WIKI/NOPE"])
+    assert requests["WIKI/NOPE"] == 1
+
+def test_http_source_retries_unavailable(stub_server):
+    url, statuses, requests = stub_server
+    statuses["WIKI/AAPL"] = [503, 503]
+    source = marketdata.make_quandl_http_source(base_url=url, requests_per_second=1000, backoff=0.01)
+    data = source("WIKI/AAPL", start_date="2016-01-01", end_date="2016-01-31")
+    assert len(data) == 2
+    assert requests["WIKI/AAPL"] == 3
+
+def test_http_source_gives_up_after_its_retries(stub_server):
+    url, statuses, requests = stub_server
+    statuses["WIKI/AAPL"] = [503] * 10
+    source = marketdata.make_quandl_http_source(base_url=url, requests_per_second=1000,
+                                                retries=2, backoff=0.01)
+    with pytest.raises(marketdata.DownloadError, match="503 after 3 attempts"):
+        source("WIKI/AAPL", start_date="2016-01-01", end_date="2016-01-31")
+    assert requests["WIKI/AAPL"] == 3
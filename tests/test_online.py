@@ -0,0 +1,61 @@
+"""RecursiveLeastSquares against batch OLS and exponentially weighted WLS."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+
+from regression.online import RecursiveLeastSquares
+
+NAMES = ['x1', 'x2', 'const']
+
+def make_data(n=150, seed=0):
+    """Return a response and a DataFrame of the predictors x1, x2 and const, with a few NaNs."""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({'x1': rng.normal(size=n), 'x2': rng.normal(size=n), 'const': 1.0})
+    y = pd.Series(0.5 + 2.0 * X['x1'] - X['x2'] + rng.normal(scale=0.3, size=n))
+    X.iloc[17, 0] = np.nan
+    y.iloc[60] = np.nan
+    return y, X
+
+def updated(fit, y, X, batch):
+    """Feed the rows of X and y to fit one at a time (batch 1) or in mini-batches."""
+    for start in range(0, len(y), batch):
+        if batch == 1:
+            fit.update(X.iloc[start], y.iloc[start])
+        else:
+            fit.update(X.iloc[start:start + batch], y.iloc[start:start + batch])
+    return fit
+
+@pytest.mark.parametrize('batch', [1, 7, 150])
+def test_without_forgetting_matches_ols(batch):
+    y, X = make_data()
+    fit = updated(RecursiveLeastSquares(NAMES), y, X, batch)
+    ols = sm.OLS(y, X, missing='drop').fit()
+    assert fit.nobs == ols.nobs
+    assert fit.df_resid == ols.df_resid
+    np.testing.assert_allclose(fit.params[NAMES], ols.params[NAMES], rtol=1e-9)
+    np.testing.assert_allclose(fit.bse[NAMES], ols.bse[NAMES], rtol=1e-8)
+    assert fit.mse_resid == pytest.approx(ols.mse_resid, rel=1e-8)
+    np.testing.assert_allclose(fit.predict(X.iloc[:5]), ols.predict(X.iloc[:5]), rtol=1e-9)
+
+@pytest.mark.parametrize('batch', [1, 7, 150])
+def test_forgetting_matches_exponentially_weighted_wls(batch):
+    y, X = make_data()
+    forgetting = 0.97
+    fit = updated(RecursiveLeastSquares(NAMES, forgetting), y, X, batch)
+    # The row that arrived k rows before the last one keeps the weight forgetting ** k
+    keep = X.notna().all(axis=1) & y.notna()
+    weights = forgetting ** np.arange(keep.sum() - 1, -1, -1.0)
+    wls = sm.WLS(y[keep], X[keep], weights=weights).fit()
+    np.testing.assert_allclose(fit.params[NAMES], wls.params[NAMES], rtol=1e-8)
+    assert fit.nobs == pytest.approx(weights.sum(), rel=1e-12)
+    assert fit.ssr == pytest.approx(wls.ssr, rel=1e-8)
+
+def test_params_are_nan_until_identified():
+    y, X = make_data()
+    fit = RecursiveLeastSquares(NAMES).update(X.iloc[:2], y.iloc[:2])
+    assert fit.params.isna().all()
+    fit.update(X.iloc[2], y.iloc[2])
+    assert fit.params.notna().all()
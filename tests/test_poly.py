@@ -0,0 +1,45 @@
+"""The polynomial fits of fit-poly against statsmodels OLS on monomial columns."""
+
+import numpy as np
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+
+from regression import poly
+
+MAX_DEGREE = 6
+
+def make_points(n=80, seed=0):
+    """Return n noisy points of a smooth curve on [1, 4], with a missing response."""
+    rng = np.random.default_rng(seed)
+    x = rng.uniform(1, 4, n)
+    y = np.exp(x / 2) * np.sin(2 * x) + rng.normal(scale=0.2, size=n)
+    y[7] = np.nan
+    return x, y
+
+def test_every_degree_matches_ols():
+    x, y = make_points()
+    fits = poly.PolynomialRegression(x, y, MAX_DEGREE)
+    keep = ~np.isnan(y)
+    grid = np.linspace(1, 4, 25)
+    for degree in range(MAX_DEGREE + 1):
+        ols = sm.OLS(y[keep], poly.monomial_basis(x[keep], degree)).fit()
+        assert fits.ssr[degree] == pytest.approx(ols.ssr, rel=1e-9)
+        expected = ols.predict(poly.monomial_basis(grid, degree))
+        np.testing.assert_allclose(fits.predict(grid, degree), expected, rtol=1e-8, atol=1e-10)
+        np.testing.assert_allclose(fits.predict(grid)[degree], expected, rtol=1e-8, atol=1e-10)
+        assert fits.fit(degree).ssr == pytest.approx(ols.ssr, rel=1e-9)
+
+def test_cross_validation_matches_ols_refits():
+    x, y = make_points()
+    errors = poly.cross_validate_polynomial(x, y, MAX_DEGREE, folds=4, seed=3)
+    keep = ~np.isnan(y)
+    x, y = x[keep], y[keep]
+    fold = np.random.RandomState(3).permutation(len(y)) % 4
+    for degree in range(MAX_DEGREE + 1):
+        sse = 0.0
+        for k in range(4):
+            train, test = fold != k, fold == k
+            ols = sm.OLS(y[train], poly.monomial_basis(x[train], degree)).fit()
+            sse += ((ols.predict(poly.monomial_basis(x[test], degree)) - y[test]) ** 2).sum()
+        assert errors[degree] == pytest.approx(sse / len(y), rel=1e-8)
@@ -0,0 +1,140 @@
+"""The functions of predict-returns against plain pandas and statsmodels."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sm = pytest.importorskip('statsmodels.api')
+
+from regression import returns
+
+def make_returns(n=300, seed=0):
+    """Return a tidy frame of n days of stock_ret and bench_ret, without const."""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range('2010-01-01', periods=n, freq='B')
+    bench = rng.normal(0.0003, 0.01, n)
+    return pd.DataFrame({'stock_ret': 0.0002 + 1.1 * bench + rng.normal(0, 0.01, n), 'bench_ret': bench},
+                        index=index)
+
+def test_lag_names_are_padded_per_column():
+    data = make_returns()
+    lagged = returns.build_lag_features(data, {'stock_ret': 120, 'bench_ret': 5})
+    names = list(lagged.columns)
+    assert names[:2] == ['stock_ret', 'bench_ret']
+    assert names[2:4] == ['stock_ret_001', 'stock_ret_002']
+    assert names[121] == 'stock_ret_120'
+    assert names[122:127] == [ 'bench_ret_%02d' % k for k in range(1, 6) ]
+    assert names[-1] == 'const'
+
+def test_lags_are_shifted_copies():
+    data = make_returns()
+    lagged = returns.build_lag_features(data, {'stock_ret': 12, 'bench_ret': 2}, const=False)
+    for k in (1, 2, 12):
+        pd.testing.assert_series_equal(lagged['stock_ret_%02d' % k], data['stock_ret'].shift(k),
+                                       check_names=False)
+    pd.testing.assert_series_equal(lagged['bench_ret_02'], data['bench_ret'].shift(2), check_names=False)
+    lagged.iloc[0, 2] = 0.0
+    lagged.fillna(0.0, inplace=True)
+    assert not lagged.isna().any().any()
+
+def make_lagged(n=260, seed=0):
+    """Return a tidy frame of n days with 2 lags of stock_ret, const and a few missing values."""
+    data = returns.build_lag_features(make_returns(n, seed), {'stock_ret': 2})
+    data.iloc[100, 0] = np.nan
+    data.iloc[150, 1] = np.nan
+    return data
+
+def refit_predictions(data, window, min_train):
+    """Predict each day from a separate OLS fit of the training days before it."""
+    preds = pd.Series(np.nan, index=data.index)
+    for t in range(len(data)):
+        train = data.iloc[max(0, t - window) if window else 0:t].dropna()
+        point = data.iloc[t].drop('stock_ret')
+        if len(train) >= min_train and point.notna().all():
+            fit = sm.OLS(train['stock_ret'], train.drop(columns=['stock_ret'])).fit()
+            preds.iloc[t] = point.dot(fit.params[point.index])
+    return preds
+
+@pytest.mark.parametrize('window', [None, 40])
+def test_walk_forward_matches_refits(window):
+    data = make_lagged()
+    backtest = returns.walk_forward_backtest(data, window=window, min_train=30)
+    expected = refit_predictions(data, window, 30)
+    np.testing.assert_allclose(backtest['prediction'], expected, rtol=1e-8, atol=1e-14)
+    scored = backtest['error'].notna()
+    assert backtest['rmse'].iloc[-1] == pytest.approx(np.sqrt((backtest['error'][scored] ** 2).mean()))
+
+def test_walk_forward_rebuilds_a_failed_downdate(monkeypatch):
+    data = make_lagged()
+    expected = returns.walk_forward_backtest(data, window=40, min_train=30)
+    update = returns.cholesky_update
+    calls = []
+
+    def failing_downdate(L, x, sign=1.0):
+        calls.append(sign)
+        return sign > 0 and update(L, x, sign)
+
+    monkeypatch.setattr(returns, 'cholesky_update', failing_downdate)
+    rebuilt = returns.walk_forward_backtest(data, window=40, min_train=30)
+    assert -1.0 in calls
+    pd.testing.assert_frame_equal(rebuilt, expected, rtol=1e-8, atol=1e-14)
+
+@pytest.mark.parametrize('sign', [1.0, -1.0])
+def test_cholesky_update(sign):
+    rng = np.random.default_rng(4)
+    A = rng.normal(size=(20, 4))
+    G = A.T.dot(A)
+    x = A[3] if sign < 0 else rng.normal(size=4)
+    L = np.linalg.cholesky(G)
+    assert returns.cholesky_update(L, x, sign)
+    np.testing.assert_allclose(L, np.linalg.cholesky(G + sign * np.outer(x, x)), rtol=1e-10, atol=1e-12)
+
+def make_candidates(n=200, seed=5):
+    """Return a frame of stock_ret and 7 candidate predictors, 3 of which matter, with a few NaNs."""
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, 7)), columns=[ 'c%d' % i for i in range(7) ])
+    X['c6'] = X['c0'] + rng.normal(scale=0.5, size=n)
+    y = 0.3 + 0.5 * X['c0'] - 0.3 * X['c3'] + 0.15 * X['c5'] + rng.normal(size=n)
+    data = pd.concat([y.rename('stock_ret'), X], axis=1)
+    data.iloc[[4, 90], [0, 3]] = np.nan
+    return data
+
+def ols_score(data, columns, criterion):
+    """Score a model by a statsmodels OLS fit with an intercept; lower is better."""
+    fit = sm.OLS(data['stock_ret'], data[list(columns) + ['const']]).fit()
+    return {'aic': fit.aic, 'bic': fit.bic, 'adjr2': -fit.rsquared_adj}[criterion]
+
+def exhaustive_selection(data, criterion, method):
+    """Select the columns of data other than stock_ret and const by refitting every model considered."""
+    data = data.dropna().assign(const=1.0)
+    candidates = [ col for col in data.columns if col not in ('stock_ret', 'const') ]
+    score = lambda columns: ols_score(data, sorted(columns, key=candidates.index), criterion)
+    if method == 'best':
+        subsets = [ [ col for i, col in enumerate(candidates) if mask >> i & 1 ]
+                    for mask in range(2 ** len(candidates)) ]
+        return min(subsets, key=score)
+    included = [] if method == 'forward' else list(candidates)
+    current = score(included)
+    while True:
+        if method == 'forward':
+            options = [ included + [col] for col in candidates if col not in included ]
+        else:
+            options = [ [ col for col in included if col != drop ] for drop in included ]
+        if not options:
+            break
+        best = min(options, key=score)
+        if score(best) >= current:
+            break
+        included, current = best, score(best)
+    return sorted(included, key=candidates.index)
+
+@pytest.mark.parametrize('const', [True, False])
+@pytest.mark.parametrize('method', ['best', 'forward', 'backward'])
+@pytest.mark.parametrize('criterion', ['aic', 'bic', 'adjr2'])
+def test_select_features_matches_exhaustive_search(criterion, method, const):
+    data = make_candidates()
+    frame = data.assign(const=1.0) if const else data
+    columns, fit = returns.select_features(frame, criterion, method, max_workers=2)
+    expected = exhaustive_selection(data, criterion, method)
+    assert columns == expected + (['const'] if const else [])
+    assert list(fit.params.index) == expected + ['const']
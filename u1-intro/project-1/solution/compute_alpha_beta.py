@@ -7,41 +7,32 @@ The actual example is to compute alpha and beta for AAPL stock,
 relative to the S&P500 average.
 """
 
+import os
 import os.path
+import sys
+import concurrent.futures
+import multiprocessing
+import zlib
+import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-import matplotlib.pyplot as plt
 
-from statsmodels.sandbox.regression.predstd \
-    import wls_prediction_std
+# The code shared by the examples lives in the regression package, at the
+# root of the repository
+_root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
 
-# The Quandl package makes it easy to access market data
-# It is available from https://pypi.python.org/pypi/Quandl
-import quandl 
+from regression.figures import build_figures, figure_task
+from regression.intervals import PredictionIntervals
+from regression.lazy import LazyModule
+from regression.marketdata import get_bulk_data_from_quandl, migrate_csv_cache
+from regression.online import RecursiveLeastSquares
+from regression.plotting import plot_scatter
+from regression.tidy import compute_returns, masked_design
+from regression.tracing import start_tracing, stop_tracing, traced
 
-def get_data_from_quandl(qticker, 
-                         start_date="2016-01-01", end_date="2016-12-31", 
-                         cache=False):
-    """Download data from Quandl service.
-    
-    Arguments:
-        qticker    -- ticker in Quandl format, e.g., "WIKI/AAPL"
-        start_date -- first date to retrieve (default "2016-01-01")
-        end_date   -- last date to retrieve (default "2016-12-31")
-        cache      -- True if local cache should be used (default False)
-    """
-    base, ticker = qticker.split("/")
-    fname = os.path.join("..", "data", "cache", ticker + ".csv")
-    if cache and os.path.isfile(fname):
-        data = pd.read_csv(fname, index_col=0)
-        return data
-    data = quandl.get(qticker,
-                      start_date=start_date, end_date=end_date)
-    data.to_csv(fname)
-    return data
-
-aapl = get_data_from_quandl("WIKI/AAPL", cache=True)
-sp500 = get_data_from_quandl("YAHOO/INDEX_GSPC", cache=True)
+sm = LazyModule('statsmodels.api')
+plt = LazyModule('matplotlib.pyplot')
 
 def visualize_raw_data(stock, benchmark, stock_name, benchmark_name):
     """Create a line chart of the stock and the benchmark.
@@ -50,50 +41,53 @@ def visualize_raw_data(stock, benchmark, stock_name, benchmark_name):
         stock     -- DataFrame of the stock of interest, must have 'Adj. Close' column
         benchmark -- DataFrame of the benchmark index, must have 'Adjusted Close' column
     """
-    df = pd.merge(aapl[['Adj. Close']], sp500[['Adjusted Close']], left_index=True, right_index=True)
+    df = pd.merge(stock[['Adj. Close']], benchmark[['Adjusted Close']], left_index=True, right_index=True)
     df.rename(columns={'Adj. Close': stock_name, 'Adjusted Close': benchmark_name}, inplace=True)
     ax = df.plot(kind='line', secondary_y=[benchmark_name], title='Raw Data')
     ax.set_xlabel('Date')
     ax.set_ylabel(stock_name)
     ax.right_ax.set_ylabel(benchmark_name)
 
-visualize_raw_data(aapl, sp500, 'AAPL', 'S&P 500')
-plt.savefig(os.path.join("..", 'img', 'raw-data-plot.png'))
-
-
-def tidy_data(stock, benchmark):
+@traced('tidy')
+def tidy_data(stock, benchmark, dtype=None, log=False, const=True):
     """Create a tidy data frame that we can use for liner regression.
     
     The data frame will have the following columns:
         stock_ret -- 1 day return of the stock of interest (y, or dependent variable)
         bench_ret -- 1 day return of the benchmark index (x, or independent variable)
-        const     -- constant column of all ones
+        const     -- constant column of all ones (only if const)
+
+    The returns are computed by compute_returns straight into the columns of
+    one block of dtype. For long series, dtype=np.float32 and const=False
+    keep the frame at a third of its default size; do_linear_regression and
+    do_batch_linear_regression then add the intercept themselves. On the
+    2016 AAPL and S&P 500 data, alpha and beta fitted from float32 returns
+    agree with the float64 ones to a relative 1e-6, about 1e-7 of their
+    standard errors.
     
     Arguments:
         stock     -- DataFrame of the stock of interest, must have 'Adj. Close' column
         benchmark -- DataFrame of the benchmark index, must have 'Adjusted Close' column
+        dtype     -- float type of the returns, e.g., np.float32 (default float64)
+        log       -- compute log returns instead of simple returns (default False)
+        const     -- add the const column, rather than leave the intercept implicit (default True)
     
     Note: The 'Adj.' vs. 'Adjusted' convention preserves the Quandl naming convention
     for WIKI stock database, vs. YAHOO index database
     """
-    def compute_returns(s):
-        """Compute 1-day returns of a time series of non-negative values.
-        
-        Arguments:
-            s -- a Series of raw data
-        """
-        today, yesterday = s, s.shift(1)
-        return (today - yesterday) / yesterday
-        
-    df = pd.DataFrame(index=stock.index)    
-    df['stock_ret'] = compute_returns(stock['Adj. Close'])
-    df['bench_ret'] = compute_returns(benchmark['Adjusted Close'])
-    df['const'] = 1
+    block = np.empty((len(stock), 2), dtype=dtype or np.float64, order='F')
+    compute_returns(stock['Adj. Close'], log, out=block[:, 0])
+    if benchmark.index.equals(stock.index):
+        compute_returns(benchmark['Adjusted Close'], log, out=block[:, 1])
+    else:
+        # Returns are computed on the dates of the benchmark, then aligned
+        bench_ret = compute_returns(benchmark['Adjusted Close'], log)
+        block[:, 1] = pd.Series(bench_ret, index=benchmark.index).reindex(stock.index).values
+    df = pd.DataFrame(block, index=stock.index, columns=['stock_ret', 'bench_ret'], copy=False)
+    if const:
+        df['const'] = 1
     return df
 
-tidy_data = tidy_data(aapl, sp500)
-tidy_data.to_csv(os.path.join("..", "data", "aapl-sp500.csv"))
-
 def visualize_data(data, stock, benchmark, axis_low=-0.1, axis_high=0.1):
     """Create a scatter plot of the stock returns vs. the benchmark returns.
     
@@ -104,29 +98,425 @@ def visualize_data(data, stock, benchmark, axis_low=-0.1, axis_high=0.1):
         axis_low  -- lowest value for x and y axes (defult -0.1)
         axis_high -- highest value for x and y axes (defult 0.1)
     """
-    ax = data.plot(kind='scatter', x='bench_ret', y='stock_ret',
-                   title='1-Day Returns',
-                   xlim=(axis_low, axis_high), ylim=(axis_low, axis_high))
+    ax = plot_scatter(data, x='bench_ret', y='stock_ret',
+                      title='1-Day Returns',
+                      xlim=(axis_low, axis_high), ylim=(axis_low, axis_high))
     ax.set_xlabel(benchmark)
     ax.set_ylabel(stock)
     ax.set_aspect(1)
 
-visualize_data(tidy_data, 'AAPL', 'S&P 500', axis_low=-0.075, axis_high=0.075)
-plt.savefig(os.path.join("..", 'img', 'scatter-plot.png'))
-
+@traced('fit')
 def do_linear_regression(data):
     """Perform a linear regression for stock_ret based on bench_ret and const of the DataFrame.
+
+    Without a const column, the intercept is added by masked_design.
     
     Arguments:
-        data      -- a tidy DataFrame, with columns stock_ret, bench_ret, and const
+        data      -- a tidy DataFrame, with columns stock_ret, bench_ret, and const (optional)
     """
+    if 'const' not in data:
+        return sm.OLS(*masked_design(data, 'stock_ret', ['bench_ret'])).fit()
     model = sm.OLS(data['stock_ret'], 
                    data[['bench_ret', 'const']],
                    missing='drop')
     fit = model.fit()
     return fit
 
-fit = do_linear_regression(tidy_data)
+@traced('fit')
+def do_batch_linear_regression(returns, design):
+    """Perform linear regressions for many stocks against one shared design in a single solve.
+
+    Complete columns of returns share the Gram matrix of the design, so it is
+    factorized once and applied to all of them with one matrix product.
+    Columns with NaN gaps get their own masked Gram matrices, built for all
+    such columns at once and solved as a batch, instead of one fit per ticker.
+
+    Returns a DataFrame indexed by ticker with columns alpha, beta, alpha_se,
+    beta_se, rsquared and nobs.
+
+    Arguments:
+        returns -- a DataFrame of 1 day returns, one column per ticker
+        design  -- a DataFrame with columns bench_ret and const (optional), on the same index as returns
+    """
+    if 'const' not in design:
+        design = design[['bench_ret']].assign(const=1.0)
+    design = design[['bench_ret', 'const']]
+    rows = design.notnull().all(axis=1).values
+    X = design.values[rows].astype(float)
+    Y = returns.values[rows].astype(float)
+    mask = ~np.isnan(Y)
+    Y0 = np.where(mask, Y, 0.0)
+    n, p = X.shape
+    k = Y.shape[1]
+
+    full = mask.all(axis=0)
+    params = np.empty((p, k))
+    gram_inv = np.empty((k, p, p))
+    if full.any():
+        gram = X.T.dot(X)
+        chol = np.linalg.cholesky(gram)
+        inv_chol = np.linalg.inv(chol)
+        shared_inv = inv_chol.T.dot(inv_chol)
+        gram_inv[full] = shared_inv
+        params[:, full] = shared_inv.dot(X.T.dot(Y0[:, full]))
+    if (~full).any():
+        m = mask[:, ~full].astype(float)
+        pairs = (X[:, :, None] * X[:, None, :]).reshape(n, p * p)
+        grams = pairs.T.dot(m).T.reshape(-1, p, p)
+        xty = X.T.dot(Y0[:, ~full]).T
+        grams_inv = np.linalg.pinv(grams)
+        gram_inv[~full] = grams_inv
+        params[:, ~full] = np.einsum('kij,kj->ik', grams_inv, xty)
+
+    nobs = mask.sum(axis=0)
+    resid = (Y0 - X.dot(params)) * mask
+    ssr = (resid ** 2).sum(axis=0)
+    ybar = Y0.sum(axis=0) / nobs
+    tss = (((Y0 - ybar) * mask) ** 2).sum(axis=0)
+    scale = ssr / (nobs - p)
+    bse = np.sqrt(scale[:, None] * np.diagonal(gram_inv, axis1=1, axis2=2))
+
+    return pd.DataFrame({'alpha': params[1], 'beta': params[0],
+                         'alpha_se': bse[:, 1], 'beta_se': bse[:, 0],
+                         'rsquared': 1 - ssr / tss, 'nobs': nobs},
+                        index=returns.columns,
+                        columns=['alpha', 'beta', 'alpha_se', 'beta_se', 'rsquared', 'nobs'])
+
+def huber_norm(u, t=1.345):
+    """Return rho, the IRLS weights psi(u) / u and psi'(u) of Huber's norm.
+
+    Arguments:
+        u -- array of standardized residuals
+        t -- tuning constant (default 1.345)
+    """
+    a = np.abs(u)
+    inside = a <= t
+    with np.errstate(divide='ignore'):
+        return (np.where(inside, 0.5 * u * u, t * a - 0.5 * t * t),
+                np.where(inside, 1.0, t / a),
+                inside.astype(float))
+
+def tukey_norm(u, c=4.685):
+    """Return rho, the IRLS weights psi(u) / u and psi'(u) of Tukey's biweight.
+
+    Arguments:
+        u -- array of standardized residuals
+        c -- tuning constant (default 4.685)
+    """
+    z2 = (u / c) ** 2
+    inside = z2 <= 1
+    return (np.where(inside, c * c / 6 * (1 - (1 - z2) ** 3), c * c / 6),
+            np.where(inside, (1 - z2) ** 2, 0.0),
+            np.where(inside, (1 - z2) * (1 - 5 * z2), 0.0))
+
+ROBUST_NORMS = {'huber': huber_norm, 'tukey': tukey_norm}
+
+@traced('fit')
+def do_batch_robust_linear_regression(returns, design, norm='huber', tuning=None, start=None,
+                                      max_iter=50, tol=1e-8):
+    """Perform robust linear regressions for many stocks against one shared design at once.
+
+    Each stock is fitted by iteratively reweighted least squares (IRLS), as
+    statsmodels RLM does with scale_est='mad' and conv='coefs': the weights
+    of the standardized residuals define a weighted least squares step, and
+    the scale is re-estimated from the median absolute residual after
+    each step. All stocks take their step together, from one product of the
+    design with the matrix of weights, and a stock leaves the iteration once
+    no coefficient moves by more than tol, so the shared loop runs until the
+    slowest stock converges. The iteration starts from the OLS fit, or warm
+    from start, e.g., the robust fit of the day before.
+
+    Returns a DataFrame indexed by ticker with columns alpha, beta, alpha_se,
+    beta_se (with the H1 covariance of RLM), scale, nobs, iterations and
+    converged.
+
+    Arguments:
+        returns  -- a DataFrame of 1 day returns, one column per ticker
+        design   -- a DataFrame with columns bench_ret and const (optional), on the same index as returns
+        norm     -- 'huber' or 'tukey' (default 'huber')
+        tuning   -- tuning constant of the norm (default 1.345 for Huber, 4.685 for Tukey)
+        start    -- DataFrame indexed by ticker with columns alpha and beta to start
+                    from; other tickers start from OLS (default None)
+        max_iter -- most reweighting steps (default 50)
+        tol      -- largest change of a coefficient at convergence (default 1e-8)
+    """
+    if norm not in ROBUST_NORMS:
+        raise ValueError("unknown norm %r" % norm)
+    evaluate = ROBUST_NORMS[norm] if tuning is None else (lambda u: ROBUST_NORMS[norm](u, tuning))
+    if 'const' not in design:
+        design = design[['bench_ret']].assign(const=1.0)
+    design = design[['bench_ret', 'const']]
+    rows = design.notnull().all(axis=1).values
+    X = design.values[rows].astype(float)
+    Y = returns.values[rows].astype(float)
+    mask = ~np.isnan(Y)
+    Y0 = np.where(mask, Y, 0.0)
+    n, p = X.shape
+    k = Y.shape[1]
+    pairs = (X[:, :, None] * X[:, None, :]).reshape(n, p * p)
+
+    def solve(W, cols):
+        """Weighted least squares of the columns cols of Y, with weights W."""
+        grams = pairs.T.dot(W).T.reshape(-1, p, p)
+        xty = X.T.dot(W * Y0[:, cols]).T
+        return np.einsum('kij,kj->ki', np.linalg.pinv(grams), xty)
+
+    def mad(resid, cols):
+        """Scale of the residuals of the columns cols, from their median absolute value."""
+        return np.nanmedian(np.where(mask[:, cols], np.abs(resid), np.nan), axis=0) / 0.6744897501960817
+
+    everything = np.arange(k)
+    params = np.full((k, p), np.nan)
+    if start is not None:
+        params[:] = start.reindex(returns.columns)[['beta', 'alpha']].values
+    cold = np.flatnonzero(np.isnan(params).any(axis=1))
+    if len(cold):
+        params[cold] = solve(mask[:, cold].astype(float), cold)
+    resid = (Y0 - X.dot(params.T)) * mask
+    with np.errstate(invalid='ignore'):
+        scale = mad(resid, everything)
+    iterations = np.zeros(k, dtype=int)
+    converged = scale == 0
+    active = np.flatnonzero(scale > 0)
+    for i in range(max_iter):
+        if not len(active):
+            break
+        W = evaluate(resid[:, active] / scale[active])[1] * mask[:, active]
+        new = solve(W, active)
+        step = np.abs(new - params[active]).max(axis=1)
+        params[active] = new
+        resid[:, active] = (Y0[:, active] - X.dot(new.T)) * mask[:, active]
+        scale[active] = mad(resid[:, active], active)
+        iterations[active] += 1
+        done = (step <= tol) | ~(scale[active] > 0)
+        converged[active[done]] = True
+        active = active[~done]
+
+    # H1 covariance of Huber (1981), as in RLMResults.bcov_scaled
+    nobs = mask.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = resid / scale
+        rho, weights, psi_deriv = evaluate(u)
+        psi = u * weights * mask
+        psi_deriv = psi_deriv * mask
+        m = psi_deriv.sum(axis=0) / nobs
+        var_psi_deriv = (psi_deriv ** 2).sum(axis=0) / nobs - m ** 2
+        kappa = 1 + p / nobs * var_psi_deriv / m ** 2
+        factor = kappa ** 2 * (psi ** 2).sum(axis=0) * scale ** 2 / (nobs - p) / m ** 2
+        grams_inv = np.linalg.pinv(pairs.T.dot(mask.astype(float)).T.reshape(k, p, p))
+        bse = np.sqrt(factor[:, None] * np.diagonal(grams_inv, axis1=1, axis2=2))
+
+    return pd.DataFrame({'alpha': params[:, 1], 'beta': params[:, 0],
+                         'alpha_se': bse[:, 1], 'beta_se': bse[:, 0], 'scale': scale,
+                         'nobs': nobs, 'iterations': iterations, 'converged': converged},
+                        index=returns.columns,
+                        columns=['alpha', 'beta', 'alpha_se', 'beta_se', 'scale', 'nobs',
+                                 'iterations', 'converged'])
+
+def do_robust_linear_regression(data, norm='huber', **kwargs):
+    """Perform a robust linear regression for stock_ret based on bench_ret and const.
+
+    Returns a Series with the columns of do_batch_robust_linear_regression.
+
+    Arguments:
+        data   -- a tidy DataFrame, with columns stock_ret, bench_ret, and const (optional)
+        norm   -- 'huber' or 'tukey' (default 'huber')
+        kwargs -- tuning, start, max_iter and tol of do_batch_robust_linear_regression
+    """
+    fits = do_batch_robust_linear_regression(data[['stock_ret']], data.drop(columns=['stock_ret']),
+                                             norm, **kwargs)
+    return fits.iloc[0]
+
+@traced('fit')
+def do_rolling_linear_regression(data, window):
+    """Perform a rolling linear regression for stock_ret based on bench_ret and const.
+
+    Running means and co-moments of the observations in the window are kept
+    up to date by adding the newest day and removing the one that left the
+    window, so each step costs O(1) regardless of the window length. Days
+    where either return is NaN are skipped, as with missing='drop'.
+
+    Returns a DataFrame on the index of data with columns alpha, beta,
+    resid_var and nobs; dates with fewer than 3 observations in the window
+    are NaN.
+
+    Arguments:
+        data      -- a tidy DataFrame, with columns stock_ret and bench_ret
+        window    -- number of trading days in each window, e.g. 60, 120 or 252
+    """
+    xs = data['bench_ret'].values
+    ys = data['stock_ret'].values
+    valid = ~(np.isnan(xs) | np.isnan(ys))
+    out = np.full((len(data), 4), np.nan)
+    n, mx, my, cxx, cxy, cyy = 0, 0.0, 0.0, 0.0, 0.0, 0.0
+    for i in range(len(data)):
+        if valid[i]:
+            x, y = xs[i], ys[i]
+            n += 1
+            dx = x - mx
+            mx += dx / n
+            dy = y - my
+            my += dy / n
+            cxx += dx * (x - mx)
+            cxy += dx * (y - my)
+            cyy += dy * (y - my)
+        j = i - window
+        if j >= 0 and valid[j]:
+            x, y = xs[j], ys[j]
+            n -= 1
+            if n == 0:
+                mx, my, cxx, cxy, cyy = 0.0, 0.0, 0.0, 0.0, 0.0
+            else:
+                dx = x - mx
+                mx -= dx / n
+                dy = y - my
+                my -= dy / n
+                cxx -= dx * (x - mx)
+                cxy -= dx * (y - my)
+                cyy -= dy * (y - my)
+        if n > 2 and cxx > 0:
+            beta = cxy / cxx
+            out[i] = (my - beta * mx, beta, (cyy - beta * cxy) / (n - 2), n)
+        else:
+            out[i, 3] = n
+    return pd.DataFrame(out, index=data.index,
+                        columns=['alpha', 'beta', 'resid_var', 'nobs'])
+
+def bootstrap_indices(n, resamples, method='iid', block_size=None, seed=None):
+    """Return a (resamples, n) matrix of row indices, one bootstrap sample per row.
+
+    All samples are drawn at once. 'iid' draws rows independently; 'block' is
+    the moving block bootstrap, which concatenates blocks of block_size
+    consecutive rows; 'stationary' is the stationary bootstrap of Politis and
+    Romano, whose blocks have geometric lengths of mean block_size and wrap
+    around the end of the sample.
+
+    Arguments:
+        n          -- number of rows of the sample
+        resamples  -- number of bootstrap samples
+        method     -- 'iid', 'block' or 'stationary' (default 'iid')
+        block_size -- (mean) block length (default n ** (1/3))
+        seed       -- seed, SeedSequence or Generator of the random numbers
+    """
+    rng = np.random.default_rng(seed)
+    if method == 'iid':
+        return rng.integers(0, n, size=(resamples, n))
+    if block_size is None:
+        block_size = max(1, int(round(n ** (1.0 / 3))))
+    block_size = min(block_size, n)
+    if method == 'block':
+        blocks = -(-n // block_size)
+        starts = rng.integers(0, n - block_size + 1, size=(resamples, blocks))
+        idx = starts[:, :, None] + np.arange(block_size)
+        return idx.reshape(resamples, -1)[:, :n]
+    if method == 'stationary':
+        positions = np.arange(n)
+        # A new block starts at each position with probability 1 / block_size
+        new = rng.random((resamples, n)) < 1.0 / block_size
+        new[:, 0] = True
+        starts = rng.integers(0, n, size=(resamples, n))
+        last = np.maximum.accumulate(np.where(new, positions, 0), axis=1)
+        return (np.take_along_axis(starts, last, axis=1) + positions - last) % n
+    raise ValueError("unknown bootstrap method %r" % (method,))
+
+def bootstrap_alpha_beta(data, resamples=10000, method='iid', block_size=None, seed=None,
+                         chunksize=1000):
+    """Return a DataFrame of alpha and beta on bootstrap samples of a tidy data frame.
+
+    The regression has a single predictor, so each sample is solved in closed
+    form from its means and cross products, for a chunk of samples at a time,
+    instead of fitting one model per sample.
+
+    Arguments:
+        data       -- a tidy DataFrame, with columns stock_ret and bench_ret
+        resamples  -- number of bootstrap samples (default 10000)
+        method     -- 'iid', 'block' or 'stationary' (default 'iid')
+        block_size -- (mean) block length (default n ** (1/3))
+        seed       -- seed, SeedSequence or Generator of the random numbers
+        chunksize  -- samples solved at once, bounding the memory used
+    """
+    data = data[['stock_ret', 'bench_ret']].dropna()
+    y = data['stock_ret'].values.astype(float)
+    x = data['bench_ret'].values.astype(float)
+    rng = np.random.default_rng(seed)
+    out = np.empty((resamples, 2))
+    for start in range(0, resamples, chunksize):
+        stop = min(start + chunksize, resamples)
+        idx = bootstrap_indices(len(x), stop - start, method, block_size, rng)
+        xs, ys = x[idx], y[idx]
+        mx = xs.mean(axis=1)
+        my = ys.mean(axis=1)
+        dx = xs - mx[:, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            beta = (dx * (ys - my[:, None])).sum(axis=1) / (dx * dx).sum(axis=1)
+        out[start:stop, 0] = my - beta * mx
+        out[start:stop, 1] = beta
+    return pd.DataFrame(out, columns=['alpha', 'beta'])
+
+@traced('fit')
+def bootstrap_intervals(data, resamples=10000, method='iid', block_size=None, level=0.95,
+                        seed=None):
+    """Return alpha and beta of a tidy data frame with their bootstrap intervals.
+
+    Returns a Series with alpha, beta, their bootstrap standard errors
+    alpha_se and beta_se, the percentile intervals alpha_lower, alpha_upper,
+    beta_lower and beta_upper, and nobs.
+
+    Arguments:
+        data       -- a tidy DataFrame, with columns stock_ret and bench_ret
+        resamples  -- number of bootstrap samples (default 10000)
+        method     -- 'iid', 'block' or 'stationary' (default 'iid')
+        block_size -- (mean) block length (default n ** (1/3))
+        level      -- confidence level of the intervals (default 0.95)
+        seed       -- seed, SeedSequence or Generator of the random numbers
+    """
+    data = data[['stock_ret', 'bench_ret']].dropna()
+    draws = bootstrap_alpha_beta(data, resamples, method, block_size, seed).values
+    x = data['bench_ret'].values
+    y = data['stock_ret'].values
+    dx = x - x.mean()
+    beta = (dx * (y - y.mean())).sum() / (dx * dx).sum()
+    tail = 100 * (1 - level) / 2
+    lower, upper = np.nanpercentile(draws, [tail, 100 - tail], axis=0)
+    se = np.nanstd(draws, axis=0, ddof=1)
+    return pd.Series([y.mean() - beta * x.mean(), beta, se[0], se[1],
+                      lower[0], upper[0], lower[1], upper[1], len(data)],
+                     index=['alpha', 'beta', 'alpha_se', 'beta_se', 'alpha_lower',
+                            'alpha_upper', 'beta_lower', 'beta_upper', 'nobs'])
+
+@traced('fit')
+def bootstrap_alpha_beta_universe(returns, design, resamples=10000, method='iid', block_size=None,
+                                  level=0.95, seed=0, max_workers=None):
+    """Compute bootstrap intervals of alpha and beta for many stocks in parallel.
+
+    Tickers are spread over a pool of processes. The random numbers of each
+    ticker come from seed and the name of the ticker, so results do not
+    depend on the number of processes or on the other tickers.
+
+    Returns a DataFrame indexed by ticker with the columns of bootstrap_intervals.
+
+    Arguments:
+        returns     -- a DataFrame of 1 day returns, one column per ticker
+        design      -- a DataFrame with column bench_ret, on the same index as returns
+        resamples   -- number of bootstrap samples per ticker (default 10000)
+        method      -- 'iid', 'block' or 'stationary' (default 'iid')
+        block_size  -- (mean) block length (default n ** (1/3))
+        level       -- confidence level of the intervals (default 0.95)
+        seed        -- seed of the random numbers (default 0)
+        max_workers -- processes to use (default the number of cores)
+    """
+    results = {}
+    context = multiprocessing.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = {}
+        for ticker in returns.columns:
+            data = pd.DataFrame({'stock_ret': returns[ticker], 'bench_ret': design['bench_ret']})
+            ticker_seed = np.random.SeedSequence(seed, spawn_key=(zlib.crc32(str(ticker).encode()),))
+            futures[executor.submit(bootstrap_intervals, data, resamples, method, block_size,
+                                    level, ticker_seed)] = ticker
+        for future in concurrent.futures.as_completed(futures):
+            results[futures[future]] = future.result()
+    return pd.DataFrame([ results[ticker] for ticker in returns.columns ], index=returns.columns)
 
 def visualize_linear_regression(data, fit, stock, benchmark, axis_low=-0.1, axis_high=0.1, show_std=False):
     """Create a scatter plot and linear model of the stock returns vs. the benchmark returns.
@@ -140,24 +530,92 @@ def visualize_linear_regression(data, fit, stock, benchmark, axis_low=-0.1, axis
         axis_high -- highest value for x and y axes (defult 0.1)
         show_std  -- whether to show upper and lower bands around answer (default False)
     """
-    ax = data.plot(kind='scatter', x='bench_ret', y='stock_ret',
-                   title='1-Day Returns',
-                   xlim=(axis_low, axis_high), ylim=(axis_low, axis_high))
+    ax = plot_scatter(data, x='bench_ret', y='stock_ret',
+                      title='1-Day Returns',
+                      xlim=(axis_low, axis_high), ylim=(axis_low, axis_high))
     X_new = pd.DataFrame({'bench_ret': [axis_low, axis_high]})
     X_new['const'] = 1
     preds = fit.predict(X_new)
     plt.plot(X_new['bench_ret'], preds, 'r-')
     if show_std:
-        _, lower, upper = wls_prediction_std(fit, X_new)
+        _, lower, upper = PredictionIntervals(fit).predict(X_new, interval='prediction')
         plt.plot(X_new['bench_ret'], lower, 'r--', 
                  X_new['bench_ret'], upper, 'r--')
     ax.set_xlabel(benchmark)
     ax.set_ylabel(stock)
     ax.set_aspect(1)
 
+def main(bootstrap=0):
+    """Compute alpha and beta of AAPL relative to the S&P 500, and draw the figures.
+
+    Returns the exit status, 1 if some market data could not be retrieved.
+
+    Arguments:
+        bootstrap -- number of bootstrap samples of the iid, block and stationary
+                     intervals, which are skipped if 0 (default 0)
+    """
+    figures = []
+
+    migrate_csv_cache()
+    market_data, failures = get_bulk_data_from_quandl(["WIKI/AAPL", "YAHOO/INDEX_GSPC"], cache=True)
+    if failures:
+        for qticker, e in sorted(failures.items()):
+            print("%s: %s" % (qticker, e), file=sys.stderr)
+        return 1
+    aapl = market_data["WIKI/AAPL"]
+    sp500 = market_data["YAHOO/INDEX_GSPC"]
+
+    figures.append(figure_task(os.path.join("..", 'img', 'raw-data-plot.png'),
+                               visualize_raw_data, aapl, sp500, 'AAPL', 'S&P 500'))
+
+    returns = tidy_data(aapl, sp500)
+    returns.to_csv(os.path.join("..", "data", "aapl-sp500.csv"))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'scatter-plot.png'),
+                               visualize_data, returns, 'AAPL', 'S&P 500', axis_low=-0.075, axis_high=0.075))
+
+    fit = do_linear_regression(returns)
+
+    batch_fit = do_batch_linear_regression(returns[['stock_ret']].rename(columns={'stock_ret': 'AAPL'}),
+                                           returns[['bench_ret', 'const']])
+    print(batch_fit)
+
+    robust_fits = dict((norm, do_robust_linear_regression(returns, norm)) for norm in ROBUST_NORMS)
+    print(pd.DataFrame(robust_fits))
+
+    rolling_fits = { window: do_rolling_linear_regression(returns, window)
+                     for window in (60, 120, 252) }
+    print(rolling_fits[60].tail())
+
+    if bootstrap:
+        bootstrap_fits = dict((method, bootstrap_intervals(returns, bootstrap, method=method, seed=0))
+                              for method in ('iid', 'block', 'stationary'))
+        print(pd.DataFrame(bootstrap_fits))
+
+    online_fit = RecursiveLeastSquares(['bench_ret', 'const'])
+    for date, row in returns.iterrows():
+        online_fit.update(row, row['stock_ret'])
+    print(online_fit.params)
+
+    figures.append(figure_task(os.path.join("..", 'img', 'lr-plot-without-errors.png'),
+                               visualize_linear_regression, returns, fit, 'AAPL', 'S&P 500', axis_low=-0.075, axis_high=0.075))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'lr-plot-with-errors.png'),
+                               visualize_linear_regression, returns, fit, 'AAPL', 'S&P 500', axis_low=-0.075, axis_high=0.075, show_std=True))
 
-visualize_linear_regression(tidy_data, fit, 'AAPL', 'S&P 500', axis_low=-0.075, axis_high=0.075)
-plt.savefig(os.path.join("..", 'img', 'lr-plot-without-errors.png'))
+    figure_times = build_figures(figures)
+    print(figure_times)
+    return 0
 
-visualize_linear_regression(tidy_data, fit, 'AAPL', 'S&P 500', axis_low=-0.075, axis_high=0.075, show_std=True)
-plt.savefig(os.path.join("..", 'img', 'lr-plot-with-errors.png'))
+if __name__ == "__main__":
+    # Set REGRESSION_TRACE to a file name to record the stages of the run
+    trace_file = os.environ.get("REGRESSION_TRACE")
+    if trace_file:
+        start_tracing()
+    # Set REGRESSION_BOOTSTRAP to a number of samples to print bootstrap intervals
+    status = main(bootstrap=int(os.environ.get("REGRESSION_BOOTSTRAP", "0")))
+    if trace_file:
+        tracer = stop_tracing()
+        tracer.write_chrome_trace(trace_file)
+        print(tracer.summary().to_string())
+    sys.exit(status)
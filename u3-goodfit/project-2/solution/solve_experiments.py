@@ -8,14 +8,28 @@ experiments.
 """
 
 import os.path
-import math
+import sys
+import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-import matplotlib.pyplot as plt
 
-from statsmodels.sandbox.regression.predstd \
-    import wls_prediction_std
+# The code shared by the examples lives in the regression package, at the
+# root of the repository
+_root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
 
+from regression.figures import build_figures, figure_task
+from regression.grouped import do_grouped_linear_regression
+from regression.intervals import PredictionIntervals
+from regression.lazy import LazyModule
+from regression.online import RecursiveLeastSquares
+from regression.plotting import plot_scatter
+from regression.tracing import start_tracing, stop_tracing, traced
+
+sm = LazyModule('statsmodels.api')
+plt = LazyModule('matplotlib.pyplot')
+
+@traced('fetch')
 def read_data(fname):
     """Read data from tidy CSV data frame.
     
@@ -25,9 +39,6 @@ def read_data(fname):
     data = pd.read_csv(fname)
     return data
 
-springs    = read_data(os.path.join("..", "data", "experiment-springs.csv"))
-refraction = read_data(os.path.join("..", "data", "experiment-refraction.csv"))
-
 def visualize_data(data, response_name, predictor_name):
     """Create a scatter plot of the predictor vs. the response variable.
     
@@ -36,19 +47,15 @@ def visualize_data(data, response_name, predictor_name):
         response_name  -- name of the response variable
         predictor_name -- name of the predictor variable
     """
-    ax = data.plot(kind='scatter', x=1, y=0,
-                   title=('Relationship of %s vs. %s' % (response_name, predictor_name)),
-                   #xlim=(axis_low, axis_high), ylim=(axis_low, axis_high)
-                   )
+    ax = plot_scatter(data, x=1, y=0,
+                      title=('Relationship of %s vs. %s' % (response_name, predictor_name)),
+                      #xlim=(axis_low, axis_high), ylim=(axis_low, axis_high)
+                      )
     ax.set_xlabel(predictor_name)
     ax.set_ylabel(response_name)
     #ax.set_aspect(1)
 
-visualize_data(springs, 'Spring Displacement', 'Mass')
-plt.savefig(os.path.join("..", 'img', 'scatter-plot-springs.png'))
-visualize_data(refraction, 'Refraction Angle', 'Incidence Angle')
-plt.savefig(os.path.join("..", 'img', 'scatter-plot-refraction.png'))
-
+@traced('fit')
 def do_linear_regression(data):
     """Perform a linear regression for column 1 based on column 2 of the DataFrame.
     
@@ -61,11 +68,224 @@ def do_linear_regression(data):
     fit = model.fit()
     return fit
 
-springs_fit = do_linear_regression(springs)
-print (springs_fit.summary ())
+class ChunkedLeastSquares(RecursiveLeastSquares):
+    """Least squares fit accumulated from chunks of rows, in bounded memory.
+
+    Each chunk is reduced together with the triangular factor of everything
+    before it by one QR factorization of [X | y] (a TSQR reduction), so only
+    a (p + 1) x (p + 1) matrix is kept between chunks. This avoids forming
+    X'X, and the coefficients, standard errors and R^2 are those of a fit of
+    all rows at once.
+    """
+
+    def __init__(self, names):
+        """Create an empty chunked regression.
+
+        Arguments:
+            names -- names of the predictor columns, in the order of params
+        """
+        super(ChunkedLeastSquares, self).__init__(names)
+        self.r = None
+        self.ymean = 0.0
+        self.tss = 0.0
+
+    def update(self, exog, endog):
+        """Add a chunk of observations to the fit.
+
+        Observations with a NaN are skipped, as with missing='drop'.
+
+        Arguments:
+            exog  -- a DataFrame or 2-d array of predictors, one row per observation
+            endog -- response of each observation
+        """
+        X = self._as_matrix(exog)
+        y = np.atleast_1d(np.asarray(endog, dtype=float))
+        keep = ~(np.isnan(X).any(axis=1) | np.isnan(y))
+        X, y = X[keep], y[keep]
+        m = len(y)
+        if m == 0:
+            return self
+        block = np.column_stack([X, y])
+        if self.r is not None:
+            block = np.vstack([self.r, block])
+        self.r = np.linalg.qr(block, mode='r')
+        # Combine the centered sums of squares of y as in Chan et al.
+        delta = y.mean() - self.ymean
+        total = self.nobs + m
+        self.tss += ((y - y.mean()) ** 2).sum() + delta * delta * self.nobs * m / total
+        self.ymean += delta * m / total
+        self.nobs = total
+        p = len(self.names)
+        if self.r.shape[0] > p and np.linalg.matrix_rank(self.r[:p, :p]) == p:
+            r_inv = np.linalg.inv(self.r[:p, :p])
+            self.gram_inv = r_inv.dot(r_inv.T)
+            self.theta = r_inv.dot(self.r[:p, p])
+            self.ssr = self.r[p, p] ** 2
+        return self
+
+    @property
+    def rsquared(self):
+        """Coefficient of determination of the fit."""
+        return 1 - self.ssr / self.tss
+
+@traced('fit')
+def do_chunked_linear_regression(fname, chunksize=100000, index_col=None):
+    """Perform a linear regression for column 1 based on column 2 of a CSV file, reading it in chunks.
+
+    Only one chunk is in memory at a time, so the file can be larger than
+    memory; the result equals do_linear_regression on the whole file.
+    
+    Arguments:
+        fname     -- Name of file where data resides, with response in column 1, predictor in column 2, and constant in column 3
+        chunksize -- number of rows read at a time (default 100000)
+        index_col -- column to use as the index, e.g., 0 for the Date of tidy stock data (default None)
+    """
+    fit = None
+    for chunk in pd.read_csv(fname, chunksize=chunksize, index_col=index_col):
+        if fit is None:
+            fit = ChunkedLeastSquares(chunk.columns[1:3])
+        fit.update(chunk.iloc[:, [1, 2]], chunk.iloc[:, 0])
+    return fit
+
+class Transform(object):
+    """A transformation of a variable and its inverse, both vectorized with NumPy ufuncs.
+
+    Each direction may have a domain, a function returning a boolean array of
+    the values it accepts. Values outside of it are found with one vectorized
+    test, and either rejected or turned into NaN.
+    """
+
+    def __init__(self, name, forward, inverse, domain=None, inverse_domain=None):
+        """Create a transformation.
+
+        Arguments:
+            name           -- name used in error messages, e.g., 'sin'
+            forward        -- ufunc or vectorized function of the transformation
+            inverse        -- ufunc or vectorized function of its inverse
+            domain         -- function returning which values forward accepts (default all)
+            inverse_domain -- function returning which values inverse accepts (default all)
+        """
+        self.name = name
+        self.forward = forward
+        self.backward = inverse
+        self.domain = domain
+        self.inverse_domain = inverse_domain
+
+    def _apply(self, func, domain, name, x, errors):
+        """Apply func to x after checking it against domain; keep the index of a Series."""
+        if errors not in ('raise', 'coerce'):
+            raise ValueError("errors must be 'raise' or 'coerce', not %r" % errors)
+        values = np.asarray(x, dtype=float)
+        if domain is not None:
+            with np.errstate(invalid='ignore'):
+                valid = domain(values) | np.isnan(values)
+            if not valid.all():
+                if errors == 'raise':
+                    bad = np.flatnonzero(~valid)
+                    raise ValueError("%d value(s) outside the domain of %s, the first is %g at position %d"
+                                     % (len(bad), name, values.flat[bad[0]], bad[0]))
+                values = np.where(valid, values, np.nan)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = func(values)
+        if isinstance(x, pd.Series):
+            return pd.Series(result, index=x.index, name=x.name)
+        return result
+
+    def __call__(self, x, errors='raise'):
+        """Transform x.
+
+        Arguments:
+            x      -- scalar, array or Series
+            errors -- 'raise' to reject values outside the domain, 'coerce' to make them NaN (default 'raise')
+        """
+        return self._apply(self.forward, self.domain, self.name, x, errors)
+
+    def inverse(self, y, errors='raise'):
+        """Transform y back.
+
+        Arguments:
+            y      -- scalar, array or Series
+            errors -- 'raise' to reject values outside the domain of the inverse,
+                      'coerce' to make them NaN (default 'raise')
+        """
+        return self._apply(self.backward, self.inverse_domain, 'the inverse of ' + self.name, y, errors)
+
+def boxcox_transform(lmbda):
+    """Return the Box-Cox transformation (x^lmbda - 1) / lmbda, or log(x) for lmbda 0.
+
+    Arguments:
+        lmbda -- the Box-Cox parameter
+    """
+    if lmbda == 0:
+        return Transform('boxcox(0)', np.log, np.exp, domain=lambda x: x > 0)
+    return Transform('boxcox(%g)' % lmbda,
+                     lambda x: np.expm1(lmbda * np.log(x)) / lmbda,
+                     lambda y: np.exp(np.log1p(lmbda * y) / lmbda),
+                     domain=lambda x: x > 0,
+                     inverse_domain=lambda y: lmbda * y > -1)
+
+def power_transform(p):
+    """Return the transformation x^p of non-negative values (positive ones if p < 0).
+
+    Arguments:
+        p -- the exponent, not 0
+    """
+    if p == 0:
+        raise ValueError("the exponent of a power transformation cannot be 0; use 'log'")
+    if p > 0:
+        positive = lambda x: x >= 0
+    else:
+        positive = lambda x: x > 0
+    return Transform('power(%g)' % p,
+                     lambda x: np.power(x, p),
+                     lambda y: np.power(y, 1.0 / p),
+                     domain=positive, inverse_domain=positive)
+
+# Registry of transformations by name; the parametrized ones take their
+# parameter, e.g., get_transform(('boxcox', 0.5))
+TRANSFORMS = {
+    'identity': lambda: Transform('identity', np.asarray, np.asarray),
+    'sin': lambda: Transform('sin', np.sin, np.arcsin,
+                             domain=lambda x: np.abs(x) <= np.pi / 2,
+                             inverse_domain=lambda y: np.abs(y) <= 1),
+    'log': lambda: Transform('log', np.log, np.exp, domain=lambda x: x > 0),
+    'exp': lambda: Transform('exp', np.exp, np.log, inverse_domain=lambda y: y > 0),
+    'boxcox': boxcox_transform,
+    'power': power_transform,
+}
+
+def get_transform(spec):
+    """Return the Transform for a name, a (name, parameter) pair, or a Transform.
+
+    Arguments:
+        spec -- e.g., 'sin', ('boxcox', 0.5), a Transform, or None for the identity
+    """
+    if isinstance(spec, Transform):
+        return spec
+    if spec is None:
+        return TRANSFORMS['identity']()
+    if isinstance(spec, str):
+        name, args = spec, ()
+    else:
+        name, args = spec[0], tuple(spec[1:])
+    if name not in TRANSFORMS:
+        raise ValueError("unknown transformation %r, expected one of %s" % (name, ", ".join(sorted(TRANSFORMS))))
+    return TRANSFORMS[name](*args)
 
-refraction_fit = do_linear_regression(refraction)
-print (refraction_fit.summary ())
+@traced('tidy')
+def transform_data(data, transforms, errors='raise'):
+    """Return a copy of a tidy data frame with some of its columns transformed, a whole column at a time.
+
+    Arguments:
+        data       -- a tidy DataFrame
+        transforms -- dict of column name or position to a transformation, as taken by get_transform
+        errors     -- 'raise' or 'coerce' for values outside a domain (default 'raise')
+    """
+    data = data.copy()
+    for col, spec in transforms.items():
+        name = data.columns[col] if isinstance(col, int) else col
+        data[name] = get_transform(spec)(data[name], errors=errors)
+    return data
 
 def transform_refraction(data):
     """Transform the data by taking sines of the first and second column.
@@ -73,16 +293,63 @@ def transform_refraction(data):
     Arguments:
         data      -- a tidy DataFrame, with response in column 1, predictor in column 2, and constant in column 3
     """
+    return transform_data(data, {0: 'sin', 1: 'sin'})
 
-    data = data.copy()
-    data.iloc[:,0] = data.iloc[:,0].apply(math.sin)
-    data.iloc[:,1] = data.iloc[:,1].apply(math.sin)
-    
-    return data
+class TransformedRegression(object):
+    """A linear regression fitted on transformed columns, predicting on the original scale.
+
+    The response and predictors are transformed column by column, the model
+    is fitted with do_linear_regression, and predictions and their bands are
+    transformed back with the inverse of the response transformation. Bands
+    are computed on the transformed scale, where the errors are assumed
+    normal, so they are not symmetric once transformed back.
+    """
 
-transformed_refraction = transform_refraction(refraction)
-transformed_refraction_fit = do_linear_regression(transformed_refraction)
-print (transformed_refraction_fit.summary ())
+    @traced('fit')
+    def __init__(self, data, transforms):
+        """Transform the data and fit the model.
+
+        Arguments:
+            data       -- a tidy DataFrame, with response in column 1, predictor in column 2, and constant in column 3
+            transforms -- dict of column name or position to a transformation, as taken by get_transform,
+                          e.g., {0: 'sin', 1: 'sin'}
+        """
+        self.transforms = dict(((data.columns[col] if isinstance(col, int) else col), get_transform(spec))
+                               for col, spec in transforms.items())
+        self.response = data.columns[0]
+        self.data = transform_data(data, self.transforms)
+        self.fit = do_linear_regression(self.data)
+        self.intervals = PredictionIntervals(self.fit)
+
+    @property
+    def params(self):
+        """Parameters of the fit on the transformed scale."""
+        return self.fit.params
+
+    def cov_params(self):
+        """Covariance of the parameters on the transformed scale."""
+        return self.fit.cov_params()
+
+    @traced('predict')
+    def predict(self, exog, interval=None, alpha=0.05, errors='raise'):
+        """Predict the response on its original scale; with an interval, also return its bounds.
+
+        Arguments:
+            exog     -- DataFrame of untransformed predictor values, with the predictor columns of data
+            interval -- None, 'confidence' or 'prediction' (default None)
+            alpha    -- significance level of the interval (default 0.05)
+            errors   -- 'raise' to reject predictions outside the domain of the inverse of the
+                        response transformation, 'coerce' to make them NaN (default 'raise')
+        """
+        names = self.fit.params.index
+        X = transform_data(exog[names], dict((col, transform) for col, transform in self.transforms.items()
+                                             if col in names))
+        inverse = self.transforms.get(self.response, get_transform(None)).inverse
+        if interval is None:
+            return inverse(self.intervals.predict(X), errors=errors)
+        preds, lower, upper = [ inverse(a, errors=errors) for a in self.intervals.predict(X, interval, alpha) ]
+        # A decreasing transformation swaps the bounds
+        return preds, np.fmin(lower, upper), np.fmax(lower, upper)
 
 def visualize_linear_regression(data, fit, response_name, predictor_name, show_std=False):
     """Create a scatter plot and linear model of the response variable (column 1) vs. predictor variable (column 2).
@@ -94,77 +361,118 @@ def visualize_linear_regression(data, fit, response_name, predictor_name, show_s
         predictor_name -- name of the predictor variable
         show_std       -- whether to show upper and lower bands around answer (default False)
     """
-    ax = data.plot(kind='scatter', x=1, y=0,
-                   title=('Relationship of %s vs. %s' % (response_name, predictor_name)),
-                   #xlim=(axis_low, axis_high), ylim=(axis_low, axis_high)
-                   )
+    ax = plot_scatter(data, x=1, y=0,
+                      title=('Relationship of %s vs. %s' % (response_name, predictor_name)),
+                      #xlim=(axis_low, axis_high), ylim=(axis_low, axis_high)
+                      )
     X_new = pd.DataFrame({'predictor': ax.get_xlim()})
     X_new['const'] = 1
     preds = fit.predict(X_new)
     plt.plot(X_new['predictor'], preds, 'r-')
     if show_std:
-        _, lower, upper = wls_prediction_std(fit, X_new)
+        _, lower, upper = PredictionIntervals(fit).predict(X_new, interval='prediction')
         plt.plot(X_new['predictor'], lower, 'r--', 
                  X_new['predictor'], upper, 'r--')
     ax.set_xlabel(predictor_name)
     ax.set_ylabel(response_name)
     # ax.set_aspect(1)
 
-
-visualize_linear_regression(springs, springs_fit, 'Spring Displacement', 'Mass')
-plt.savefig(os.path.join("..", 'img', 'springs-lr-plot-without-errors.png'))
-
-visualize_linear_regression(springs, springs_fit, 'Spring Displacement', 'Mass', True)
-plt.savefig(os.path.join("..", 'img', 'springs-lr-plot-with-errors.png'))
-
-visualize_linear_regression(refraction, refraction_fit, 'Refraction Angle', 'Incidence Angle')
-plt.savefig(os.path.join("..", 'img', 'refraction-lr-plot-without-errors.png'))
-
-visualize_linear_regression(refraction, refraction_fit, 'Refraction Angle', 'Incidence Angle', True)
-plt.savefig(os.path.join("..", 'img', 'refraction-lr-plot-with-errors.png'))
-
-visualize_linear_regression(transformed_refraction, transformed_refraction_fit, 'Sine Refraction Angle', 'Sine Incidence Angle')
-plt.savefig(os.path.join("..", 'img', 'refraction-xlr-plot-without-errors.png'))
-
-visualize_linear_regression(transformed_refraction, transformed_refraction_fit, 'Sine Refraction Angle', 'Sine Incidence Angle', True)
-plt.savefig(os.path.join("..", 'img', 'refraction-xlr-plot-with-errors.png'))
-
-def visualize_linear_regression_with_transformation(orig_data, fit, response_name, predictor_name, response_inverse, predictor_transform, show_std=False):
+def visualize_linear_regression_with_transformation(orig_data, model, response_name, predictor_name, show_std=False):
     """Create a scatter plot and linear model of the response variable (column 1) vs. predictor variable (column 2).
     
     Arguments:
         orig_data           -- a tidy DataFrame, with response in column 1, predictor in column 2, and constant in column 3
-        fit                 -- a linear regression result
+        model               -- a TransformedRegression of orig_data
         response_name       -- name of the response variable
         predictor_name      -- name of the predictor variable
-        response_inverse    -- inverse transformation to apply to response variable
-        predictor_transform -- transformation to apply to predictor variable
         show_std            -- whether to show upper and lower bands around answer (default False)
     """
-    ax = orig_data.plot(kind='scatter', x=1, y=0,
-                        title=('Relationship of %s vs. %s' % (response_name, predictor_name)))
-    X_orig = pd.np.linspace(min(orig_data.iloc[:,1]), max(orig_data.iloc[:,1]))
-    X_new = pd.DataFrame({'predictor': X_orig})
-    X_new['predictor'] = X_new['predictor'].apply(predictor_transform)
-    X_new['const'] = 1
-    preds = fit.predict(X_new)
-    vrespinv = pd.np.vectorize(response_inverse)
-    preds = vrespinv(preds)
+    ax = plot_scatter(orig_data, x=1, y=0,
+                      title=('Relationship of %s vs. %s' % (response_name, predictor_name)))
+    X_orig = np.linspace(orig_data.iloc[:,1].min(), orig_data.iloc[:,1].max())
+    X_new = pd.DataFrame({orig_data.columns[1]: X_orig, orig_data.columns[2]: 1.0})
+    preds = model.predict(X_new)
     plt.plot(X_orig, preds, 'r-')
 
     if show_std:
-        _, lower, upper = wls_prediction_std(fit, X_new)
-        lower = vrespinv(lower)
-        upper = vrespinv(upper)
+        # Bounds beyond the domain of the inverse are left out of the plot
+        _, lower, upper = model.predict(X_new, interval='prediction', errors='coerce')
         plt.plot(X_orig, lower, 'r--', 
                  X_orig, upper, 'r--')
     ax.set_xlabel(predictor_name)
     ax.set_ylabel(response_name)
     # ax.set_aspect(1)
 
-visualize_linear_regression_with_transformation(refraction, transformed_refraction_fit, 'Refraction Angle', 'Incidence Angle', math.asin, math.sin)
-plt.savefig(os.path.join("..", 'img', 'refraction-nonlinear-plot-without-errors.png'))
+def main():
+    """Fit the spring-mass and refraction experiments, and draw the figures."""
+    figures = []
+
+    springs    = read_data(os.path.join("..", "data", "experiment-springs.csv"))
+    refraction = read_data(os.path.join("..", "data", "experiment-refraction.csv"))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'scatter-plot-springs.png'),
+                               visualize_data, springs, 'Spring Displacement', 'Mass'))
+    figures.append(figure_task(os.path.join("..", 'img', 'scatter-plot-refraction.png'),
+                               visualize_data, refraction, 'Refraction Angle', 'Incidence Angle'))
+
+    springs_fit = do_linear_regression(springs)
+    print (springs_fit.summary ())
+
+    refraction_fit = do_linear_regression(refraction)
+    print (refraction_fit.summary ())
+
+    experiment_fits = do_grouped_linear_regression({'springs': springs, 'refraction': refraction})
+    print(experiment_fits)
+
+    springs_online_fit = RecursiveLeastSquares(springs.columns[1:3])
+    for start in range(0, len(springs), 10):
+        batch = springs.iloc[start:start + 10]
+        springs_online_fit.update(batch.iloc[:, [1, 2]], batch.iloc[:, 0])
+    print(springs_online_fit.params)
+
+    springs_chunked_fit = do_chunked_linear_regression(os.path.join("..", "data", "experiment-springs.csv"),
+                                                       chunksize=25)
+    print(springs_chunked_fit.params, springs_chunked_fit.bse, springs_chunked_fit.rsquared)
+
+    refraction_model = TransformedRegression(refraction, {0: 'sin', 1: 'sin'})
+    transformed_refraction = refraction_model.data
+    transformed_refraction_fit = refraction_model.fit
+    print (transformed_refraction_fit.summary ())
+
+    figures.append(figure_task(os.path.join("..", 'img', 'springs-lr-plot-without-errors.png'),
+                               visualize_linear_regression, springs, springs_fit, 'Spring Displacement', 'Mass'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'springs-lr-plot-with-errors.png'),
+                               visualize_linear_regression, springs, springs_fit, 'Spring Displacement', 'Mass', True))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'refraction-lr-plot-without-errors.png'),
+                               visualize_linear_regression, refraction, refraction_fit, 'Refraction Angle', 'Incidence Angle'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'refraction-lr-plot-with-errors.png'),
+                               visualize_linear_regression, refraction, refraction_fit, 'Refraction Angle', 'Incidence Angle', True))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'refraction-xlr-plot-without-errors.png'),
+                               visualize_linear_regression, transformed_refraction, transformed_refraction_fit, 'Sine Refraction Angle', 'Sine Incidence Angle'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'refraction-xlr-plot-with-errors.png'),
+                               visualize_linear_regression, transformed_refraction, transformed_refraction_fit, 'Sine Refraction Angle', 'Sine Incidence Angle', True))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'refraction-nonlinear-plot-without-errors.png'),
+                               visualize_linear_regression_with_transformation, refraction, refraction_model, 'Refraction Angle', 'Incidence Angle'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'refraction-nonlinear-plot-with-errors.png'),
+                               visualize_linear_regression_with_transformation, refraction, refraction_model, 'Refraction Angle', 'Incidence Angle', True))
 
-visualize_linear_regression_with_transformation(refraction, transformed_refraction_fit, 'Refraction Angle', 'Incidence Angle', math.asin, math.sin, True)
-plt.savefig(os.path.join("..", 'img', 'refraction-nonlinear-plot-with-errors.png'))
+    figure_times = build_figures(figures)
+    print(figure_times)
 
+if __name__ == "__main__":
+    # Set REGRESSION_TRACE to a file name to record the stages of the run
+    trace_file = os.environ.get("REGRESSION_TRACE")
+    if trace_file:
+        start_tracing()
+    main()
+    if trace_file:
+        tracer = stop_tracing()
+        tracer.write_chrome_trace(trace_file)
+        print(tracer.summary().to_string())
@@ -1,3 +1,28 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Anscombe's Quartet
+
+This program draws the best linear fit to each of the four Anscombe datasets,
+which share their means, variances, correlation and regression line.
+"""
+
+import os.path
+import sys
+import numpy as np
+import pandas as pd
+
+# The code shared by the examples lives in the regression package, at the
+# root of the repository
+_root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+from regression.figures import build_figures, figure_task
+from regression.grouped import do_grouped_linear_regression
+from regression.lazy import LazyModule
+
+plt = LazyModule('matplotlib.pyplot')
+
 anscombe1 = [ (10.0,  8.04),
               ( 8.0,  6.95),
               (13.0,  7.58),
@@ -43,15 +68,48 @@ anscombe4 = [ ( 8.0,  6.58,),
               ( 8.0,  7.91,),
               ( 8.0,  6.89,) ]
 
+def tidy_data(points):
+    """Create a tidy data frame of y, x and const columns from a list of (x, y) points.
 
+    Arguments:
+        points -- list of (x, y) tuples
+    """
+    xs, ys = np.array(points, dtype=float).T
+    return pd.DataFrame({'y': ys, 'x': xs, 'const': 1.0}, columns=['y', 'x', 'const'])
 
+def visualize_regression(data, fit, axis=(0, 20, 0, 15)):
+    """Create a scatter plot of the points and the best linear fit.
 
+    Arguments:
+        data -- a tidy DataFrame, with columns y, x and const
+        fit  -- a linear regression result, or a Series of its x and const coefficients
+        axis -- the axis limits (xmin, xmax, ymin, ymax) (default (0, 20, 0, 15))
+    """
+    params = getattr(fit, 'params', fit)
+    ax = data.plot(kind='scatter', x='x', y='y', title='Best Linear Fit')
+    xs = np.linspace(axis[0], axis[1])
+    plt.plot(xs, params['const'] + params['x'] * xs, 'r-')
+    ax.axis(axis)
+    ax.set_aspect('equal')
+    ax.grid(True)
 
+def main():
+    """Fit and draw each of the four Anscombe datasets.
 
+    The figures are saved as anscombe-fit1.png to anscombe-fit4.png, next to
+    the slide images anscombe1.png to anscombe4.png made in MATLAB.
+    """
+    figures = []
+    datasets = dict((i, tidy_data(points))
+                    for i, points in enumerate([ anscombe1, anscombe2, anscombe3, anscombe4 ], start=1))
+    fits = do_grouped_linear_regression(datasets)
+    print(fits)
+    for i, data in datasets.items():
+        figures.append(figure_task(os.path.join("..", 'anscombe-fit%d.png' % i),
+                                   visualize_regression, data, fits.loc[i, ['x', 'const']]))
 
+    figure_times = build_figures(figures)
+    print(figure_times)
 
-
-
-
-
-
+if __name__ == "__main__":
+    main()
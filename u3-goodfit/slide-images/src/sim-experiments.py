@@ -1,19 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""Simulate the spring-mass and refraction experiments
+
+Without arguments, this program writes the 99 rows of each experiment used
+in the slides. It also generates large datasets to load-test the fitting
+code, in blocks of rows drawn with independent seeded random streams, on a
+pool of processes, and written as CSV or as a binary .npy file:
+
+    python sim-experiments.py springs -n 100000000 -o springs.npy --seed 1
+    python sim-experiments.py refraction -n 10000000 --outliers 0.01 --heteroscedasticity 2
+"""
+
+import argparse
+import collections
+import concurrent.futures
 import math
-import random
-
-with open('experiment-springs.csv', 'w') as f:
-    print("distance, mass, const", file=f)
-    k = 0.9
-    for i in range(1,100):
-        m = random.uniform(0, 10)
-        d = k * m + random.gauss(0, 0.1)
-        print("%.4f, %.4f, %d" % (d, m, 1), file=f)
-
-with open('experiment-refraction.csv', 'w') as f:
-    print("beta, alpha, const", file=f)
-    nalpha = 1.0
-    nbeta = 4.0 / 3.0
-    for i in range(1,100):
-        alpha = random.uniform(0, math.pi/2)
-        beta = math.asin(nalpha * math.sin(alpha) / nbeta) + random.gauss(0, 0.001)
-        print("%.4f, %.4f, %d" % (beta, alpha, 1), file=f)
+import multiprocessing
+import os
+import numpy as np
+
+def spring_distance(mass, k=0.9):
+    """Return the extension of a spring under a mass, by Hooke's law."""
+    return k * mass
+
+def refraction_angle(alpha, nalpha=1.0, nbeta=4.0 / 3.0):
+    """Return the angle of refraction for an angle of incidence, by Snell's law."""
+    return np.arcsin(nalpha * np.sin(alpha) / nbeta)
+
+# name: (columns, model, low and high of the predictor, noise)
+EXPERIMENTS = {
+    'springs': (('distance', 'mass', 'const'), spring_distance, 0.0, 10.0, 0.1),
+    'refraction': (('beta', 'alpha', 'const'), refraction_angle, 0.0, math.pi / 2, 0.001),
+}
+
+def simulate_block(experiment, n, seed=None, noise=None, outliers=0.0, outlier_scale=10.0,
+                   heteroscedasticity=0.0, dtype=np.float64):
+    """Return an (n, 3) array of rows of an experiment: response, predictor and const.
+
+    The predictor is uniform over its range and the response is the model
+    plus normal noise. The standard deviation of the noise grows linearly
+    across the range of the predictor, up to 1 + heteroscedasticity times
+    noise, and a fraction outliers of the rows get outlier_scale times more.
+
+    Arguments:
+        experiment         -- 'springs' or 'refraction'
+        n                  -- number of rows
+        seed               -- seed, SeedSequence or Generator of the random numbers
+        noise              -- standard deviation of the noise (default that of the experiment)
+        outliers           -- fraction of rows with outlying noise (default 0)
+        outlier_scale      -- factor of the noise of the outliers (default 10)
+        heteroscedasticity -- growth of the noise across the predictor (default 0)
+        dtype              -- type of the array (default float64)
+    """
+    columns, model, low, high, default_noise = EXPERIMENTS[experiment]
+    rng = np.random.default_rng(seed)
+    if noise is None:
+        noise = default_noise
+    out = np.empty((n, 3), dtype=dtype)
+    x = rng.uniform(low, high, n)
+    e = rng.standard_normal(n)
+    e *= noise
+    if heteroscedasticity:
+        e *= 1 + heteroscedasticity * (x - low) / (high - low)
+    if outliers:
+        e[rng.random(n) < outliers] *= outlier_scale
+    out[:, 0] = model(x) + e
+    out[:, 1] = x
+    out[:, 2] = 1
+    return out
+
+def format_block(block, precision=4):
+    """Return the rows of a block as CSV text in the format of the data files.
+
+    The whole block is formatted by a single % operation, about three times
+    faster than np.savetxt, which formats one row at a time.
+    """
+    row = "%%.%df, %%.%df, %%d\n" % (precision, precision)
+    return (row * len(block)) % tuple(block.ravel().tolist())
+
+def _csv_block(experiment, n, seed, options, precision):
+    """Simulate one block of rows and return it as encoded CSV lines."""
+    return format_block(simulate_block(experiment, n, seed, **options), precision).encode()
+
+def _npy_block(fname, start, experiment, n, seed, options):
+    """Simulate one block of rows into its place in the .npy file; return the number of rows."""
+    out = np.lib.format.open_memmap(fname, mode='r+')
+    out[start:start + n] = simulate_block(experiment, n, seed, dtype=out.dtype, **options)
+    out.flush()
+    return n
+
+def _bounded_map(executor, fn, tasks, window):
+    """Yield fn(*task) for each task in order, with at most window tasks submitted and not yet yielded.
+
+    Unlike executor.map, which submits every task at once and holds all the
+    results that are ready before the one being consumed, this keeps the
+    memory of the results to a few blocks.
+
+    Arguments:
+        executor -- a concurrent.futures executor
+        fn       -- function to call
+        tasks    -- iterable of argument tuples of fn
+        window   -- most tasks in flight at a time
+    """
+    pending = collections.deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(fn, *task))
+    while pending:
+        yield pending.popleft().result()
+
+def generate(experiment, fname, rows, block_size=1000000, seed=None, max_workers=None,
+             precision=4, dtype=np.float64, **options):
+    """Write rows of an experiment to a CSV or .npy file, generating blocks in parallel.
+
+    The rows are drawn in blocks of block_size, each from its own stream
+    spawned from seed, so the output only depends on seed and block_size,
+    not on the number of processes. Blocks are written to a .npy file in
+    place by the processes, and to a CSV file in order as they are formatted.
+    Only two blocks per process are in flight at a time, so memory stays at
+    a few blocks however many rows are written.
+
+    Arguments:
+        experiment  -- 'springs' or 'refraction'
+        fname       -- file to write; binary if its name ends in .npy, CSV otherwise
+        rows        -- number of rows
+        block_size  -- rows generated at once by a process (default 1000000)
+        seed        -- seed of the random numbers (default fresh entropy)
+        max_workers -- processes to use (default the number of cores)
+        precision   -- decimals of the CSV file (default 4)
+        dtype       -- type of the .npy file (default float64)
+        options     -- noise, outliers, outlier_scale and heteroscedasticity of simulate_block
+    """
+    starts = list(range(0, rows, block_size))
+    sizes = [ min(block_size, rows - start) for start in starts ]
+    seeds = np.random.SeedSequence(seed).spawn(len(starts))
+    binary = fname.endswith(".npy")
+    if binary:
+        np.lib.format.open_memmap(fname, mode='w+', dtype=dtype, shape=(rows, 3)).flush()
+        work = _npy_block
+        tasks = [ (fname, start, experiment, n, s, options) for start, n, s in zip(starts, sizes, seeds) ]
+    else:
+        work = _csv_block
+        tasks = [ (experiment, n, s, options, precision) for n, s in zip(sizes, seeds) ]
+    if len(tasks) <= 1 or max_workers == 1:
+        executor = None
+        results = (work(*task) for task in tasks)
+    else:
+        context = multiprocessing.get_context("fork")
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        # Two blocks per process keep them all busy while the CSV blocks are written in order
+        results = _bounded_map(executor, work, tasks, 2 * (max_workers or os.cpu_count() or 1))
+    try:
+        if binary:
+            list(results)
+        else:
+            with open(fname, 'wb') as f:
+                f.write((", ".join(EXPERIMENTS[experiment][0]) + "\n").encode())
+                for chunk in results:
+                    f.write(chunk)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def main(argv=None):
+    """Write the simulated experiments given on the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("experiments", nargs="*", metavar="EXPERIMENT",
+                        help="springs or refraction (default both)")
+    parser.add_argument("-n", "--rows", type=int, default=99, help="rows to generate (default %(default)s)")
+    parser.add_argument("-o", "--output", help="file to write, .npy for binary (default experiment-NAME.csv)")
+    parser.add_argument("--seed", type=int, help="seed of the random numbers (default fresh entropy)")
+    parser.add_argument("--block-size", type=int, default=1000000,
+                        help="rows generated at once by a process (default %(default)s)")
+    parser.add_argument("--processes", type=int, help="processes to use (default the number of cores)")
+    parser.add_argument("--noise", type=float, help="standard deviation of the noise (default per experiment)")
+    parser.add_argument("--outliers", type=float, default=0.0, help="fraction of outlying rows (default 0)")
+    parser.add_argument("--outlier-scale", type=float, default=10.0,
+                        help="factor of the noise of the outliers (default %(default)s)")
+    parser.add_argument("--heteroscedasticity", type=float, default=0.0,
+                        help="growth of the noise across the predictor (default 0)")
+    parser.add_argument("--precision", type=int, default=4, help="decimals of CSV output (default %(default)s)")
+    parser.add_argument("--float32", action="store_true", help="write single precision .npy output")
+    args = parser.parse_args(argv)
+
+    experiments = args.experiments or sorted(EXPERIMENTS, reverse=True)
+    for experiment in experiments:
+        if experiment not in EXPERIMENTS:
+            parser.error("unknown experiment %r" % experiment)
+    if args.output and len(experiments) > 1:
+        parser.error("--output needs a single experiment")
+    for experiment in experiments:
+        generate(experiment, args.output or 'experiment-%s.csv' % experiment, args.rows,
+                 block_size=args.block_size, seed=args.seed, max_workers=args.processes,
+                 precision=args.precision, dtype=np.float32 if args.float32 else np.float64,
+                 noise=args.noise, outliers=args.outliers, outlier_scale=args.outlier_scale,
+                 heteroscedasticity=args.heteroscedasticity)
+
+if __name__ == "__main__":
+    main()
@@ -7,100 +7,176 @@ The actual example is to predict the 1-day returns of Walmart (WMT) by using pre
 days 1-day returns and the current day's 1-day return of the S&P500.
 """
 
+import os
 import os.path
+import sys
+import multiprocessing
+import concurrent.futures
+import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-import matplotlib.pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
-
-# The Quandl package makes it easy to access market data
-# It is available from https://pypi.python.org/pypi/Quandl
-import quandl 
-
-def get_data_from_quandl(qticker, 
-                         start_date="2016-01-01", end_date="2016-12-31", 
-                         cache=False):
-    """Download data from Quandl service.
-    
+
+# The code shared by the examples lives in the regression package, at the
+# root of the repository
+_root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
+
+from regression.figures import build_figures, figure_task
+from regression.intervals import PredictionIntervals
+from regression.lazy import LazyModule
+from regression.marketdata import get_bulk_data_from_quandl, migrate_csv_cache
+from regression.online import RecursiveLeastSquares
+from regression.plotting import plot_scatter
+from regression.tidy import compute_returns, masked_design
+from regression.tracing import start_tracing, stop_tracing, traced
+
+sm = LazyModule('statsmodels.api')
+plt = LazyModule('matplotlib.pyplot')
+
+def build_lag_features(data, lags, const=True, copy=True):
+    """Add lagged copies of return columns to a tidy data frame.
+
+    All lags of a column are read from a single buffer holding the column
+    once, preceded by as many NaNs as there are lags, and gathered from its
+    sliding windows into one block per column. The windows are read-only
+    strided views of the buffer; with copy=False the lag columns are those
+    views, so n lags of a column cost one copy of it rather than n, but the
+    frame can't be written to, e.g., with .iloc or fillna(inplace=True).
+
+    The result has the columns of data (other than const), then the lags of
+    each column in the order given, named like stock_ret_01, and finally
+    const, so it can be passed to do_linear_regression. The lag numbers of a
+    column have two digits, or as many as its own number of lags needs. Lags
+    keep the dtype of their column.
+
     Arguments:
-        qticker    -- ticker in Quandl format, e.g., "WIKI/WMT"
-        start_date -- first date to retrieve (default "2016-01-01")
-        end_date   -- last date to retrieve (default "2016-12-31")
-        cache      -- True if local cache should be used (default False)
+        data  -- a tidy DataFrame, with columns stock_ret, bench_ret, ...
+        lags  -- dict of column name to number of lags, e.g., {'stock_ret': 60, 'bench_ret': 5}
+        const -- add the const column, rather than leave the intercept implicit (default True)
+        copy  -- copy the lags into writable blocks, rather than keep the views (default True)
     """
-    base, ticker = qticker.split("/")
-    fname = os.path.join("..", "data", "cache", ticker + ".csv")
-    if cache and os.path.isfile(fname):
-        data = pd.read_csv(fname, index_col=0)
-        return data
-    data = quandl.get(qticker,
-                      start_date=start_date, end_date=end_date)
-    data.to_csv(fname)
-    return data
-
-wmt = get_data_from_quandl("WIKI/WMT", cache=True)
-sp500 = get_data_from_quandl("YAHOO/INDEX_GSPC", cache=True)
-
-def tidy_data(stock, benchmark):
+    frames = [data[[col for col in data.columns if col != 'const']]]
+    for col, nlags in lags.items():
+        if nlags == 0:
+            continue
+        # Padded per column, so the names of one column don't depend on the lags of another
+        width = max(2, len(str(nlags)))
+        buf = np.empty(len(data) + nlags, dtype=data[col].dtype)
+        buf[:nlags] = np.nan
+        buf[nlags:] = data[col].values
+        # Row t of windows is buf[t:t + nlags + 1], so column nlags - k is the lag k value
+        windows = np.lib.stride_tricks.sliding_window_view(buf, nlags + 1)
+        names = [ '%s_%0*d' % (col, width, k) for k in range(1, nlags + 1) ]
+        block = np.array(windows[:, nlags - 1::-1]) if copy else windows[:, nlags - 1::-1]
+        frames.append(pd.DataFrame(block, index=data.index,
+                                   columns=names, copy=False))
+    df = pd.concat(frames, axis=1)
+    if const:
+        df['const'] = 1
+    return df
+
+@traced('tidy')
+def tidy_data(stock, benchmark, lags=10, bench_lags=0, dtype=None, log=False, const=True):
     """Create a tidy data frame that we can use for liner regression.
     
     The data frame will have the following columns:
         stock_ret    -- 1 day return of the stock of interest (y, or dependent variable)
         bench_ret    -- 1 day return of the benchmark index (x, or independent variable)
-        stock_ret_01 -- 1 day return of the benchmark index 1 day ago
-        stock_ret_02 -- 1 day return of the benchmark index 2 days ago
+        stock_ret_01 -- 1 day return of the stock of interest 1 day ago
+        stock_ret_02 -- 1 day return of the stock of interest 2 days ago
         ...
-        stock_ret_10 -- 1 day return of the benchmark index 10 days ago
-        const        -- constant column of all ones
+        stock_ret_10 -- 1 day return of the stock of interest 10 days ago
+        bench_ret_01 -- 1 day return of the benchmark index 1 day ago (only if bench_lags > 0)
+        ...
+        const        -- constant column of all ones (only if const)
+
+    The returns are computed by compute_returns straight into the columns of
+    one block of dtype, and their lags keep that dtype. For long series,
+    dtype=np.float32 and const=False halve the size of the frame;
+    do_linear_regression then adds the intercept itself. Fits from float32
+    returns agree with the float64 ones to about 1e-6 relative.
     
     Arguments:
-        stock     -- DataFrame of the stock of interest, must have 'Adj. Close' column
-        benchmark -- DataFrame of the benchmark index, must have 'Adjusted Close' column
+        stock      -- DataFrame of the stock of interest, must have 'Adj. Close' column
+        benchmark  -- DataFrame of the benchmark index, must have 'Adjusted Close' column
+        lags       -- number of lagged stock returns (default 10)
+        bench_lags -- number of lagged benchmark returns (default 0)
+        dtype      -- float type of the returns, e.g., np.float32 (default float64)
+        log        -- compute log returns instead of simple returns (default False)
+        const      -- add the const column, rather than leave the intercept implicit (default True)
     
     Note: The 'Adj.' vs. 'Adjusted' convention preserves the Quandl naming convention
     for WIKI stock database, vs. YAHOO index database
     """
-    def compute_returns(s):
-        """Compute 1-day returns of a time series of non-negative values.
-        
-        Arguments:
-            s -- a Series of raw data
-        """
-        today, yesterday = s, s.shift(1)
-        return (today - yesterday) / yesterday
-        
-    df = pd.DataFrame(index=stock.index)    
-    df['stock_ret'] = compute_returns(stock['Adj. Close'])
-    df['bench_ret'] = compute_returns(benchmark['Adjusted Close'])
-    df['stock_ret_01'] = df['stock_ret'].shift(1)
-    df['stock_ret_02'] = df['stock_ret'].shift(2)
-    df['stock_ret_03'] = df['stock_ret'].shift(3)
-    df['stock_ret_04'] = df['stock_ret'].shift(4)
-    df['stock_ret_05'] = df['stock_ret'].shift(5)
-    df['stock_ret_06'] = df['stock_ret'].shift(6)
-    df['stock_ret_07'] = df['stock_ret'].shift(7)
-    df['stock_ret_08'] = df['stock_ret'].shift(8)
-    df['stock_ret_09'] = df['stock_ret'].shift(9)
-    df['stock_ret_10'] = df['stock_ret'].shift(10)
-    df['const'] = 1
-    return df
-
-tidy_data = tidy_data(wmt, sp500)
-tidy_data.to_csv(os.path.join("..", "data", "wmt-sp500.csv"))
-
-def find_correlations(data):
+    block = np.empty((len(stock), 2), dtype=dtype or np.float64, order='F')
+    compute_returns(stock['Adj. Close'], log, out=block[:, 0])
+    if benchmark.index.equals(stock.index):
+        compute_returns(benchmark['Adjusted Close'], log, out=block[:, 1])
+    else:
+        # Returns are computed on the dates of the benchmark, then aligned
+        bench_ret = compute_returns(benchmark['Adjusted Close'], log)
+        block[:, 1] = pd.Series(bench_ret, index=benchmark.index).reindex(stock.index).values
+    df = pd.DataFrame(block, index=stock.index, columns=['stock_ret', 'bench_ret'], copy=False)
+    return build_lag_features(df, {'stock_ret': lags, 'bench_ret': bench_lags}, const=const)
+
+@traced('tidy')
+def find_correlations(data, columns=None):
     """Find the correlations of the dependent column against each of the independent columns.
 
+    All correlations come out of one set of matrix products. As with
+    Series.corr, each one uses the rows where both columns are present.
+
     Arguments:
         data     -- a tidy DataFrame, with independent column stock_ret
+        columns  -- names of the columns to correlate with stock_ret (default all others)
     """
-    index = [ col for col in data.columns.values if col != "stock_ret" ]
-    s = pd.Series(index=index)
-    for col in index:
-        s[col] = data['stock_ret'].corr(data[col])
-    return s
+    if columns is None:
+        columns = [ col for col in data.columns.values if col != "stock_ret" ]
+    X = data[columns].values.astype(float)
+    y = data['stock_ret'].values.astype(float)
+    # Correlation does not change under a shift, and removing the means first
+    # keeps the sums of squares below from cancelling
+    X = X - np.nanmean(X, axis=0)
+    y = y - np.nanmean(y)
+    mask = ~np.isnan(X) & ~np.isnan(y)[:, None]
+    X0 = np.where(mask, X, 0.0)
+    Y0 = np.where(mask, y[:, None], 0.0)
+    n = mask.sum(axis=0)
+    sx, sy = X0.sum(axis=0), Y0.sum(axis=0)
+    sxx, syy, sxy = (X0 * X0).sum(axis=0), (Y0 * Y0).sum(axis=0), (X0 * Y0).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+    return pd.Series(corr, index=columns)
+
+def find_autocorrelations(returns, nlags):
+    """Find the autocorrelations of return series up to nlags days, for many tickers at once.
+
+    The lagged cross-products of every column come from one FFT, so the
+    cost grows with n log n rather than with n times nlags. NaNs are left
+    out: each lag is normalized by the number of pairs where both days are
+    present, which for complete series is the adjusted (n - k) estimate.
+
+    Returns a DataFrame indexed by lag 1..nlags, with one column per ticker;
+    each column can be passed to visualize_correlogram.
 
-correlations = find_correlations(tidy_data)
+    Arguments:
+        returns -- a DataFrame of 1 day returns, one column per ticker
+        nlags   -- number of lags to compute
+    """
+    values = returns.values.astype(float)
+    mask = ~np.isnan(values)
+    x = np.where(mask, values - np.nanmean(values, axis=0), 0.0)
+    n = len(values)
+    nfft = 1 << int(2 * n - 1).bit_length()
+    fx = np.fft.rfft(x, nfft, axis=0)
+    fm = np.fft.rfft(mask.astype(float), nfft, axis=0)
+    acov = np.fft.irfft(fx * np.conj(fx), nfft, axis=0)[:nlags + 1]
+    pairs = np.round(np.fft.irfft(fm * np.conj(fm), nfft, axis=0)[:nlags + 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        acov = acov / pairs
+        acf = acov[1:] / acov[0]
+    return pd.DataFrame(acf, index=pd.RangeIndex(1, nlags + 1, name='lag'),
+                        columns=returns.columns)
 
 def visualize_correlogram(correlations, stock):
     """Create a correlogram plot for each independent variable
@@ -121,11 +197,6 @@ def visualize_correlogram(correlations, stock):
     plt.xticks(xs, correlations.axes[0].tolist(), rotation=45, ha='right')
     plt.subplots_adjust(bottom=0.25)
 
-
-visualize_correlogram(correlations, 'WMT')
-plt.savefig(os.path.join("..", 'img', 'correlogram.png'))
-
-
 def visualize_data(data, stock, benchmark, axis_low=-0.1, axis_high=0.1, x='bench_ret'):
     """Create a scatter plot of the stock returns vs. the benchmark returns.
     
@@ -137,36 +208,365 @@ def visualize_data(data, stock, benchmark, axis_low=-0.1, axis_high=0.1, x='benc
         axis_high -- highest value for x and y axes (default 0.1)
         x         -- name of independent column (default 'bench_ret')
     """
-    ax = data.plot(kind='scatter', x=x, y='stock_ret',
-                   title='1-Day Returns',
-                   xlim=(axis_low, axis_high), ylim=(axis_low, axis_high))
+    ax = plot_scatter(data, x=x, y='stock_ret',
+                      title='1-Day Returns',
+                      xlim=(axis_low, axis_high), ylim=(axis_low, axis_high))
     ax.set_xlabel(benchmark)
     ax.set_ylabel(stock)
     ax.set_aspect(1)
 
-visualize_data(tidy_data, 'WMT', 'WMT (1 day ago)', axis_low=-0.075, axis_high=0.075, x='stock_ret_01')
-plt.savefig(os.path.join("..", 'img', 'scatter-plot.png'))
-
-
+@traced('fit')
 def do_linear_regression(data):
     """Perform a linear regression for stock_ret based on bench_ret and const of the DataFrame.
+
+    Without a const column, the intercept is added by masked_design.
     
     Arguments:
-        data      -- a tidy DataFrame, with columns stock_ret, bench_ret, and const
+        data      -- a tidy DataFrame, with columns stock_ret, bench_ret, and const (optional)
     """
     index = [ col for col in data.columns.values if col != "stock_ret" ]
+    if 'const' not in data:
+        return sm.OLS(*masked_design(data, 'stock_ret', index)).fit()
     model = sm.OLS(data['stock_ret'], 
                    data[index],
                    missing='drop')
     fit = model.fit()
     return fit
 
-fit = do_linear_regression(tidy_data)
-print(fit.summary())
+def cholesky_update(L, x, sign=1.0):
+    """Update a Cholesky factor in place for a rank-one change of its matrix.
+
+    Turns the lower triangular factor L of G into that of G + sign * x x',
+    in O(p^2). Returns False if a downdate (sign -1) would leave the matrix
+    without a Cholesky factor, in which case L must be rebuilt.
+
+    Arguments:
+        L    -- lower triangular Cholesky factor, updated in place
+        x    -- vector of the rank-one change
+        sign -- 1.0 to add x x' (update), -1.0 to remove it (downdate) (default 1.0)
+    """
+    x = np.array(x, dtype=float)
+    for k in range(len(x)):
+        r2 = L[k, k] * L[k, k] + sign * x[k] * x[k]
+        if r2 <= 0:
+            return False
+        r = np.sqrt(r2)
+        c, s = r / L[k, k], x[k] / L[k, k]
+        L[k, k] = r
+        L[k + 1:, k] = (L[k + 1:, k] + sign * s * x[k + 1:]) / c
+        x[k + 1:] = c * x[k + 1:] - s * L[k + 1:, k]
+    return True
+
+@traced('fit')
+def walk_forward_backtest(data, window=None, min_train=60):
+    """Backtest the regression of do_linear_regression out of sample, one day at a time.
+
+    Each day's stock_ret is predicted from a fit of the days before it only:
+    all of them (expanding) or the last `window` days (rolling). Instead of a
+    refit per day, the Cholesky factor of X'X is updated with the day that
+    enters and downdated with the day that leaves the training set. If a
+    downdate breaks down numerically, the factor is rebuilt from the running
+    X'X.
+
+    Returns a DataFrame on the index of data with columns prediction, actual,
+    error and the running out-of-sample rmse, mae and hit_rate (share of days
+    where the sign was predicted right).
+
+    Arguments:
+        data      -- a tidy DataFrame, with column stock_ret and the predictor columns
+        window    -- number of days in the rolling training set, or None to expand (default None)
+        min_train -- fewest training observations before predicting (default 60)
+    """
+    import scipy.linalg
+    index = [ col for col in data.columns.values if col != "stock_ret" ]
+    X = data[index].values.astype(float)
+    y = data['stock_ret'].values.astype(float)
+    has_x = ~np.isnan(X).any(axis=1)
+    valid = has_x & ~np.isnan(y)
+    p = len(index)
+    gram, xty = np.zeros((p, p)), np.zeros(p)
+    L, theta, ntrain = None, None, 0
+    preds = np.full(len(y), np.nan)
+    for t in range(len(y)):
+        if theta is not None and ntrain >= min_train and has_x[t]:
+            preds[t] = X[t].dot(theta)
+        changes = [(t, 1.0)]
+        if window is not None and t >= window:
+            changes.append((t - window, -1.0))
+        changed = False
+        for i, sign in changes:
+            if not valid[i]:
+                continue
+            changed = True
+            gram += sign * np.outer(X[i], X[i])
+            xty += sign * X[i] * y[i]
+            ntrain += int(sign)
+            if L is not None and not cholesky_update(L, X[i], sign):
+                L = None
+        if not changed:
+            continue
+        if L is None and ntrain >= p:
+            try:
+                L = np.linalg.cholesky(gram)
+            except np.linalg.LinAlgError:
+                L = None
+        theta = None if L is None else scipy.linalg.cho_solve((L, True), xty)
+
+    error = y - preds
+    scored = ~np.isnan(error)
+    count = np.cumsum(scored)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        rmse = np.sqrt(np.cumsum(np.where(scored, error * error, 0.0)) / count)
+        mae = np.cumsum(np.where(scored, np.abs(error), 0.0)) / count
+        hit_rate = np.cumsum(scored & (np.sign(preds) == np.sign(y))) / count
+    return pd.DataFrame({'prediction': preds, 'actual': y, 'error': error,
+                         'rmse': rmse, 'mae': mae, 'hit_rate': hit_rate},
+                        index=data.index,
+                        columns=['prediction', 'actual', 'error', 'rmse', 'mae', 'hit_rate'])
+
+@traced('fit')
+def walk_forward_backtest_universe(datasets, window=None, min_train=60, max_workers=None):
+    """Run walk_forward_backtest for many tickers in parallel, one process per core.
+
+    Returns a dict of ticker to the per-day backtest, and a DataFrame indexed
+    by ticker with the final rmse, mae and hit_rate and the number of days
+    predicted.
+
+    Arguments:
+        datasets    -- dict of ticker to tidy DataFrame, as taken by walk_forward_backtest
+        window      -- number of days in the rolling training set, or None to expand (default None)
+        min_train   -- fewest training observations before predicting (default 60)
+        max_workers -- number of processes (default the number of cores)
+    """
+    # The workers are forked rather than spawned, because this file may
+    # be loaded by path and could not be imported again by a new process
+    context = multiprocessing.get_context("fork")
+    tickers = sorted(datasets)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+        futures = [ executor.submit(walk_forward_backtest, datasets[ticker], window, min_train)
+                    for ticker in tickers ]
+        results = dict(zip(tickers, [ future.result() for future in futures ]))
+    summary = pd.DataFrame([ results[ticker][['rmse', 'mae', 'hit_rate']].iloc[-1]
+                             for ticker in tickers ], index=tickers)
+    summary['days'] = [ results[ticker]['prediction'].notnull().sum() for ticker in tickers ]
+    return results, summary
+
+def selection_criterion(ssr, k, setting):
+    """Return a model selection criterion for fits with the given residual sums of squares; lower is better.
+
+    The 'aic' and 'bic' values are those statsmodels reports for OLS; 'adjr2'
+    is minus the adjusted R^2.
 
-tidy_data2 = tidy_data[['stock_ret', 'bench_ret', 'stock_ret_01', 'const']]
-fit2 = do_linear_regression(tidy_data2)
-print(fit2.summary())
+    Arguments:
+        ssr     -- residual sum of squares, a number or an array
+        k       -- number of coefficients, including the constant
+        setting -- dict with the number of observations n, the centered total sum
+                   of squares tss and the criterion name
+    """
+    n = setting['n']
+    if setting['criterion'] == 'adjr2':
+        return (n - 1.0) / (n - k) * ssr / setting['tss'] - 1.0
+    with np.errstate(divide='ignore'):
+        llf = -n / 2.0 * (np.log(2 * np.pi) + np.log(ssr / n) + 1)
+    penalty = 2.0 * k if setting['criterion'] == 'aic' else k * np.log(n)
+    return -2 * llf + penalty
+
+def sweep_out(C, j):
+    """Bring predictor j into the model of a residual Gram matrix.
+
+    C is the Gram matrix of the predictors not in the model and the response
+    (last row and column), after regressing out the predictors in the model;
+    C[-1, -1] is then the residual sum of squares. Regressing out predictor j
+    as well is a rank-one update, the same step as one column of a Cholesky
+    factorization, and costs O(m^2).
+
+    Arguments:
+        C -- residual Gram matrix, with the response last
+        j -- position of the predictor in C
+    """
+    keep = [ i for i in range(len(C)) if i != j ]
+    c = C[keep, j]
+    return C[np.ix_(keep, keep)] - np.outer(c, c) / C[j, j]
+
+def branch_and_bound_subsets(C, labels, included, setting, best):
+    """Find the best subset of predictors below a node of the subset search tree.
+
+    Each node decides whether the first undecided predictor goes in or out.
+    A subtree is skipped when even the residual sum of squares of all its
+    undecided predictors, with the penalty of the smallest model it can add,
+    cannot beat the best subset found so far.
+
+    Returns the (criterion value, column list) of the best subset.
+
+    Arguments:
+        C        -- residual Gram matrix of the undecided predictors and the response, as for sweep_out
+        labels   -- names of the undecided predictors, in the order of C
+        included -- names of the predictors already in the model
+        setting  -- dict as for selection_criterion, plus diag, the diagonal of the full Gram matrix by name
+        best     -- (criterion value, column list) of the best subset found so far
+    """
+    if not labels:
+        return best
+    k = len(included)
+    coef = np.linalg.lstsq(C[:-1, :-1], C[:-1, -1], rcond=None)[0]
+    ssr_all = C[-1, -1] - C[:-1, -1].dot(coef)
+    if selection_criterion(ssr_all, k + 1, setting) >= best[0]:
+        return best
+    if C[0, 0] > 1e-10 * setting['diag'][labels[0]]:
+        C_in = sweep_out(C, 0)
+        value = selection_criterion(C_in[-1, -1], k + 1, setting)
+        if value < best[0]:
+            best = (value, included + [labels[0]])
+        best = branch_and_bound_subsets(C_in, labels[1:], included + [labels[0]], setting, best)
+    return branch_and_bound_subsets(C[1:, 1:], labels[1:], included, setting, best)
+
+@traced('fit')
+def select_features(data, criterion='bic', method='best', keep=('const',), max_workers=None):
+    """Choose the predictor columns of a tidy data frame by AIC, BIC or adjusted R^2.
+
+    The Gram matrix of the predictors and stock_ret is computed once, over
+    the rows where all of them are present, and no candidate model is ever
+    refit. Forward stepwise brings a column in with a rank-one update of the
+    residual Gram matrix, and scores every candidate at once from it.
+    Backward stepwise drops a column with a rank-one downdate of the inverse
+    Gram matrix, again scoring every candidate at once. Best subset runs a
+    branch and bound search, seeded with the forward stepwise result, whose
+    top subtrees are searched in parallel processes.
+
+    Without a const column, the intercept that do_linear_regression adds is
+    in every model searched as well, though not in the returned columns.
+
+    Returns the chosen column list, in the order of data, and its fit by
+    do_linear_regression.
+
+    Arguments:
+        data        -- a tidy DataFrame, with column stock_ret and the candidate columns
+        criterion   -- 'aic', 'bic' or 'adjr2' (default 'bic')
+        method      -- 'best', 'forward' or 'backward' (default 'best')
+        keep        -- columns that are always in the model (default ('const',))
+        max_workers -- number of processes for the best subset search (default the number of cores)
+    """
+    if criterion not in ('aic', 'bic', 'adjr2'):
+        raise ValueError("unknown criterion %r" % criterion)
+    if method not in ('best', 'forward', 'backward'):
+        raise ValueError("unknown method %r" % method)
+    index = [ col for col in data.columns.values if col != "stock_ret" ]
+    keep = [ col for col in index if col in keep ]
+    candidates = [ col for col in index if col not in keep ]
+    if 'const' not in index:
+        # do_linear_regression fits an intercept anyway, so every model searched has one
+        keep.append('const')
+        data = data.assign(const=1.0)
+    Z = data[keep + candidates + ['stock_ret']].dropna().values.astype(float)
+    G = Z.T.dot(Z)
+    y = Z[:, -1]
+    setting = {'n': len(Z), 'tss': ((y - y.mean()) ** 2).sum(), 'criterion': criterion,
+               'diag': dict(zip(keep + candidates, np.diag(G)))}
+
+    if method == 'backward':
+        p = len(keep) + len(candidates)
+        included = keep + candidates
+        G_inv = np.linalg.inv(G[:p, :p])
+        theta = G_inv.dot(G[:p, -1])
+        ssr = G[-1, -1] - G[:p, -1].dot(theta)
+        current = selection_criterion(ssr, len(included), setting)
+        while len(included) > len(keep):
+            # Dropping column j raises the SSR by theta_j^2 / (X'X)^-1_jj
+            droppable = np.arange(len(keep), len(included))
+            ssr_new = ssr + theta[droppable] ** 2 / np.diag(G_inv)[droppable]
+            values = selection_criterion(ssr_new, len(included) - 1, setting)
+            best_j = np.argmin(values)
+            if values[best_j] >= current:
+                break
+            j = droppable[best_j]
+            rest = [ i for i in range(len(included)) if i != j ]
+            theta = theta[rest] - G_inv[rest, j] * theta[j] / G_inv[j, j]
+            G_inv = G_inv[np.ix_(rest, rest)] - np.outer(G_inv[rest, j], G_inv[j, rest]) / G_inv[j, j]
+            ssr, current = ssr_new[best_j], values[best_j]
+            del included[j]
+    else:
+        C = G
+        for i in range(len(keep)):
+            C = sweep_out(C, 0)
+        labels = list(candidates)
+        included = list(keep)
+        current = selection_criterion(C[-1, -1], len(included), setting)
+        while labels:
+            d = np.diag(C)[:-1]
+            usable = d > 1e-10 * np.array([ setting['diag'][col] for col in labels ])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ssr_new = np.where(usable, C[-1, -1] - C[:-1, -1] ** 2 / d, np.inf)
+            values = selection_criterion(ssr_new, len(included) + 1, setting)
+            j = np.argmin(values)
+            if values[j] >= current:
+                break
+            C = sweep_out(C, j)
+            included.append(labels.pop(j))
+            current = values[j]
+
+        if method == 'best':
+            best = (current, included)
+            C = G
+            for i in range(len(keep)):
+                C = sweep_out(C, 0)
+            # Strong predictors first, so good subsets are found early and prune more
+            order = np.argsort(-(C[:-1, -1] ** 2 / np.maximum(np.diag(C)[:-1], 1e-300)))
+            C = C[np.ix_(list(order) + [len(C) - 1], list(order) + [len(C) - 1])]
+            nodes = [ (C, [ candidates[i] for i in order ], list(keep)) ]
+            for level in range(min(3, len(candidates))):
+                expanded = []
+                for C, labels, inc in nodes:
+                    if C[0, 0] > 1e-10 * setting['diag'][labels[0]]:
+                        C_in = sweep_out(C, 0)
+                        value = selection_criterion(C_in[-1, -1], len(inc) + 1, setting)
+                        if value < best[0]:
+                            best = (value, inc + [labels[0]])
+                        expanded.append((C_in, labels[1:], inc + [labels[0]]))
+                    expanded.append((C[1:, 1:], labels[1:], inc))
+                nodes = expanded
+            # The workers are forked rather than spawned, because this file may
+            # be loaded by path and could not be imported again by a new process
+            context = multiprocessing.get_context("fork")
+            with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as executor:
+                futures = [ executor.submit(branch_and_bound_subsets, C, labels, inc, setting, best)
+                            for C, labels, inc in nodes ]
+                best = min([ future.result() for future in futures ] + [best], key=lambda b: b[0])
+            included = best[1]
+
+    columns = [ col for col in index if col in included ]
+    return columns, do_linear_regression(data[['stock_ret'] + columns])
+
+@traced('predict')
+def predict_batch(fit, values, interval=None, alpha=0.05):
+    """Predict the response for a whole grid or batch of predictor values with one matrix product.
+
+    The values of each predictor are broadcast against each other, so a
+    meshgrid, a vector and a scalar can be mixed; predictors that are not
+    given are taken to be 0. The predictions have the broadcast shape.
+
+    With interval 'confidence' (for the mean response) or 'prediction' (for
+    a new observation), also returns the lower and upper bounds of the
+    1 - alpha interval. Pass a PredictionIntervals instead of the fit to
+    reuse its covariance factor across calls.
+
+    Arguments:
+        fit      -- a linear regression result, or its PredictionIntervals
+        values   -- dict of predictor name to a scalar or array of values, or of column
+                    position for a fit on an ndarray, whose params have no names
+        interval -- None, 'confidence' or 'prediction' (default None)
+        alpha    -- significance level of the interval (default 0.05)
+    """
+    if interval not in (None, 'confidence', 'prediction'):
+        raise ValueError("unknown interval %r" % interval)
+    intervals = fit if isinstance(fit, PredictionIntervals) else PredictionIntervals(fit)
+    names = intervals.names if intervals.names is not None else range(len(intervals.params))
+    arrays = np.broadcast_arrays(*[ np.asarray(values.get(name, 0.0), dtype=float)
+                                    for name in names ])
+    shape = arrays[0].shape
+    X = np.column_stack([ a.ravel() for a in arrays ])
+    if interval is None:
+        return intervals.predict(X).reshape(shape)
+    return tuple(a.reshape(shape) for a in intervals.predict(X, interval, alpha))
 
 def visualize_3d_fit(data, fit, stock, benchmark, x1='bench_ret', x2='stock_ret_01'):
     """Create a scatter plot of the stock returns vs. the benchmark returns.
@@ -179,25 +579,22 @@ def visualize_3d_fit(data, fit, stock, benchmark, x1='bench_ret', x2='stock_ret_
         x1        -- name of independent column #1 (default 'bench_ret')
         x2        -- name of independent column #2 (default 'bench_ret')
     """
+    from mpl_toolkits.mplot3d import Axes3D  # registers the '3d' projection
     fig = plt.figure()
     ax = fig.add_subplot(111, projection='3d')
     ax.scatter(data['stock_ret'], data[x1], data[x2])
     xmin, xmax = ax.get_xlim()
     ymin, ymax = ax.get_ylim()
-    xs = pd.np.arange(xmin, xmax, 0.01)
-    ys = pd.np.arange(ymin, ymax, 0.01)
-    xs, ys = pd.np.meshgrid(xs, ys)
-    vfn = pd.np.vectorize(lambda x, y: x*fit.params[x1] + y*fit.params[x2] + fit.params['const'])
-    zs = vfn(xs, ys)
+    xs = np.arange(xmin, xmax, 0.01)
+    ys = np.arange(ymin, ymax, 0.01)
+    xs, ys = np.meshgrid(xs, ys)
+    zs = predict_batch(fit, {x1: xs, x2: ys, 'const': 1})
     ax.plot_surface(xs, ys, zs, color='r', alpha=0.2)
     fig.suptitle('1-Day Returns of ' + stock)
     ax.set_xlabel(benchmark)
     ax.set_ylabel(stock + ' (previous)')
     ax.set_zlabel(stock)
 
-visualize_3d_fit(tidy_data2, fit2, "WMT", "S&P 500", x1='bench_ret', x2='stock_ret_01')
-plt.savefig(os.path.join("..", 'img', 'scatter-plot-3d.png'))
-
 def visualize_single_parameter(data, fit, stock, benchmark, x='bench_ret'):
     """Create a scatter plot and linear model of the stock returns vs. a single parameter.
     
@@ -208,26 +605,17 @@ def visualize_single_parameter(data, fit, stock, benchmark, x='bench_ret'):
         benchmark -- name of the benchmark index
         x         -- name of independent column to display (default 'bench_ret')
     """
-    ax = data.plot(kind='scatter', x=x, y='stock_ret',
-                   title='1-Day Returns')
+    ax = plot_scatter(data, x=x, y='stock_ret',
+                      title='1-Day Returns')
     index = [ col for col in data.columns.values if col != "stock_ret" ]
-    X_new = pd.DataFrame({})
-    for col in index:
-        mid = (data[col].min() + data[col].max()) / 2.0
-        X_new[col] = [mid, mid]
-    X_new[x] = ax.get_xlim()
-
-    preds = fit.predict(X_new)
-    plt.plot(X_new[x], preds, 'r-')
+    values = dict((col, (data[col].min() + data[col].max()) / 2.0) for col in index)
+    values[x] = np.array(ax.get_xlim())
+
+    preds = predict_batch(fit, values)
+    plt.plot(values[x], preds, 'r-')
     ax.set_xlabel(benchmark)
     ax.set_ylabel(stock)
 
-visualize_single_parameter(tidy_data2, fit2, "WMT", "S&P 500", x='bench_ret')
-plt.savefig(os.path.join("..", 'img', 'lr-single-bench-rest-avg.png'))
-
-visualize_single_parameter(tidy_data2, fit2, "WMT", "WMT (previous)", x='stock_ret_01')
-plt.savefig(os.path.join("..", 'img', 'lr-single-yesterday-rest-avg.png'))
-
 def visualize_single_isolated_parameter(data, fit, stock, benchmark, x='bench_ret'):
     """Create a scatter plot and linear model of the stock returns vs. a single parameter
     after accounting for the others.
@@ -241,27 +629,92 @@ def visualize_single_isolated_parameter(data, fit, stock, benchmark, x='bench_re
     """
     index = [ col for col in data.columns.values if col != "stock_ret" ]
 
-    X_new = pd.DataFrame({})
-    for col in index:
-        X_new[col] = data[col]
-    X_new[x] = 0
-    X_new['stock_ret'] = data['stock_ret'] - fit.predict(X_new)
-    X_new[x] = data[x]
-    ax = X_new.plot(kind='scatter', x=x, y='stock_ret',
-                    title='1-Day Returns')
-
-    X_new = pd.DataFrame({})
-    for col in index:
-        X_new[col] = [0, 0]
-    X_new[x] = ax.get_xlim()
-    preds = fit.predict(X_new)
-    plt.plot(X_new[x], preds, 'r-')
+    values = dict((col, data[col].values) for col in index)
+    values[x] = 0
+    X_new = pd.DataFrame({x: data[x],
+                          'stock_ret': data['stock_ret'] - predict_batch(fit, values)})
+    ax = plot_scatter(X_new, x=x, y='stock_ret',
+                      title='1-Day Returns')
+
+    xs = np.array(ax.get_xlim())
+    preds = predict_batch(fit, {x: xs})
+    plt.plot(xs, preds, 'r-')
 
     ax.set_xlabel(benchmark)
     ax.set_ylabel(stock)
 
-visualize_single_isolated_parameter(tidy_data2, fit2, "WMT", "S&P 500", x='bench_ret')
-plt.savefig(os.path.join("..", 'img', 'lr-isolated-bench-rest-avg.png'))
+def main():
+    """Predict the 1-day returns of WMT from lagged returns and the S&P 500, and draw the figures.
+
+    Returns the exit status, 1 if some market data could not be retrieved.
+    """
+    figures = []
+
+    migrate_csv_cache()
+    market_data, failures = get_bulk_data_from_quandl(["WIKI/WMT", "YAHOO/INDEX_GSPC"], cache=True)
+    if failures:
+        for qticker, e in sorted(failures.items()):
+            print("%s: %s" % (qticker, e), file=sys.stderr)
+        return 1
+    wmt = market_data["WIKI/WMT"]
+    sp500 = market_data["YAHOO/INDEX_GSPC"]
+
+    returns = tidy_data(wmt, sp500)
+    returns.to_csv(os.path.join("..", "data", "wmt-sp500.csv"))
+
+    correlations = find_correlations(returns)
+
+    figures.append(figure_task(os.path.join("..", 'img', 'correlogram.png'),
+                               visualize_correlogram, correlations, 'WMT'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'scatter-plot.png'),
+                               visualize_data, returns, 'WMT', 'WMT (1 day ago)', axis_low=-0.075, axis_high=0.075, x='stock_ret_01'))
+
+    fit = do_linear_regression(returns)
+    print(fit.summary())
+
+    returns2 = returns[['stock_ret', 'bench_ret', 'stock_ret_01', 'const']]
+    fit2 = do_linear_regression(returns2)
+    print(fit2.summary())
+
+    online_fit2 = RecursiveLeastSquares(['bench_ret', 'stock_ret_01', 'const'])
+    for date, row in returns2.iterrows():
+        online_fit2.update(row, row['stock_ret'])
+    print(online_fit2.params)
+
+    backtest = walk_forward_backtest(returns2, window=120)
+    print(backtest.tail())
+
+    selected_columns, fit3 = select_features(returns, criterion='bic')
+    print(selected_columns)
+
+    figures.append(figure_task(os.path.join("..", 'img', 'scatter-plot-3d.png'),
+                               visualize_3d_fit, returns2, fit2, "WMT", "S&P 500", x1='bench_ret', x2='stock_ret_01'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'lr-single-bench-rest-avg.png'),
+                               visualize_single_parameter, returns2, fit2, "WMT", "S&P 500", x='bench_ret'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'lr-single-yesterday-rest-avg.png'),
+                               visualize_single_parameter, returns2, fit2, "WMT", "WMT (previous)", x='stock_ret_01'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'lr-isolated-bench-rest-avg.png'),
+                               visualize_single_isolated_parameter, returns2, fit2, "WMT", "S&P 500", x='bench_ret'))
+
+    figures.append(figure_task(os.path.join("..", 'img', 'lr-isolated-yesterday-rest-avg.png'),
+                               visualize_single_isolated_parameter, returns2, fit2, "WMT", "WMT (previous)", x='stock_ret_01'))
+
+    figure_times = build_figures(figures)
+    print(figure_times)
+    return 0
 
-visualize_single_isolated_parameter(tidy_data2, fit2, "WMT", "WMT (previous)", x='stock_ret_01')
-plt.savefig(os.path.join("..", 'img', 'lr-isolated-yesterday-rest-avg.png'))
+if __name__ == "__main__":
+    # Set REGRESSION_TRACE to a file name to record the stages of the run
+    trace_file = os.environ.get("REGRESSION_TRACE")
+    if trace_file:
+        start_tracing()
+    status = main()
+    if trace_file:
+        tracer = stop_tracing()
+        tracer.write_chrome_trace(trace_file)
+        print(tracer.summary().to_string())
+    sys.exit(status)
@@ -7,15 +7,35 @@ The actual example is to fit the growth of the federal budget over 50 years.
 """
 
 import os.path
+import sys
 import math
+import numpy as np
 import pandas as pd
-import statsmodels.api as sm
-import matplotlib.pyplot as plt
 
-from statsmodels.sandbox.regression.predstd \
-    import wls_prediction_std
+# The code shared by the examples lives in the regression package, at the
+# root of the repository
+_root = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", ".."))
+if _root not in sys.path:
+    sys.path.insert(0, _root)
 
-data = pd.read_csv("us-federal-debt.csv", sep=",\s*", engine='python')
+from regression.figures import build_figures, figure_task
+from regression.intervals import PredictionIntervals
+from regression.lazy import LazyModule
+from regression.online import RecursiveLeastSquares
+
+sm = LazyModule('statsmodels.api')
+plt = LazyModule('matplotlib.pyplot')
+
+def monomial_basis(x, degree):
+    """Return the powers of x as the columns x0 (all 1s), x1, ..., x<degree> of a DataFrame.
+
+    Arguments:
+        x      -- a Series or array of predictor values
+        degree -- highest power
+    """
+    x = np.asarray(x, dtype=float)
+    return pd.DataFrame(np.vander(x, degree + 1, increasing=True),
+                        columns=[ 'x%d' % i for i in range(degree + 1) ])
 
 def tidy_data(data):
     """Create a tidy data frame that we can use for liner regression.
@@ -33,13 +53,9 @@ def tidy_data(data):
         
     df = pd.DataFrame(index=data.index)
     df['debt'] = data['Debt']
-    df['x0'] = 1
-    df['x1'] = data['Year'] - min(data['Year']) + 1.0
-    df['x2'] = df['x1'] * df['x1']
-    df['x3'] = df['x2'] * df['x1']
-    return df
-
-tidy_data = tidy_data(data)
+    basis = monomial_basis(data['Year'] - min(data['Year']) + 1.0, 3)
+    basis.index = data.index
+    return df.join(basis)
 
 def visualize_data(data):
     """Create a line plot of the debt vs. year.
@@ -52,9 +68,6 @@ def visualize_data(data):
     ax.set_xlabel('Year')
     ax.set_ylabel('Debt')
 
-visualize_data(tidy_data)
-plt.savefig(os.path.join("..", 'line-plot.png'))
-
 def do_linear_regression(data):
     """Perform a linear regression for stock_ret based on bench_ret and const of the DataFrame.
     
@@ -68,9 +81,6 @@ def do_linear_regression(data):
     fit = model.fit()
     return fit
 
-fit = do_linear_regression(tidy_data)
-print(fit.summary())
-
 def visualize_linear_regression(data, fit, show_std=False):
     """Create a line plot and linear model of the response variable ('debt') vs. predictor variable ('x1').
     
@@ -81,25 +91,185 @@ def visualize_linear_regression(data, fit, show_std=False):
     """
     ax = data.plot(kind='line', x='x1', y='debt',
                    title=('US National Debt'))
-    x = pd.np.linspace(min(data['x1']), max(data['x1']))
-    X_new = pd.DataFrame()
-    X_new['x0'] = [1] * len(x)
-    X_new['x1'] = x
-    X_new['x2'] = X_new['x1'] * X_new['x1']
-    X_new['x3'] = X_new['x2'] * X_new['x1']
+    x = np.linspace(min(data['x1']), max(data['x1']))
+    X_new = monomial_basis(x, len(fit.params) - 1)
     preds = fit.predict(X_new)
     plt.plot(x, preds, 'r--')
 
     if show_std:
-        _, lower, upper = wls_prediction_std(fit, X_new)
+        _, lower, upper = PredictionIntervals(fit).predict(X_new, interval='prediction')
         plt.plot(x, lower, 'r:', 
                  x, upper, 'r:')
     ax.set_xlabel('Year')
     ax.set_ylabel('Debt')
 
-visualize_linear_regression(tidy_data, fit)
-plt.savefig(os.path.join("..", 'nonlinear-plot-without-errors.png'))
+def legendre_basis(x, degree, domain):
+    """Return the Legendre polynomials of x as the columns p0, p1, ..., p<degree> of a DataFrame.
+
+    The domain is mapped to [-1, 1] first, where the Legendre polynomials
+    are orthogonal, so the columns stay well conditioned at high degree,
+    unlike powers of x.
+
+    Arguments:
+        x      -- a Series or array of predictor values
+        degree -- highest degree
+        domain -- (low, high) range of x that is mapped to [-1, 1]
+    """
+    low, high = domain
+    t = (2 * np.asarray(x, dtype=float) - (low + high)) / (high - low)
+    return pd.DataFrame(np.polynomial.legendre.legvander(t, degree),
+                        columns=[ 'p%d' % i for i in range(degree + 1) ])
+
+class PolynomialRegression(object):
+    """Least squares polynomial fits of every degree up to max_degree, from one QR factorization.
+
+    With V = QR for the Legendre columns of x, the fit of degree d uses only
+    the first d + 1 columns of Q, so Q'y gives the fitted values, residual
+    sums of squares and coefficients of all degrees at once.
+    """
+
+    def __init__(self, x, y, max_degree):
+        """Fit all degrees up to max_degree.
+
+        Arguments:
+            x          -- a Series or array of predictor values
+            y          -- a Series or array of response values
+            max_degree -- highest degree to fit
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        keep = ~(np.isnan(x) | np.isnan(y))
+        self.x, self.y = x[keep], y[keep]
+        self.max_degree = max_degree
+        self.domain = (self.x.min(), self.x.max())
+        self.q, self.r = np.linalg.qr(legendre_basis(self.x, max_degree, self.domain).values)
+        self.qty = self.q.T.dot(self.y)
+        # Degree d leaves out the Q'y terms above d on top of the residual of the full fit
+        resid = self.y - self.q.dot(self.qty)
+        tail = np.append(np.cumsum((self.qty ** 2)[::-1])[::-1][1:], 0.0)
+        self.ssr = pd.Series(resid.dot(resid) + tail,
+                             index=pd.RangeIndex(0, max_degree + 1, name='degree'))
+
+    def params(self, degree):
+        """Return the Legendre coefficients of the fit of a given degree.
+
+        Arguments:
+            degree -- degree of the fit, at most max_degree
+        """
+        coef = np.linalg.solve(self.r[:degree + 1, :degree + 1], self.qty[:degree + 1])
+        return pd.Series(coef, index=[ 'p%d' % i for i in range(degree + 1) ])
+
+    def predict(self, x, degree=None):
+        """Predict the response at new predictor values.
+
+        Returns an array for one degree, or a DataFrame with one column per
+        degree, all from the same triangular solve.
+
+        Arguments:
+            x      -- a Series or array of predictor values, e.g., a plotting grid
+            degree -- degree of the fit, or None for all degrees (default None)
+        """
+        V = legendre_basis(x, self.max_degree, self.domain).values
+        preds = np.cumsum(np.linalg.solve(self.r.T, V.T).T * self.qty, axis=1)
+        if degree is not None:
+            return preds[:, degree]
+        return pd.DataFrame(preds, columns=self.ssr.index)
+
+    def fit(self, degree):
+        """Return the statsmodels fit of a given degree on the Legendre columns, e.g., for summary().
+
+        Arguments:
+            degree -- degree of the fit, at most max_degree
+        """
+        return sm.OLS(self.y, legendre_basis(self.x, degree, self.domain)).fit()
+
+def cross_validate_polynomial(x, y, max_degree, folds=5, seed=0):
+    """Estimate the prediction error of every polynomial degree up to max_degree by k-fold cross-validation.
+
+    Each fold takes one QR factorization of its training rows and predicts
+    its held-out rows for all degrees at once, as in PolynomialRegression.
+
+    Returns a Series of the mean squared prediction error per degree.
+
+    Arguments:
+        x          -- a Series or array of predictor values
+        y          -- a Series or array of response values
+        max_degree -- highest degree to evaluate
+        folds      -- number of folds (default 5)
+        seed       -- seed of the random assignment of rows to folds (default 0)
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    keep = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[keep], y[keep]
+    V = legendre_basis(x, max_degree, (x.min(), x.max())).values
+    fold = np.random.RandomState(seed).permutation(len(y)) % folds
+    sse = np.zeros(max_degree + 1)
+    for k in range(folds):
+        train, test = fold != k, fold == k
+        q, r = np.linalg.qr(V[train])
+        preds = np.cumsum(np.linalg.solve(r.T, V[test].T).T * q.T.dot(y[train]), axis=1)
+        sse += ((preds - y[test][:, None]) ** 2).sum(axis=0)
+    return pd.Series(sse / len(y), index=pd.RangeIndex(0, max_degree + 1, name='degree'))
+
+def visualize_polynomial_regression(data, poly, degree, show_std=False):
+    """Create a line plot and polynomial model of the response variable ('debt') vs. predictor variable ('x1').
+    
+    Arguments:
+        data      -- a tidy DataFrame, with response column debt and predictor column x1
+        poly      -- a PolynomialRegression of debt on x1
+        degree    -- degree of the polynomial to show
+        show_std  -- whether to show upper and lower bands around answer (default False)
+    """
+    ax = data.plot(kind='line', x='x1', y='debt',
+                   title=('US National Debt'))
+    x = np.linspace(min(data['x1']), max(data['x1']))
+    plt.plot(x, poly.predict(x, degree), 'r--')
+
+    if show_std:
+        _, lower, upper = PredictionIntervals(poly.fit(degree)).predict(legendre_basis(x, degree, poly.domain),
+                                                                         interval='prediction')
+        plt.plot(x, lower, 'r:', 
+                 x, upper, 'r:')
+    ax.set_xlabel('Year')
+    ax.set_ylabel('Debt')
+
+def main():
+    """Fit polynomials to the growth of the federal debt, and draw the figures."""
+    figures = []
+
+    data = pd.read_csv("us-federal-debt.csv", sep=",\s*", engine='python')
+
+    tidy = tidy_data(data)
+
+    figures.append(figure_task(os.path.join("..", 'line-plot.png'),
+                               visualize_data, tidy))
+
+    fit = do_linear_regression(tidy)
+    print(fit.summary())
+
+    online_fit = RecursiveLeastSquares(['x0', 'x1', 'x2', 'x3'])
+    for year, row in tidy.iterrows():
+        online_fit.update(row, row['debt'])
+    print(online_fit.params)
+
+    figures.append(figure_task(os.path.join("..", 'nonlinear-plot-without-errors.png'),
+                               visualize_linear_regression, tidy, fit))
+
+    figures.append(figure_task(os.path.join("..", 'nonlinear-plot-with-errors.png'),
+                               visualize_linear_regression, tidy, fit, show_std=True))
+
+    cv_errors = cross_validate_polynomial(tidy['x1'], tidy['debt'], 8)
+    print(cv_errors)
+    poly = PolynomialRegression(tidy['x1'], tidy['debt'], 8)
+    print(poly.params(cv_errors.idxmin()))
+
+    figures.append(figure_task(os.path.join("..", 'polynomial-plot-with-errors.png'),
+                               visualize_polynomial_regression, tidy, poly, cv_errors.idxmin(),
+                               show_std=True))
 
-visualize_linear_regression(tidy_data, fit, show_std=True)
-plt.savefig(os.path.join("..", 'nonlinear-plot-with-errors.png'))
+    figure_times = build_figures(figures)
+    print(figure_times)
 
+if __name__ == "__main__":
+    main()